@@ -1,13 +1,106 @@
+import asyncio
+
 import streamlit as st
 
-from main import GraChalleInterface
+from common import WARM_UP_ENABLED, get_openai_service
+from job_queue import FAILED, JOB_INPROCESS_CONCURRENCY, JobWorker, get_job_queue
+from main import (
+    EVALUATION_PENDING_MESSAGE,
+    JOB_HANDLERS,
+    GraChalleInterface,
+    start_warm_up,
+)
+from runtime import get_background_loop, run_sync
+from session_store import get_session_store
+from telemetry import start_metrics_server
+
+# 評価ジョブの完了を画面で待つ最大秒数（超えた場合は次の操作・再読み込み時に改めて待つ）
+EVALUATION_WAIT_SECONDS = 120
+
+
+@st.cache_resource
+def get_shared_openai_service():
+    """
+    全セッションで共有するOpenAIServiceを取得する（Streamlitのリソースキャッシュで保持）
+    """
+    return get_openai_service()
+
+
+@st.cache_resource
+def get_metrics_server():
+    """
+    Prometheusのスクレイプ用エンドポイントをプロセスにつき1回だけ起動する（GRACHALLE_METRICS_PORT=0で無効）
+    """
+    return start_metrics_server()
+
+
+@st.cache_resource
+def get_warm_up():
+    """
+    スキーマの変換とデプロイメントへの接続をプロセスにつき1回だけ開始する（完了は待たない）
+    """
+    return start_warm_up(get_shared_openai_service())
+
+
+@st.cache_resource
+def get_job_worker():
+    """
+    評価ジョブのワーカーをプロセスにつき1つだけ常駐イベントループで動かす（GRACHALLE_JOB_INPROCESS_CONCURRENCY）
+    """
+    worker = JobWorker(get_job_queue(), JOB_HANDLERS, concurrency=JOB_INPROCESS_CONCURRENCY)
+    asyncio.run_coroutine_threadsafe(worker.run(), get_background_loop().loop)
+    return worker
+
+
+def restore_interface(session_id):
+    """
+    再読み込み前のセッションをセッションストアから復元する（登録済みの評価ジョブの結果を受け取れるようにする）
+    """
+    snapshot = get_session_store().load(session_id)
+    if snapshot is None:
+        return None, []
+    interface = GraChalleInterface.from_snapshot(snapshot, get_shared_openai_service())
+    messages = [
+        {"role": item["role"], "content": item["content"]} for item in snapshot.conversation.conversation_history
+    ]
+    if snapshot.evaluation_report is not None:
+        messages.append({"role": "assistant", "content": snapshot.evaluation_report})
+    return interface, messages
+
+
+def save_interface(interface):
+    """セッションの状態をセッションストアに保存する（コミットは待たない）"""
+    interface.version += 1
+    get_session_store().save(interface.snapshot())
+
+
+get_metrics_server()
+if WARM_UP_ENABLED:
+    get_warm_up()
+# 評価ジョブのキュー（設定があれば、このプロセス内でもジョブを処理する）
+job_queue = get_job_queue()
+if job_queue is not None and JOB_INPROCESS_CONCURRENCY > 0:
+    get_job_worker()
 
 # Streamlitアプリのタイトル
 st.title("GraChalle: 会話式外国語試験Bot")
 
 # インターフェースの初期化
 if "interface" not in st.session_state:
-    st.session_state.interface = GraChalleInterface()
+    interface, messages = None, []
+    # ジョブキューを使う場合は、評価を待つ間に再読み込みしても同じセッションを続けられるようにする
+    if job_queue is not None and st.query_params.get("session"):
+        interface, messages = restore_interface(st.query_params["session"])
+    if interface is None:
+        interface = GraChalleInterface(get_shared_openai_service())
+    st.session_state.interface = interface
+    st.session_state.messages = messages
+    if job_queue is not None:
+        st.query_params["session"] = interface.session_id
+
+# セッションのリセット（先行生成中の処理もキャンセルする）
+if st.sidebar.button("試験をリセット"):
+    st.session_state.interface.reset()
     st.session_state.messages = []
 
 for message in st.session_state.messages:
@@ -15,7 +108,6 @@ for message in st.session_state.messages:
         st.markdown(message["content"])
 
 prompt = st.chat_input("What would you like to ask?")
-print(prompt)
 
 if prompt:
     st.session_state.messages.append({"role": "user", "content": prompt})
@@ -24,7 +116,26 @@ if prompt:
         st.markdown(prompt)
 
     with st.chat_message("assistant"):
-        response = st.session_state.interface.run(prompt)
-        st.markdown(response)
+        response = st.write_stream(st.session_state.interface.run_stream(prompt))
 
     st.session_state.messages.append({"role": "assistant", "content": response})
+    if job_queue is not None:
+        save_interface(st.session_state.interface)
+
+# 評価ジョブを登録済みの場合は、完了を待って評価レポートを表示する
+interface = st.session_state.interface
+if interface.evaluation_job_id is not None and interface.evaluation_report is None:
+    with st.chat_message("assistant"):
+        with st.spinner("評価を作成しています..."):
+            job = run_sync(interface.wait_evaluation_async(timeout=EVALUATION_WAIT_SECONDS))
+        if interface.evaluation_report is not None:
+            st.markdown(interface.evaluation_report)
+            st.session_state.messages.append({"role": "assistant", "content": interface.evaluation_report})
+            save_interface(interface)
+        elif job is not None and job.status == FAILED:
+            st.markdown("評価を作成できませんでした。何か入力すると、この場で評価します。")
+        else:
+            st.markdown(EVALUATION_PENDING_MESSAGE)
+
+# このセッションのLLM呼び出しの推定料金
+st.sidebar.caption(f"推定料金: ${st.session_state.interface.cost_ledger.total_cost:.4f}")
@@ -0,0 +1,434 @@
+# batch_evaluate.py
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from pydantic import BaseModel, Field, ValidationError
+
+from common import (
+    API_KEY,
+    API_VERSION,
+    ENDPOINT,
+    MODEL_NAME,
+    OpenAIService,
+    get_openai_service,
+    logger,
+    response_format_for,
+)
+from evaluator import ConversationEvaluator, EvaluationFeedback, EvaluationScore
+from telemetry import CostLedger, bind_ledger, unbind_ledger
+
+
+# -----------------------------------------------------#
+# 入力（保存済みの会話）                               #
+# -----------------------------------------------------#
+class TranscriptRecord(BaseModel):
+    """評価対象の会話1件"""
+
+    id: str = Field(description="会話の識別子")
+    language: str = Field(description="出題言語")
+    level: str = Field(description="出題難易度")
+    conversation_history: list[dict] = Field(description="role/contentを持つ会話履歴")
+
+
+def parse_transcript(line_no, line):
+    """
+    入力の1行を会話として解釈します。
+    {"id", "language", "level", "conversation_history"}の形式のほか、
+    セッションストアのスナップショット（session_store.SessionSnapshot）の形式も受け付けます。
+
+    Returns:
+        TranscriptRecord: 会話（解釈できない場合はValueError）
+    """
+    try:
+        item = json.loads(line)
+    except ValueError as e:
+        raise ValueError(f"JSONとして解釈できません: {str(e)}")
+    conversation = item.get("conversation")
+    history = item.get("conversation_history")
+    if history is None:
+        history = conversation.get("conversation_history") if isinstance(conversation, dict) else conversation
+    try:
+        return TranscriptRecord(
+            id=str(item.get("id") or item.get("session_id") or line_no),
+            language=item.get("language") or (conversation or {}).get("language"),
+            level=item.get("level") or (conversation or {}).get("level"),
+            conversation_history=history or [],
+        )
+    except (ValidationError, AttributeError) as e:
+        raise ValueError(f"会話として解釈できません: {str(e)}")
+
+
+def iter_lines(path):
+    """入力ファイルを1行ずつ（行番号, 行）で返す（空行は読み飛ばす）"""
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f):
+            if line.strip():
+                yield line_no, line
+
+
+# -----------------------------------------------------#
+# チェックポイント                                     #
+# -----------------------------------------------------#
+class Checkpoint:
+    """
+    評価済みの入力行を記録し、中断後に続きから再開するためのチェックポイント。
+    完了順は入力順と一致しないため、「この行より前はすべて完了」という境界（watermark）と、
+    境界より後ろで完了した行の集合（同時実行数程度の大きさ）のみを保持します。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.watermark = 0
+        self.done = set()
+        self.output_offset = 0
+
+    def load(self):
+        """保存済みのチェックポイントを読み込む（存在しない場合は何もしない）"""
+        if not os.path.exists(self.path):
+            return self
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        self.watermark = data["watermark"]
+        self.done = set(data["done"])
+        self.output_offset = data["output_offset"]
+        return self
+
+    def is_done(self, line_no):
+        return line_no < self.watermark or line_no in self.done
+
+    def mark_done(self, line_no, frontier):
+        """
+        行の完了を記録し、境界を進める
+
+        Parameters:
+            line_no (int): 完了した行番号
+            frontier (int): これより前の行はすべて完了している行番号（処理中の最小の行、なければ読み込み位置）
+        """
+        self.done.add(line_no)
+        self.watermark = max(self.watermark, frontier)
+        self.done = {done_line for done_line in self.done if done_line >= self.watermark}
+
+    def save(self, output_offset):
+        """一時ファイルに書き出してから置き換える（書き込み途中で中断しても壊れないように）"""
+        self.output_offset = output_offset
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"watermark": self.watermark, "done": sorted(self.done), "output_offset": output_offset},
+                f,
+            )
+        os.replace(tmp_path, self.path)
+
+
+def recover_output(output_path, checkpoint):
+    """
+    チェックポイント以降に出力済みの結果をチェックポイントに反映し、書き込み途中の末尾行を切り詰めます
+    （再開時に同じ会話を二重に評価・出力しないように）
+    """
+    if not os.path.exists(output_path):
+        return
+    with open(output_path, "rb+") as f:
+        f.seek(checkpoint.output_offset)
+        offset = checkpoint.output_offset
+        for raw in f:
+            try:
+                if not raw.endswith(b"\n"):
+                    raise ValueError("incomplete line")
+                checkpoint.done.add(json.loads(raw)["line"])
+            except (ValueError, KeyError):
+                logger.warning("書き込み途中の出力を切り詰めます（%sバイト目以降）", offset)
+                f.truncate(offset)
+                break
+            offset += len(raw)
+
+
+# -----------------------------------------------------#
+# オンライン評価                                       #
+# -----------------------------------------------------#
+async def run_batch(
+    input_path,
+    output_path,
+    openai_service=None,
+    concurrency=16,
+    checkpoint_path=None,
+    checkpoint_every=50,
+    batch_results=None,
+):
+    """
+    入力の会話を上限付きの同時実行数で評価し、結果をJSONLに追記します。
+    入力は1行ずつ読み、処理中の会話は同時実行数の2倍までしか保持しないため、件数によらずメモリ使用量は一定です。
+
+    Parameters:
+        input_path (str): 入力（JSONL、1行1会話）
+        output_path (str): 出力（JSONL、1行1結果）
+        openai_service (OpenAIService): 利用するサービス（未指定の場合はプロセス共有のもの）
+        concurrency (int): 同時に評価する会話数
+        checkpoint_path (str): チェックポイントのパス（未指定の場合は出力パス + ".ckpt"）
+        checkpoint_every (int): この件数を出力するごとにチェックポイントを保存する
+        batch_results (dict): Batch APIで算出済みのスコア・フィードバック（行番号 → {"score", "feedback"}）
+
+    Returns:
+        dict: 件数の集計（evaluated, skipped, failed）
+    """
+    evaluator = ConversationEvaluator(openai_service=openai_service)
+    checkpoint = Checkpoint(checkpoint_path or f"{output_path}.ckpt").load()
+    recover_output(output_path, checkpoint)
+    counts = {"evaluated": 0, "skipped": 0, "failed": 0}
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    # 処理中の行と、入力の読み込み位置（境界はどちらも越えて進めない）
+    pending = set()
+    position = {"next": checkpoint.watermark}
+    started = time.perf_counter()
+
+    output = open(output_path, "a", encoding="utf-8")
+
+    def _write(result):
+        output.write(json.dumps(result, ensure_ascii=False) + "\n")
+        pending.discard(result["line"])
+        checkpoint.mark_done(result["line"], min(pending) if pending else position["next"])
+        written = counts["evaluated"] + counts["failed"]
+        if written % checkpoint_every == 0:
+            output.flush()
+            os.fsync(output.fileno())
+            checkpoint.save(output.tell())
+            elapsed = time.perf_counter() - started
+            logger.info("%s件を評価しました（%.0f件/時）", written, written / elapsed * 3600)
+
+    async def _evaluate(line_no, line):
+        try:
+            record = parse_transcript(line_no, line)
+        except ValueError as e:
+            counts["failed"] += 1
+            _write({"line": line_no, "id": None, "status": "invalid", "error": str(e)})
+            return
+        precomputed = (batch_results or {}).get(line_no, {})
+        ledger = CostLedger(record.id)
+        token = bind_ledger(ledger)
+        started_at = time.perf_counter()
+        try:
+            evaluation = await evaluator.evaluate_transcript(
+                record.conversation_history,
+                record.language,
+                record.level,
+                score=precomputed.get("score"),
+                feedback=precomputed.get("feedback"),
+            )
+        finally:
+            unbind_ledger(token)
+        status = "ok" if evaluation.score is not None and evaluation.feedback is not None else "partial"
+        counts["evaluated"] += 1
+        _write(
+            {
+                "line": line_no,
+                "id": record.id,
+                "language": record.language,
+                "level": record.level,
+                "status": status,
+                "score": evaluation.score,
+                "feedback": evaluation.feedback,
+                "report": evaluation.report,
+                "seconds": round(time.perf_counter() - started_at, 3),
+                "cost_usd": ledger.total_cost,
+            }
+        )
+
+    async def _worker():
+        while True:
+            item = await queue.get()
+            try:
+                if item is None:
+                    return
+                await _evaluate(*item)
+            except Exception as e:
+                logger.exception("評価中にエラーが発生しました（%s行目）: %s", item[0], e)
+                counts["failed"] += 1
+                _write({"line": item[0], "id": None, "status": "error", "error": str(e)})
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.create_task(_worker()) for _ in range(concurrency)]
+    try:
+        for line_no, line in iter_lines(input_path):
+            if checkpoint.is_done(line_no):
+                counts["skipped"] += 1
+            else:
+                pending.add(line_no)
+                await queue.put((line_no, line))
+            position["next"] = line_no + 1
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for worker in workers:
+            worker.cancel()
+        output.flush()
+        os.fsync(output.fileno())
+        checkpoint.save(output.tell())
+        output.close()
+    return counts
+
+
+# -----------------------------------------------------#
+# Azure OpenAI Batch API                               #
+# -----------------------------------------------------#
+def _batch_request(custom_id, deployment, system_prompt, user_content, output_schema):
+    """Batch APIの入力ファイルの1行（chat completions・構造化出力）を作る"""
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/chat/completions",
+        "body": {
+            "model": deployment,
+            "messages": OpenAIService._build_messages(system_prompt, user_content),
+            "temperature": 0,
+            # SDKのparse()が送るものと同じ厳密なJSONスキーマ
+            "response_format": response_format_for(output_schema),
+        },
+    }
+
+
+def emit_batch_requests(input_path, output_path, deployment):
+    """
+    スコア算出とフィードバック生成のリクエストをAzure OpenAI Batch APIの入力ファイル形式（JSONL）で書き出します。
+    評価レポートはこの2つの結果を使うため、Batch APIの結果を--batch-resultsで渡してオンラインで生成します。
+
+    Returns:
+        int: 書き出したリクエスト数
+    """
+    count = 0
+    with open(output_path, "w", encoding="utf-8") as f:
+        for line_no, line in iter_lines(input_path):
+            try:
+                record = parse_transcript(line_no, line)
+            except ValueError as e:
+                logger.warning("%s行目を読み飛ばします: %s", line_no, e)
+                continue
+            conversation_full = ConversationEvaluator.format_conversation(record.conversation_history)
+            stages = [
+                ("score", ConversationEvaluator.build_score_prompt(record.language, record.level), EvaluationScore),
+                (
+                    "feedback",
+                    ConversationEvaluator.build_feedback_prompt(record.language, record.level),
+                    EvaluationFeedback,
+                ),
+            ]
+            for stage, system_prompt, output_schema in stages:
+                request = _batch_request(
+                    f"{line_no}:{stage}", deployment, system_prompt, conversation_full, output_schema
+                )
+                f.write(json.dumps(request, ensure_ascii=False) + "\n")
+                count += 1
+    return count
+
+
+def load_batch_results(path):
+    """
+    Batch APIの出力ファイルからスコア・フィードバックを読み込みます（失敗したリクエストは含めない）
+
+    Returns:
+        dict: 行番号 → {"score": int, "feedback": str}
+    """
+    results = {}
+    for _, line in iter_lines(path):
+        item = json.loads(line)
+        line_no, stage = item["custom_id"].split(":")
+        response = item.get("response") or {}
+        if response.get("status_code") != 200:
+            continue
+        try:
+            content = json.loads(response["body"]["choices"][0]["message"]["content"])
+            value = EvaluationScore(**content).score if stage == "score" else EvaluationFeedback(**content).feedback
+        except (KeyError, IndexError, ValueError, ValidationError) as e:
+            logger.warning("Batch APIの結果を解釈できません（%s）: %s", item["custom_id"], e)
+            continue
+        results.setdefault(int(line_no), {})[stage] = value
+    return results
+
+
+# -----------------------------------------------------#
+# Parquet出力                                          #
+# -----------------------------------------------------#
+def convert_to_parquet(jsonl_path, parquet_path, rows_per_group=5000):
+    """評価結果のJSONLをParquetに変換します（行グループ単位で書き出すためメモリ使用量は一定）"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("Parquetで出力するにはpyarrowが必要です: pip install pyarrow")
+
+    schema = pa.schema(
+        [
+            ("line", pa.int64()),
+            ("id", pa.string()),
+            ("language", pa.string()),
+            ("level", pa.string()),
+            ("status", pa.string()),
+            ("score", pa.int64()),
+            ("feedback", pa.string()),
+            ("report", pa.string()),
+            ("seconds", pa.float64()),
+            ("cost_usd", pa.float64()),
+            ("error", pa.string()),
+        ]
+    )
+    with pq.ParquetWriter(parquet_path, schema) as writer:
+        rows = []
+        for _, line in iter_lines(jsonl_path):
+            rows.append(json.loads(line))
+            if len(rows) >= rows_per_group:
+                writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+                rows = []
+        if rows:
+            writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+
+
+if __name__ == "__main__":
+    import logging
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
+    )
+
+    parser = argparse.ArgumentParser(description="保存済みの会話（JSONL）を一括で評価します")
+    parser.add_argument("input", help="入力（JSONL、1行1会話）")
+    parser.add_argument("--output", default="evaluations.jsonl", help="評価結果の出力先（JSONL）")
+    parser.add_argument("--checkpoint", default=None, help="チェックポイントのパス（既定は出力先 + .ckpt）")
+    parser.add_argument("--concurrency", type=int, default=16, help="同時に評価する会話数")
+    parser.add_argument("--rpm", type=int, default=0, help="このバッチに割り当てる1分あたりのリクエスト数")
+    parser.add_argument("--tpm", type=int, default=0, help="このバッチに割り当てる1分あたりのトークン数")
+    parser.add_argument("--endpoint", default=None, help="接続先（未指定の場合は環境変数の設定）")
+    parser.add_argument("--parquet", default=None, help="評価結果をParquetにも書き出す場合の出力先")
+    parser.add_argument("--emit-batch", default=None, help="評価せずにBatch APIの入力ファイルを書き出す場合の出力先")
+    parser.add_argument("--batch-deployment", default=MODEL_NAME, help="Batch API用（Global Batch）のデプロイメント名")
+    parser.add_argument("--batch-results", default=None, help="Batch APIの出力ファイル（スコア・フィードバックに使用）")
+    args = parser.parse_args()
+
+    if args.emit_batch:
+        count = emit_batch_requests(args.input, args.emit_batch, args.batch_deployment)
+        print(f"Batch APIの入力ファイルを書き出しました: {args.emit_batch}（{count}件）")
+        raise SystemExit(0)
+
+    if args.endpoint:
+        service = OpenAIService(endpoint=args.endpoint, api_key=API_KEY or "mock-key", api_version=API_VERSION)
+    else:
+        service = get_openai_service(ENDPOINT, API_KEY, MODEL_NAME, API_VERSION)
+    if args.rpm or args.tpm:
+        # オンラインの試験と同じクォータを使う場合は、その一部のみをバッチに割り当てる
+        service.limit_rate(args.rpm, args.tpm)
+
+    results = load_batch_results(args.batch_results) if args.batch_results else None
+    started = time.perf_counter()
+    counts = asyncio.run(
+        run_batch(args.input, args.output, service, args.concurrency, args.checkpoint, batch_results=results)
+    )
+    elapsed = time.perf_counter() - started
+    print(
+        f"評価: {counts['evaluated']}件, 失敗: {counts['failed']}件, 再開時に読み飛ばし: {counts['skipped']}件"
+        f"（{elapsed:.1f}秒, {counts['evaluated'] / max(elapsed, 1e-9) * 3600:.0f}件/時）"
+    )
+    if args.parquet:
+        convert_to_parquet(args.output, args.parquet)
+        print(f"Parquetを書き出しました: {args.parquet}")
@@ -0,0 +1,194 @@
+# benchmark.py
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+
+from cassette import RECORD, REPLAY, Cassette
+from common import OpenAIService, logger
+
+# 記録・再生で同じリクエストになるよう、入力は固定する
+SCRIPT = [
+    "英語の初級で試験を受けたい",
+    "はい、始めてください",
+    "I like playing soccer with my friends.",
+    "I usually go shopping on weekends.",
+    "I want to visit Canada because of the nature.",
+    "終了します",
+]
+
+
+def _summarize(samples):
+    """計測値（秒）の統計量をマイクロ秒で返す"""
+    ordered = sorted(samples)
+    return {
+        "n": len(ordered),
+        "mean": statistics.fmean(ordered) * 1e6,
+        "p50": ordered[len(ordered) // 2] * 1e6,
+        "p95": ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] * 1e6,
+    }
+
+
+def _timeit(func, iterations):
+    """関数を繰り返し実行し、1回ごとの所要時間（秒）を返す"""
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def _sample_history(turns):
+    history = []
+    for i in range(turns):
+        history.append({"role": "assistant", "content": f"Question {i}: What did you do last weekend, and why?"})
+        history.append({"role": "user", "content": f"Answer {i}: I went hiking with my friends because it was sunny."})
+    return history
+
+
+# -----------------------------------------------------#
+# 各ステージの純Python処理                             #
+# -----------------------------------------------------#
+def bench_prompt_building(iterations, turns):
+    """ConversationalChatのメッセージ組み立て（会話履歴の追加と窓の更新を含む）"""
+    from examination import ConversationalChat
+
+    chat = ConversationalChat(openai_service=OpenAIService(endpoint="http://127.0.0.1", api_key="bench"))
+    chat._start_state("英語", "初級")
+    for item in _sample_history(turns):
+        chat._append_message(item["role"], item["content"])
+
+    def _step():
+        chat._append_message("user", "I like playing soccer with my friends.")
+        chat._build_continue_messages()
+
+    return _timeit(_step, iterations)
+
+
+def bench_history_joining(iterations, turns):
+    """ConversationEvaluator.set_conversation_historyによる会話履歴の連結"""
+    from evaluator import ConversationEvaluator
+
+    evaluator = ConversationEvaluator(openai_service=OpenAIService(endpoint="http://127.0.0.1", api_key="bench"))
+    history = _sample_history(turns)
+    return _timeit(lambda: evaluator.set_conversation_history(history), iterations)
+
+
+def bench_pydantic_parsing(iterations):
+    """各応答スキーマのJSON文字列からのパース"""
+    from evaluator import (
+        EvaluationFeedback,
+        EvaluationResult,
+        EvaluationScore,
+        TurnAssessment,
+    )
+    from examination import ConversationalText
+    from intent import (
+        ConfirmationMessage,
+        ExaminationInformation,
+        ExaminationStartIntent,
+        HearingResult,
+    )
+    from mock_server import payload_for_request
+
+    schemas = [
+        ExaminationStartIntent,
+        ExaminationInformation,
+        HearingResult,
+        ConfirmationMessage,
+        ConversationalText,
+        EvaluationScore,
+        EvaluationFeedback,
+        EvaluationResult,
+        TurnAssessment,
+    ]
+    payloads = [
+        (schema, payload_for_request({"response_format": {"json_schema": {"name": schema.__name__}}}))
+        for schema in schemas
+    ]
+
+    def _step():
+        for schema, payload in payloads:
+            schema.model_validate_json(payload)
+
+    return _timeit(_step, iterations)
+
+
+# -----------------------------------------------------#
+# 状態遷移の処理（カセット再生）                       #
+# -----------------------------------------------------#
+async def _run_script(openai_service, timings=None):
+    """固定の入力で試験を最後まで進め、状態遷移ごとの所要時間を記録する"""
+    from main import GraChalleInterface
+
+    interface = GraChalleInterface(openai_service)
+    for user_input in SCRIPT:
+        before = interface.exam_status
+        started = time.perf_counter()
+        await interface.run_async(user_input)
+        # ターン別評価などのバックグラウンド処理を完了させてから次へ進む
+        await asyncio.gather(*interface._turn_scoring_tasks)
+        if timings is not None:
+            timings[f"{before}->{interface.exam_status}"].append(time.perf_counter() - started)
+
+
+def record_cassette(path, endpoint):
+    """モックサーバー（または指定の接続先）に対して試験を1回実施し、カセットに記録する"""
+    if endpoint is None:
+        from mock_server import MockSettings, start_mock_server
+
+        server = start_mock_server(port=0, settings=MockSettings(latency_median=0, chunk_interval=0))
+        endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+    service = OpenAIService(
+        endpoint=endpoint, api_key=os.getenv("AZURE_OPENAI_API_KEY") or "bench", cassette=Cassette(path, RECORD)
+    )
+    asyncio.run(_run_script(service))
+    logger.info("カセットを記録しました: %s (%s件)", path, len(service.cassette))
+
+
+def bench_dispatch(path, iterations):
+    """カセット再生でrun_asyncの状態遷移を実行し、LLMを除いた自前コードの所要時間を計測する"""
+    service = OpenAIService(endpoint="http://127.0.0.1", api_key="bench", cassette=Cassette(path, REPLAY))
+    timings = defaultdict(list)
+
+    async def _iterate():
+        for _ in range(iterations):
+            await _run_script(service, timings)
+
+    asyncio.run(_iterate())
+    return timings
+
+
+def print_result(name, samples):
+    summary = _summarize(samples)
+    print(f"{name:<36}{summary['n']:>8}{summary['mean']:>12.1f}{summary['p50']:>12.1f}{summary['p95']:>12.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LLM応答を除いた自前コードの処理時間を計測します")
+    parser.add_argument("--iterations", type=int, default=1000, help="各ステージの繰り返し回数")
+    parser.add_argument("--turns", type=int, default=10, help="会話履歴の往復数")
+    parser.add_argument(
+        "--cassette",
+        default=os.path.join(tempfile.gettempdir(), "grachalle_bench_cassette.jsonl"),
+        help="状態遷移の計測に使うカセット（存在しない場合は記録する）",
+    )
+    parser.add_argument(
+        "--record-endpoint", default=None, help="カセット記録時の接続先（未指定の場合はモックサーバー）"
+    )
+    parser.add_argument("--dispatch-iterations", type=int, default=50, help="状態遷移の計測で試験を繰り返す回数")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.cassette):
+        record_cassette(args.cassette, args.record_endpoint)
+
+    print(f"{'stage':<36}{'n':>8}{'mean(us)':>12}{'p50(us)':>12}{'p95(us)':>12}")
+    print_result("prompt_building", bench_prompt_building(args.iterations, args.turns))
+    print_result("history_joining", bench_history_joining(args.iterations, args.turns))
+    print_result("pydantic_parsing", bench_pydantic_parsing(args.iterations))
+    for transition, samples in sorted(bench_dispatch(args.cassette, args.dispatch_iterations).items()):
+        print_result(f"dispatch[{transition}]", samples)
@@ -0,0 +1,97 @@
+# cassette.py
+import json
+import os
+import threading
+import time
+
+from common import logger
+
+RECORD = "record"
+REPLAY = "replay"
+
+
+# -----------------------------------------------------#
+# 記録・再生カセット                                   #
+# -----------------------------------------------------#
+class Cassette:
+    """
+    LLMへのリクエストとレスポンスの組をJSONLファイルに記録し、ネットワークを使わずに再生するためのストア。
+    リクエストのハッシュ（モデル・メッセージ・スキーマ・温度）をキーに、ファイル内のオフセットを索引として保持します。
+    """
+
+    def __init__(self, path, mode=REPLAY):
+        """
+        Parameters:
+            path (str): 記録先のJSONLファイル
+            mode (str): "record"（実APIを呼び出して記録）または "replay"（記録から応答）
+        """
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"カセットのモードが不正です: {mode}")
+        self.path = path
+        self.mode = mode
+        self._index = {}  # key -> ファイル内のバイトオフセット
+        self._lock = threading.Lock()
+        self._build_index()
+
+    @property
+    def is_replay(self):
+        return self.mode == REPLAY
+
+    def _build_index(self):
+        """JSONLファイルを先頭から走査し、キーごとのオフセットを索引化する"""
+        if not os.path.exists(self.path):
+            if self.is_replay:
+                logger.warning("カセットファイルが存在しません: %s", self.path)
+            return
+        with open(self.path, "rb") as f:
+            offset = 0
+            for line in f:
+                if line.strip():
+                    # 同じキーが複数ある場合は最初の記録を使う
+                    self._index.setdefault(json.loads(line)["key"], offset)
+                offset += len(line)
+        logger.info("カセットを読み込みました: %s (%s件)", self.path, len(self._index))
+
+    def __len__(self):
+        return len(self._index)
+
+    def lookup(self, key):
+        """
+        記録済みの応答を取得します。
+
+        Parameters:
+            key (str): リクエストのハッシュ
+
+        Returns:
+            str: 記録済みの応答（JSON文字列、未記録の場合はNone）
+        """
+        with self._lock:
+            offset = self._index.get(key)
+            if offset is None:
+                return None
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                return json.loads(f.readline())["response"]
+
+    def record(self, key, request, response):
+        """
+        リクエストと応答の組を追記します（同じキーが記録済みの場合は何もしない）
+
+        Parameters:
+            key (str): リクエストのハッシュ
+            request (dict): 記録用のリクエスト内容
+            response (str): 応答のJSON文字列
+        """
+        if not response:
+            return
+        line = json.dumps(
+            {"key": key, "recorded_at": time.time(), "request": request, "response": response}, ensure_ascii=False
+        )
+        with self._lock:
+            if key in self._index:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "ab") as f:
+                offset = f.tell()
+                f.write((line + "\n").encode("utf-8"))
+            self._index[key] = offset
@@ -1,25 +1,42 @@
 import asyncio
+import functools
+import hashlib
 import json
 import logging
 import os
 import random
+import threading
+import time
 from datetime import datetime
 from typing import Any, Dict, Optional
 
-from dotenv import load_dotenv
-from openai import AsyncAzureOpenAI, AzureOpenAI
-
-# 環境変数を.envファイルから読み込む
-load_dotenv()
+import config  # noqa: F401
+from deployment_pool import (
+    Deployment,
+    DeploymentConfig,
+    DeploymentPool,
+    load_deployment_configs,
+)
+from model_routing import TIER_SMALL, ModelRouter, load_small_deployment_configs
+from ratelimit import MAX_OUTPUT_TOKENS_ESTIMATE, PRIORITY_NAMES, RateLimiter
+from resilience import LLMFailure, RetryPolicy, classify_exception
+from response_cache import get_response_cache
+from structured_logging import configure_logging
+from telemetry import (
+    record_attempt_failure,
+    record_cache,
+    record_escalation,
+    record_llm_call,
+    record_ttft,
+    watch_pools,
+)
+from tracing import SPAN_KIND_CLIENT, current_span, span, start_span, use_span
 
 # -----------------------------------------------------#
 # ロガー設定                                           #
 # -----------------------------------------------------#
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
+# 出力は専用スレッドで行い、イベントループのスレッドでファイル・端末への書き込みを待たない
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # -----------------------------------------------------#
@@ -30,6 +47,19 @@ API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
 MODEL_NAME = os.getenv("AZURE_OPENAI_MODEL", "gpt-4")  # デフォルトモデルの設定
 API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-01")  # APIバージョンのデフォルト値
 
+# コネクションプール設定（プロセス内の全セッションで共有）
+MAX_CONNECTIONS = int(os.getenv("AZURE_OPENAI_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("AZURE_OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("AZURE_OPENAI_KEEPALIVE_EXPIRY", "30"))  # 秒
+
+# 記録・再生カセット（未指定の場合は無効）
+CASSETTE_PATH = os.getenv("GRACHALLE_CASSETTE_PATH")
+CASSETTE_MODE = os.getenv("GRACHALLE_CASSETTE_MODE", "replay")  # "record" または "replay"
+
+# 起動時のウォームアップ（最初の利用者が来る前に、スキーマの変換とデプロイメントへの接続を済ませる）
+WARM_UP_ENABLED = os.getenv("GRACHALLE_WARM_UP", "false").lower() == "true"
+WARM_UP_CONNECTIONS = int(os.getenv("GRACHALLE_WARM_UP_CONNECTIONS", "2"))  # デプロイメントごとに開いておく接続数
+
 
 # -----------------------------------------------------#
 # OpenAI サービス                                      #
@@ -38,9 +68,26 @@ class OpenAIService:
     """
     Azure OpenAI APIを利用するためのサービスクラス。
     同期・非同期両方のAPI呼び出しに対応しています。
+    複数のデプロイメントを指定した場合は、呼び出しごとに処理中の件数と観測レイテンシから呼び出し先を選びます。
+    呼び出し箇所（call_site）ごとに、小型モデルと大型モデルのどちらのデプロイメントを使うかを振り分けます。
     """
 
-    def __init__(self, endpoint=ENDPOINT, api_key=API_KEY, model_name=MODEL_NAME, api_version=API_VERSION):
+    def __init__(
+        self,
+        endpoint=ENDPOINT,
+        api_key=API_KEY,
+        model_name=MODEL_NAME,
+        api_version=API_VERSION,
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+        cassette=None,
+        retry_policy=None,
+        deployments=None,
+        small_deployments=None,
+        router=None,
+        response_cache=None,
+    ):
         """
         OpenAIServiceの初期化。
 
@@ -49,26 +96,595 @@ class OpenAIService:
             api_key (str): Azure OpenAIのAPIキー
             model_name (str): 使用するモデル名
             api_version (str): APIバージョン
+            max_connections (int): コネクションプールの最大接続数
+            max_keepalive_connections (int): キープアライブで保持する最大接続数
+            keepalive_expiry (float): アイドル接続を保持する秒数
+            cassette (Cassette): 記録・再生に使うカセット（未指定の場合は環境変数の設定に従う）
+            retry_policy (RetryPolicy): 期限・再試行の設定（未指定の場合は環境変数の設定に従う）
+            deployments (list[DeploymentConfig]): 振り分け先のデプロイメント
+                （未指定の場合はAZURE_OPENAI_DEPLOYMENTS、それもなければ引数のエンドポイント1件）
+            small_deployments (list[DeploymentConfig]): 小型モデルのデプロイメント
+                （未指定の場合はAZURE_OPENAI_MODEL_SMALLの設定に従い、それもなければ大型モデルと共用）
+            router (ModelRouter): 呼び出し箇所の振り分け（未指定の場合は環境変数の設定に従う）
+            response_cache (ResponseCache): 温度0の構造化出力の応答キャッシュ
+                （未指定の場合はプロセス共有のもの。カセット使用時は記録・再生を優先して使わない）
         """
         self.endpoint = endpoint
         self.api_key = api_key
         self.api_version = api_version
         self.model_name = model_name
-        self.client = AzureOpenAI(azure_endpoint=endpoint, api_key=api_key, api_version=api_version)
-        # 非同期クライアントは必要時に初期化する
-        self._async_client = None
+        # httpx.Limitsの引数（httpxはクライアントの生成時にインポートする）
+        self.http_limits = {
+            "max_connections": max_connections,
+            "max_keepalive_connections": max_keepalive_connections,
+            "keepalive_expiry": keepalive_expiry,
+        }
+        if deployments is None:
+            deployments = load_deployment_configs(endpoint, api_key, model_name, api_version)
+        if deployments is None:
+            deployments = [
+                DeploymentConfig(endpoint=endpoint, api_key=api_key, model_name=model_name, api_version=api_version)
+            ]
+        # 大型モデルのプール（既定の振り分け先）
+        self.pool = DeploymentPool([Deployment(config, self.http_limits) for config in deployments])
+        if small_deployments is None:
+            small_deployments = load_small_deployment_configs(deployments, endpoint, api_key, api_version)
+        if small_deployments is None:
+            self.small_pool = self.pool
+        else:
+            self.small_pool = DeploymentPool([Deployment(config, self.http_limits) for config in small_deployments])
+        self.router = router or ModelRouter()
+        watch_pools([self.pool] if self.small_pool is self.pool else [self.pool, self.small_pool])
+        self.retry_policy = retry_policy or RetryPolicy()
+        # いずれかのデプロイメントにRPM・TPMの制限がある場合のみトークン数を見積もる
+        self._rate_limited = any(
+            d.rate_limiter is not None for d in self.pool.deployments + self.small_pool.deployments
+        )
+        if cassette is None and CASSETTE_PATH:
+            from cassette import Cassette
+
+            cassette = Cassette(CASSETTE_PATH, CASSETTE_MODE)
+        self.cassette = cassette
+        if response_cache is None and cassette is None:
+            response_cache = get_response_cache()
+        self.response_cache = response_cache
+
+    @property
+    def client(self):
+        """既定（先頭）のデプロイメントの同期APIクライアント"""
+        return self.pool.primary.client
 
     def _get_async_client(self):
         """
-        非同期APIクライアントを取得（遅延初期化）
+        既定（先頭）のデプロイメントの非同期APIクライアントを取得（遅延初期化）
         """
-        if self._async_client is None:
-            self._async_client = AsyncAzureOpenAI(
-                azure_endpoint=self.endpoint, api_key=self.api_key, api_version=self.api_version
-            )
-        return self._async_client
+        return self.pool.primary.get_async_client()
+
+    def limit_rate(self, rpm=0, tpm=0):
+        """
+        このサービスのデプロイメントに、プロセス共有のものとは別のRPM・TPM制限を設定します
+        （バッチ処理でクォータの一部のみを使う場合など。デプロイメントごとに適用）
+
+        Parameters:
+            rpm (int): 1分あたりのリクエスト数の上限（0の場合は制限しない）
+            tpm (int): 1分あたりのトークン数の上限（0の場合は制限しない）
+        """
+        for deployment in {id(d): d for d in self.pool.deployments + self.small_pool.deployments}.values():
+            deployment.rate_limiter = RateLimiter(rpm=rpm, tpm=tpm) if rpm > 0 or tpm > 0 else None
+        self._rate_limited = rpm > 0 or tpm > 0
+
+    async def warm_up_async(self, schemas=(), connections=WARM_UP_CONNECTIONS, timeout=10):
+        """
+        最初の呼び出しの前に、構造化出力のスキーマを変換し、各デプロイメントの非同期クライアントを生成して接続を開きます。
+        接続はキープアライブで保持されるため、最初の利用者の呼び出しでTLSハンドシェイクを待たずに済みます。
+        失敗しても例外は送出せず、通常の呼び出し時に改めて接続します。
+
+        Parameters:
+            schemas (Iterable[pydantic.BaseModel]): 事前に変換するPydanticモデルクラス
+            connections (int): デプロイメントごとに開いておく接続数
+            timeout (float): 1接続あたりのタイムアウト（秒）
+
+        Returns:
+            int: 接続できたデプロイメントの数
+        """
+        started = time.monotonic()
+        for schema in schemas:
+            response_format_for(schema)
+        if self.cassette is not None and self.cassette.is_replay:
+            return 0
+        deployments = list({id(d): d for d in self.pool.deployments + self.small_pool.deployments}.values())
+
+        async def _open(deployment):
+            try:
+                client = deployment.get_async_client()
+                # 同時に送ることで、それぞれが別の接続を開く（応答の内容は使わない）
+                await asyncio.gather(*(client.models.list(timeout=timeout) for _ in range(max(connections, 1))))
+                return True
+            except Exception as e:
+                logger.warning("ウォームアップの接続に失敗しました: %s: %s", deployment.name, e)
+                return False
+
+        results = await asyncio.gather(*(_open(deployment) for deployment in deployments))
+        logger.info(
+            "ウォームアップが完了しました: %s/%sデプロイメント (%.2f秒)",
+            sum(results),
+            len(deployments),
+            time.monotonic() - started,
+        )
+        return sum(results)
+
+    def _pool_for(self, route):
+        """振り分け先の区分に対応するデプロイメントプール"""
+        return self.small_pool if route.tier == TIER_SMALL else self.pool
+
+    def _should_escalate(self, route, result):
+        """小型モデルの結果を大型モデルで呼び直すかどうか（小型モデルが設定されていない場合は呼び直さない）"""
+        return self.small_pool is not self.pool and self.router.needs_escalation(route, result)
+
+    def _cassette_key(self, pool, messages, output_schema, temperature):
+        """カセット利用時のみリクエストのハッシュを計算する（モデルが異なれば別のリクエストとして扱う）"""
+        if self.cassette is None:
+            return None
+        return request_fingerprint(pool.primary.model_name, messages, output_schema, temperature)
 
-    def call_llm_with_json_output(self, system_prompt, user_input, output_schema, temperature=0):
+    def _replay(self, key, output_schema):
+        """
+        カセットから応答を再生します（未記録の場合は失敗結果を返す）
+        """
+        content = self.cassette.lookup(key)
+        if content is None:
+            logger.error("カセットに記録がありません: %s (%s)", output_schema.__name__, key[:12])
+            return LLMFailure(kind="replay_miss", message=f"{output_schema.__name__} ({key[:12]})")
+        return output_schema.model_validate_json(content)
+
+    def _record(self, pool, key, messages, output_schema, temperature, content):
+        """記録モードの場合、応答をカセットに追記します"""
+        if self.cassette is not None and not self.cassette.is_replay:
+            request = {
+                "model": pool.primary.model_name,
+                "messages": messages,
+                "schema": output_schema.__name__,
+                "temperature": temperature,
+            }
+            self.cassette.record(key, request, content)
+
+    # -----------------------------------------------------#
+    # 応答キャッシュ                                       #
+    # -----------------------------------------------------#
+    def _response_cache_key(self, pool, messages, output_schema, temperature):
+        """応答キャッシュを使う場合のみリクエストのハッシュを計算する（温度0の呼び出しのみが対象）"""
+        if self.response_cache is None or temperature != 0:
+            return None
+        return request_fingerprint(pool.primary.model_name, messages, output_schema, temperature)
+
+    @staticmethod
+    def _record_cache(label, result):
+        """応答キャッシュの参照結果をメトリクスと処理中のスパンに記録する"""
+        record_cache(label, result)
+        current_span().set_attribute("llm.cache", result)
+
+    @staticmethod
+    def _shared_result(shared, output_schema):
+        """キャッシュ・合流先から受け取った結果を呼び出し元に返す形にする（応答は呼び出しごとに別のインスタンス）"""
+        return output_schema.model_validate_json(shared) if isinstance(shared, str) else shared
+
+    def _finish_flight(self, key, future, result):
+        """先着の呼び出しの結果を合流した呼び出しに渡し、成功した応答のみキャッシュに保存する"""
+        if result is None or isinstance(result, LLMFailure):
+            self.response_cache.finish(key, future, result)
+            return
+        value = result.model_dump_json()
+        self.response_cache.finish(key, future, value, value)
+
+    def _call_cached(self, key, output_schema, label, call):
+        """
+        応答キャッシュを通して呼び出します。同じリクエストが処理中であれば、その結果を待って共有します。
+        先着の呼び出しが中断された場合は、待っていた呼び出しのいずれかが改めて呼び出します。
+        """
+        while True:
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                self._record_cache(label, "hit")
+                return output_schema.model_validate_json(cached)
+            future, leader = self.response_cache.join(key)
+            if leader:
+                break
+            self._record_cache(label, "hit" if future.done() else "coalesced")
+            shared = future.result()
+            if shared is not None:
+                return self._shared_result(shared, output_schema)
+
+        self._record_cache(label, "miss")
+        result = None
+        try:
+            result = call()
+        finally:
+            self._finish_flight(key, future, result)
+        return result
+
+    async def _call_cached_async(self, key, output_schema, label, call):
+        """_call_cachedの非同期版（2次キャッシュの読み込みはイベントループを止めないよう別スレッドで行う）"""
+        while True:
+            cached = self.response_cache.get_local(key)
+            if cached is None and self.response_cache.store is not None:
+                cached = await asyncio.to_thread(self.response_cache.get, key)
+            if cached is not None:
+                self._record_cache(label, "hit")
+                return output_schema.model_validate_json(cached)
+            future, leader = self.response_cache.join(key)
+            if leader:
+                break
+            self._record_cache(label, "hit" if future.done() else "coalesced")
+            # 待っている側がキャンセルされても、共有のFutureはキャンセルしない
+            shared = await asyncio.shield(asyncio.wrap_future(future))
+            if shared is not None:
+                return self._shared_result(shared, output_schema)
+
+        self._record_cache(label, "miss")
+        result = None
+        try:
+            result = await call()
+        finally:
+            self._finish_flight(key, future, result)
+        return result
+
+    @staticmethod
+    def _build_messages(system_prompt, user_input):
+        """システムプロンプトとユーザー入力からメッセージ列を組み立てる"""
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_input},
+        ]
+
+    @staticmethod
+    def _parsed_content(response, output_schema):
+        """
+        応答をPydanticモデルとして検証し、モデル・元のJSON文字列・トークン使用量（CompletionUsage）を取り出す
+        （拒否応答・出力の打ち切りなどで検証できない場合は例外）
+        """
+        choice = response.choices[0]
+        message = choice.message
+        if message.refusal:
+            raise ValueError(message.refusal)
+        if choice.finish_reason in ("length", "content_filter") or not message.content:
+            raise ValueError(f"構造化出力を取得できませんでした: finish_reason={choice.finish_reason}")
+        return output_schema.model_validate_json(message.content), message.content, response.usage
+
+    @staticmethod
+    def _estimate_prompt_tokens(messages):
+        """メッセージ列の推定トークン数（1メッセージあたりの書式分を含む）"""
+        return sum(estimate_tokens(message.get("content") or "") + 4 for message in messages)
+
+    def _estimate_request_tokens(self, messages):
+        """レート制限用にリクエストのトークン数を見積もる（メッセージの推定トークン数 + 出力上限）"""
+        if not self._rate_limited:
+            return 0
+        return self._estimate_prompt_tokens(messages) + MAX_OUTPUT_TOKENS_ESTIMATE
+
+    # -----------------------------------------------------#
+    # 期限・再試行・振り分け                               #
+    # -----------------------------------------------------#
+    def _busy_failure(self, deployment, priority, attempts):
+        return LLMFailure(
+            kind="busy",
+            message=(
+                f"deployment={deployment.name}, priority={PRIORITY_NAMES.get(priority, priority)}, "
+                f"queue_depth={deployment.rate_limiter.queue_depth}"
+            ),
+            attempts=attempts,
+        )
+
+    def _circuit_open_failure(self, pool, attempts):
+        return LLMFailure(
+            kind="circuit_open",
+            message=", ".join(d.name for d in pool.deployments),
+            attempts=attempts,
+            retry_after=min(d.circuit_breaker.retry_after() for d in pool.deployments),
+        )
+
+    def _admit(self, deployment, tokens, priority, timeout):
+        """デプロイメントのレートリミッターの枠を確保する（リミッター未設定の場合は常に通す）"""
+        if deployment.rate_limiter is None:
+            return True
+        with span("ratelimit.admit", deployment=deployment.name, tokens=tokens) as s:
+            admitted = deployment.rate_limiter.acquire_blocking(tokens, priority, timeout)
+            s.set_attribute("admitted", admitted)
+        return admitted
+
+    async def _admit_async(self, deployment, tokens, priority, timeout):
+        """_admitの非同期版"""
+        if deployment.rate_limiter is None:
+            return True
+        with span("ratelimit.admit", deployment=deployment.name, tokens=tokens) as s:
+            try:
+                admitted = await asyncio.wait_for(deployment.rate_limiter.acquire(tokens, priority), timeout)
+            except asyncio.TimeoutError:
+                admitted = False
+            s.set_attribute("admitted", admitted)
+        return admitted
+
+    def _record_failure(self, deployment, failure):
+        """失敗をデプロイメントのサーキットブレーカーとレートリミッターに反映する"""
+        if failure.kind == "rate_limited" and deployment.rate_limiter is not None:
+            # スロットリング中は同じデプロイメントへの後続の呼び出しもまとめて待たせる
+            deployment.rate_limiter.pause(failure.retry_after or self.retry_policy.backoff(1))
+        if failure.retryable:
+            deployment.circuit_breaker.record_failure()
+        else:
+            # 4xxやパース失敗はデプロイメント自体は応答しているため、遮断の対象にしない
+            deployment.circuit_breaker.record_success()
+
+    def _record_success(self, pool, deployment, label, latency, tokens, usage):
+        """成功をデプロイメントとプールに記録し、トークン使用量を精算する"""
+        deployment.circuit_breaker.record_success()
+        pool.observe(label, latency)
+        if deployment.rate_limiter is not None:
+            deployment.rate_limiter.reconcile(tokens, usage.total_tokens if usage is not None else None)
+
+    def _next_attempt(self, error, attempt, deadline, label, deployment):
+        """
+        1回の試行の失敗を分類し、次の試行までの待機秒数を決めます。
+
+        Returns:
+            tuple[LLMFailure, float]: 失敗結果と待機秒数（再試行しない場合はNone）
+        """
+        failure = classify_exception(error, attempt)
+        logger.warning(
+            "LLM API呼び出しに失敗 (%s, %s, %s回目): %s: %s",
+            label,
+            deployment.name,
+            attempt,
+            failure.kind,
+            failure.message,
+        )
+        delay = None
+        if failure.retryable and attempt < self.retry_policy.max_attempts:
+            delay = self.retry_policy.backoff(attempt, failure.retry_after)
+            if time.monotonic() + delay >= deadline:
+                delay = None
+        record_attempt_failure(label, failure.kind, retrying=delay is not None)
+        current_span().add_event("retry" if delay is not None else "give_up", kind=failure.kind, delay=delay)
+        return failure, delay
+
+    def _call_deployment(self, pool, deployment, attempt_call, timeout, label, tokens):
+        """1つのデプロイメントに1回呼び出し、処理中の件数・レイテンシ・ブレーカーの状態を記録する"""
+        deployment.begin()
+        started = time.monotonic()
+        latency = None
+        try:
+            with span("llm.attempt", deployment=deployment.name, timeout=timeout):
+                result = attempt_call(deployment, timeout)
+            latency = time.monotonic() - started
+        except Exception as e:
+            self._record_failure(deployment, classify_exception(e, 0))
+            raise
+        finally:
+            deployment.end(latency)
+        self._record_success(pool, deployment, label, latency, tokens, result[2])
+        return result
+
+    async def _call_deployment_async(self, pool, deployment, attempt_call, timeout, label, tokens):
+        """_call_deploymentの非同期版。試行はasyncio.wait_forで期限を強制します"""
+        deployment.begin()
+        started = time.monotonic()
+        latency = None
+        try:
+            with span("llm.attempt", deployment=deployment.name, timeout=timeout):
+                result = await asyncio.wait_for(attempt_call(deployment, timeout), timeout)
+            latency = time.monotonic() - started
+        except Exception as e:
+            self._record_failure(deployment, classify_exception(e, 0))
+            raise
+        finally:
+            deployment.end(latency)
+        self._record_success(pool, deployment, label, latency, tokens, result[2])
+        return result
+
+    def _hedge_target(self, pool, primary, tokens, priority):
+        """ヘッジリクエストの送り先を選ぶ（待たずにクォータを確保できるデプロイメントのみ）"""
+        secondary = pool.select(exclude={primary})
+        if secondary is None or secondary is primary:
+            return None
+        # 遮断中のデプロイメントのクォータを消費しないよう、サーキットブレーカーを先に確認する
+        if not secondary.circuit_breaker.allow():
+            return None
+        if secondary.rate_limiter is not None and not secondary.rate_limiter.try_acquire(tokens, priority):
+            secondary.circuit_breaker.release()
+            return None
+        return secondary
+
+    async def _race_with_hedge(self, pool, primary, launch, timeout, label, tokens, priority, hedge, discard=None):
+        """
+        primaryへの呼び出しが観測レイテンシの分位点までに完了しなければ、別のデプロイメントにも同じ呼び出しを送り、
+        先に成功した方の結果を採用します（残った方はキャンセル）。
+
+        Parameters:
+            pool (DeploymentPool): 呼び出し先のプール
+            primary (Deployment): 最初の呼び出し先
+            launch (callable): (デプロイメント, タイムアウト秒数)を受け取り、コルーチンを返す関数
+            timeout (float): 1試行あたりのタイムアウト（秒）
+            label (str): 呼び出しの種類（レイテンシ分布のキー）
+            tokens (int): レート制限用の推定トークン数
+            priority (int): レート制限の優先度
+            hedge (bool): ヘッジリクエストを送ってよいかどうか
+            discard (callable): 同時に成功した側の結果を破棄する関数（コルーチンを返す）
+
+        Returns:
+            tuple[Deployment, object]: 採用したデプロイメントと結果
+        """
+        delay = pool.hedge_delay(label) if hedge else None
+        if delay is None or delay >= timeout:
+            return primary, await launch(primary, timeout)
+
+        tasks = {asyncio.create_task(launch(primary, timeout)): primary}
+        winner = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                secondary = self._hedge_target(pool, primary, tokens, priority)
+                if secondary is not None:
+                    logger.info("ヘッジリクエストを送信します (%s): %s -> %s", label, primary.name, secondary.name)
+                    tasks[asyncio.create_task(launch(secondary, timeout - delay))] = secondary
+
+            pending = set(tasks)
+            error = None
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                    elif winner is None:
+                        winner = task
+            if winner is None:
+                raise error
+            return tasks[winner], winner.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            # 採用しなかった側が同時に成功していた場合は、その結果を破棄する
+            if discard is not None:
+                for task, deployment in tasks.items():
+                    if task is not winner and task.done() and not task.cancelled() and task.exception() is None:
+                        await discard(deployment, task.result())
+
+    def _run_with_policy(self, pool, attempt_call, label, tokens, priority):
+        """
+        RetryPolicyに従い、期限内でジッター付きバックオフを挟みながら呼び出しを再試行します。
+        再試行では、この呼び出しで失敗していないデプロイメントを優先します。
+
+        Parameters:
+            pool (DeploymentPool): 呼び出し先のプール
+            attempt_call (callable): (デプロイメント, タイムアウト秒数)を受け取り、
+                (パース済みモデル, JSON文字列, 使用トークン数)を返す関数
+            label (str): 呼び出しの種類（ログ・レイテンシ分布のキー）
+            tokens (int): レート制限用の推定トークン数
+            priority (int): レート制限の優先度
+
+        Returns:
+            tuple: attempt_callの結果（失敗時はLLMFailure）
+        """
+        policy = self.retry_policy
+        deadline = time.monotonic() + policy.deadline
+        failure = None
+        tried = set()
+        for attempt in range(1, policy.max_attempts + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            deployment = pool.select(exclude=tried)
+            if deployment is None:
+                failure = self._circuit_open_failure(pool, attempt - 1)
+                break
+            if not deployment.circuit_breaker.allow():
+                failure = self._circuit_open_failure(pool, attempt - 1)
+                tried.add(deployment)
+                continue
+            if not self._admit(deployment, tokens, priority, remaining):
+                deployment.circuit_breaker.release()
+                failure = self._busy_failure(deployment, priority, attempt - 1)
+                break
+            timeout = max(min(policy.attempt_timeout, deadline - time.monotonic()), 0.001)
+            try:
+                return self._call_deployment(pool, deployment, attempt_call, timeout, label, tokens)
+            except Exception as e:
+                tried.add(deployment)
+                failure, delay = self._next_attempt(e, attempt, deadline, label, deployment)
+                if delay is None:
+                    break
+                time.sleep(delay)
+        failure = failure or LLMFailure(kind="timeout", message="呼び出しの期限を超過しました")
+        logger.error("LLM API呼び出しに失敗: %s: %s: %s", label, failure.kind, failure.message)
+        return failure
+
+    async def _run_with_policy_async(self, pool, attempt_call, label, tokens, priority, hedge=False):
+        """
+        _run_with_policyの非同期版。hedgeを指定した場合は、遅い試行に対して別のデプロイメントへ
+        ヘッジリクエストを送ります。
+
+        Parameters:
+            pool (DeploymentPool): 呼び出し先のプール
+            attempt_call (callable): (デプロイメント, タイムアウト秒数)を受け取り、
+                (パース済みモデル, JSON文字列, 使用トークン数)を返すコルーチン関数
+            label (str): 呼び出しの種類（ログ・レイテンシ分布のキー）
+            tokens (int): レート制限用の推定トークン数
+            priority (int): レート制限の優先度
+            hedge (bool): ヘッジリクエストを送ってよいかどうか
+
+        Returns:
+            tuple: attempt_callの結果（失敗時はLLMFailure）
+        """
+        policy = self.retry_policy
+        deadline = time.monotonic() + policy.deadline
+        failure = None
+        tried = set()
+
+        def _launch(deployment, timeout):
+            return self._call_deployment_async(pool, deployment, attempt_call, timeout, label, tokens)
+
+        for attempt in range(1, policy.max_attempts + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            deployment = pool.select(exclude=tried)
+            if deployment is None:
+                failure = self._circuit_open_failure(pool, attempt - 1)
+                break
+            if not deployment.circuit_breaker.allow():
+                failure = self._circuit_open_failure(pool, attempt - 1)
+                tried.add(deployment)
+                continue
+            if not await self._admit_async(deployment, tokens, priority, remaining):
+                deployment.circuit_breaker.release()
+                failure = self._busy_failure(deployment, priority, attempt - 1)
+                break
+            timeout = max(min(policy.attempt_timeout, deadline - time.monotonic()), 0.001)
+            try:
+                _, result = await self._race_with_hedge(
+                    pool, deployment, _launch, timeout, label, tokens, priority, hedge
+                )
+                return result
+            except Exception as e:
+                tried.add(deployment)
+                failure, delay = self._next_attempt(e, attempt, deadline, label, deployment)
+                if delay is None:
+                    break
+                await asyncio.sleep(delay)
+        failure = failure or LLMFailure(kind="timeout", message="呼び出しの期限を超過しました")
+        logger.error("非同期LLM API呼び出しに失敗: %s: %s: %s", label, failure.kind, failure.message)
+        return failure
+
+    @staticmethod
+    def _call_span(label, pool, output_schema):
+        """LLM呼び出し1件（キャッシュ・再試行・エスカレーション込み）のスパン"""
+        return span(
+            "llm.call",
+            SPAN_KIND_CLIENT,
+            **{"llm.call_site": label, "llm.model": pool.primary.model_name, "llm.schema": output_schema.__name__},
+        )
+
+    @staticmethod
+    def _record_metrics(pool, label, seconds, result):
+        """呼び出し1件の結果（所要時間・トークン使用量）をメトリクスとセッションの台帳に記録する"""
+        if isinstance(result, LLMFailure):
+            record_llm_call(label, pool.primary.model_name, seconds, result.kind)
+            return
+        usage = result[2]
+        record_llm_call(
+            label,
+            pool.primary.model_name,
+            seconds,
+            "ok",
+            usage.prompt_tokens if usage is not None else 0,
+            usage.completion_tokens if usage is not None else 0,
+        )
+
+    # -----------------------------------------------------#
+    # LLM呼び出し                                          #
+    # -----------------------------------------------------#
+    def call_llm_with_json_output(
+        self, system_prompt, user_input, output_schema, temperature=0, priority=None, call_site=None
+    ):
         """
         構造化JSONレスポンスを得るためのLLM呼び出しを行います。
 
@@ -77,31 +693,85 @@ class OpenAIService:
             user_input (str): ユーザー入力
             output_schema (pydantic.BaseModel): Pydanticモデルクラス
             temperature (float): 生成の多様性（0～1）
+            priority (int): レート制限の優先度（ratelimit.PRIORITY_*、未指定の場合は呼び出し箇所の設定に従う）
+            call_site (str): 呼び出し箇所（model_routing.DEFAULT_ROUTESのキー、未指定の場合は大型モデル）
 
         Returns:
-            object: 指定されたPydanticモデルのインスタンス
+            object: 指定されたPydanticモデルのインスタンス（失敗時はLLMFailure）
         """
-        try:
-            response = self.client.beta.chat.completions.parse(
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_input},
-                ],
-                model=self.model_name,
-                temperature=temperature,
-                response_format=output_schema,
-            )
+        return self.call_llm_with_messages(
+            self._build_messages(system_prompt, user_input), output_schema, temperature, priority, call_site
+        )
 
-            # JSONレスポンスを取得
-            json_content = response.choices[0].message.parsed
-            logger.debug(f"LLM応答: {json_content}")
+    def call_llm_with_messages(self, messages, output_schema, temperature=0, priority=None, call_site=None):
+        """
+        チャット形式のメッセージ列を渡して構造化JSONレスポンスを得ます。
+        小型モデルに振り分けた呼び出しが失敗・低確信度の場合は、設定に従い大型モデルで呼び直します。
 
-            return json_content
+        Parameters:
+            messages (list[dict]): role/contentを持つメッセージのリスト
+            output_schema (pydantic.BaseModel): Pydanticモデルクラス
+            temperature (float): 生成の多様性（0～1）
+            priority (int): レート制限の優先度（ratelimit.PRIORITY_*、未指定の場合は呼び出し箇所の設定に従う）
+            call_site (str): 呼び出し箇所（model_routing.DEFAULT_ROUTESのキー、未指定の場合は大型モデル）
 
-        except Exception as e:
-            logger.error(f"LLM API呼び出しに失敗: {str(e)}")
-            # 空のJSONオブジェクトを返す
-            return "{}"
+        Returns:
+            object: 指定されたPydanticモデルのインスタンス（失敗時はLLMFailure）
+        """
+        route = self.router.route(call_site)
+        priority = route.priority if priority is None else priority
+        label = call_site or output_schema.__name__
+        pool = self._pool_for(route)
+
+        def _call():
+            result = self._call_pool(pool, messages, output_schema, temperature, priority, label)
+            if self._should_escalate(route, result):
+                logger.info("小型モデルの結果を大型モデルで確認します: %s", call_site)
+                record_escalation(label)
+                current_span().add_event("escalation")
+                result = self._call_pool(self.pool, messages, output_schema, temperature, priority, label)
+            return result
+
+        with self._call_span(label, pool, output_schema) as s:
+            key = self._response_cache_key(pool, messages, output_schema, temperature)
+            result = _call() if key is None else self._call_cached(key, output_schema, label, _call)
+            if isinstance(result, LLMFailure):
+                s.set_error(f"{result.kind}: {result.message}")
+            return result
+
+    def _call_pool(self, pool, messages, output_schema, temperature, priority, label):
+        """
+        1つのプールに対して構造化JSONレスポンスを得ます（カセットの記録・再生を含む）。
+        所要時間とトークン使用量は呼び出し箇所（label）ごとのメトリクスとセッションの台帳に記録します。
+        """
+        key = self._cassette_key(pool, messages, output_schema, temperature)
+        if self.cassette is not None and self.cassette.is_replay:
+            return self._replay(key, output_schema)
+
+        def _attempt(deployment, timeout):
+            with span("openai.chat.completions.create", SPAN_KIND_CLIENT, model=deployment.model_name):
+                response = deployment.client.chat.completions.create(
+                    messages=messages,
+                    model=deployment.model_name,
+                    temperature=temperature,
+                    response_format=response_format_for(output_schema),
+                    timeout=timeout,
+                )
+            with span("pydantic.validate", schema=output_schema.__name__):
+                return self._parsed_content(response, output_schema)
+
+        tokens = self._estimate_request_tokens(messages)
+        started = time.monotonic()
+        result = self._run_with_policy(pool, _attempt, label, tokens, priority)
+        self._record_metrics(pool, label, time.monotonic() - started, result)
+        if isinstance(result, LLMFailure):
+            return result
+
+        # JSONレスポンスを取得
+        json_content, content, _ = result
+        logger.debug("LLM応答: %s", json_content)
+        self._record(pool, key, messages, output_schema, temperature, content)
+        return json_content
 
     def _create_example_from_schema(self, json_schema):
         """スキーマから具体的な例を生成する"""
@@ -120,7 +790,9 @@ class OpenAIService:
                     example[prop] = {"key": "value"}
         return example
 
-    async def call_llm_with_json_output_async(self, system_prompt, user_input, output_schema, temperature=0):
+    async def call_llm_with_json_output_async(
+        self, system_prompt, user_input, output_schema, temperature=0, priority=None, hedge=False, call_site=None
+    ):
         """
         構造化JSONレスポンスを得るためのLLM呼び出しを非同期で行います。
 
@@ -129,33 +801,340 @@ class OpenAIService:
             user_input (str): ユーザー入力
             output_schema (pydantic.BaseModel): Pydanticモデルクラス
             temperature (float): 生成の多様性（0～1）
+            priority (int): レート制限の優先度（ratelimit.PRIORITY_*、未指定の場合は呼び出し箇所の設定に従う）
+            hedge (bool): 応答が遅い場合に別のデプロイメントへヘッジリクエストを送るかどうか
+            call_site (str): 呼び出し箇所（model_routing.DEFAULT_ROUTESのキー、未指定の場合は大型モデル）
+
+        Returns:
+            object: 指定されたPydanticモデルのインスタンス（失敗時はLLMFailure）
+        """
+        return await self.call_llm_with_messages_async(
+            self._build_messages(system_prompt, user_input), output_schema, temperature, priority, hedge, call_site
+        )
+
+    async def call_llm_with_messages_async(
+        self, messages, output_schema, temperature=0, priority=None, hedge=False, call_site=None
+    ):
+        """
+        チャット形式のメッセージ列を渡して構造化JSONレスポンスを非同期で得ます。
+        小型モデルに振り分けた呼び出しが失敗・低確信度の場合は、設定に従い大型モデルで呼び直します。
+
+        Parameters:
+            messages (list[dict]): role/contentを持つメッセージのリスト
+            output_schema (pydantic.BaseModel): Pydanticモデルクラス
+            temperature (float): 生成の多様性（0～1）
+            priority (int): レート制限の優先度（ratelimit.PRIORITY_*、未指定の場合は呼び出し箇所の設定に従う）
+            hedge (bool): 応答が遅い場合に別のデプロイメントへヘッジリクエストを送るかどうか
+            call_site (str): 呼び出し箇所（model_routing.DEFAULT_ROUTESのキー、未指定の場合は大型モデル）
+
+        Returns:
+            object: 指定されたPydanticモデルのインスタンス（失敗時はLLMFailure）
+        """
+        route = self.router.route(call_site)
+        priority = route.priority if priority is None else priority
+        label = call_site or output_schema.__name__
+        pool = self._pool_for(route)
+
+        async def _call():
+            result = await self._call_pool_async(pool, messages, output_schema, temperature, priority, hedge, label)
+            if self._should_escalate(route, result):
+                logger.info("小型モデルの結果を大型モデルで確認します: %s", call_site)
+                record_escalation(label)
+                current_span().add_event("escalation")
+                result = await self._call_pool_async(
+                    self.pool, messages, output_schema, temperature, priority, hedge, label
+                )
+            return result
+
+        with self._call_span(label, pool, output_schema) as s:
+            key = self._response_cache_key(pool, messages, output_schema, temperature)
+            if key is None:
+                result = await _call()
+            else:
+                result = await self._call_cached_async(key, output_schema, label, _call)
+            if isinstance(result, LLMFailure):
+                s.set_error(f"{result.kind}: {result.message}")
+            return result
+
+    async def _call_pool_async(self, pool, messages, output_schema, temperature, priority, hedge, label):
+        """_call_poolの非同期版"""
+        key = self._cassette_key(pool, messages, output_schema, temperature)
+        if self.cassette is not None and self.cassette.is_replay:
+            return self._replay(key, output_schema)
+
+        async def _attempt(deployment, timeout):
+            with span("openai.chat.completions.create", SPAN_KIND_CLIENT, model=deployment.model_name):
+                response = await deployment.get_async_client().chat.completions.create(
+                    messages=messages,
+                    model=deployment.model_name,
+                    temperature=temperature,
+                    response_format=response_format_for(output_schema),
+                    timeout=timeout,
+                )
+            with span("pydantic.validate", schema=output_schema.__name__):
+                return self._parsed_content(response, output_schema)
+
+        tokens = self._estimate_request_tokens(messages)
+        started = time.monotonic()
+        result = await self._run_with_policy_async(pool, _attempt, label, tokens, priority, hedge)
+        self._record_metrics(pool, label, time.monotonic() - started, result)
+        if isinstance(result, LLMFailure):
+            return result
+
+        # JSONレスポンスを取得
+        json_content, content, _ = result
+        logger.debug("LLM応答(非同期): %s", json_content)
+        self._record(pool, key, messages, output_schema, temperature, content)
+        return json_content
+
+    async def stream_llm_with_json_output_async(
+        self,
+        system_prompt,
+        user_input,
+        output_schema,
+        field="message",
+        temperature=0,
+        priority=None,
+        hedge=False,
+        call_site=None,
+    ):
+        """
+        構造化JSONレスポンスをストリーミングで受信し、指定フィールドの文字列を逐次返します。
+
+        Parameters:
+            system_prompt (str): システムプロンプト
+            user_input (str): ユーザー入力
+            output_schema (pydantic.BaseModel): Pydanticモデルクラス
+            field (str): 逐次出力するトップレベルの文字列フィールド名
+            temperature (float): 生成の多様性（0～1）
+            priority (int): レート制限の優先度（ratelimit.PRIORITY_*、未指定の場合は呼び出し箇所の設定に従う）
+            hedge (bool): 最初のチャンクが遅い場合に別のデプロイメントへヘッジリクエストを送るかどうか
+            call_site (str): 呼び出し箇所（model_routing.DEFAULT_ROUTESのキー、未指定の場合は大型モデル）
+
+        Yields:
+            str: 受信済みのフィールド値の差分テキスト
+        """
+        async for delta in self.stream_llm_with_messages_async(
+            self._build_messages(system_prompt, user_input),
+            output_schema,
+            field,
+            temperature,
+            priority,
+            hedge,
+            call_site,
+        ):
+            yield delta
+
+    async def _open_stream(self, deployment, messages, output_schema, temperature, timeout):
+        """
+        ストリームを開き、最初のcontent.deltaを受信するまで読み進めます。
+        失敗・キャンセルされた場合はストリームを閉じ、処理中の件数を戻します。
 
         Returns:
-            object: 指定されたPydanticモデルのインスタンス
+            tuple: (ストリーム, 最初のチャンク（本文がない場合はNone）, 最初のチャンクまでの秒数)
         """
+        deployment.begin()
+        started = time.monotonic()
+        stream = None
+        open_span = start_span("openai.chat.completions.stream", SPAN_KIND_CLIENT, deployment=deployment.name)
         try:
-            async_client = self._get_async_client()
-
-            response = await async_client.beta.chat.completions.parse(
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_input},
-                ],
-                model=self.model_name,
-                temperature=temperature,
-                response_format=output_schema,
+            stream = await (
+                deployment.get_async_client()
+                .beta.chat.completions.stream(
+                    messages=messages,
+                    model=deployment.model_name,
+                    temperature=temperature,
+                    response_format=response_format_for(output_schema),
+                    timeout=timeout,
+                )
+                .__aenter__()
             )
+            first = None
+            while first is None:
+                try:
+                    event = await stream.__anext__()
+                except StopAsyncIteration:
+                    break
+                if event.type == "content.delta":
+                    first = event.delta
+        except BaseException as e:
+            deployment.end()
+            if stream is not None:
+                await stream.close()
+            if isinstance(e, Exception):
+                self._record_failure(deployment, classify_exception(e, 0))
+                open_span.record_exception(e)
+            raise
+        finally:
+            # 最初のチャンクまで（接続・プロンプト処理）の区間を記録する
+            open_span.end()
+        return stream, first, time.monotonic() - started
 
-            # JSONレスポンスを取得
-            json_content = response.choices[0].message.parsed
-            logger.debug(f"LLM応答(非同期): {json_content}")
+    async def _discard_stream(self, deployment, opened):
+        """ヘッジで採用されなかったストリームを閉じる"""
+        stream, _, _ = opened
+        deployment.end()
+        await stream.close()
 
-            return json_content
+    async def stream_llm_with_messages_async(
+        self,
+        messages,
+        output_schema,
+        field="message",
+        temperature=0,
+        priority=None,
+        hedge=False,
+        call_site=None,
+    ):
+        """
+        チャット形式のメッセージ列を渡して構造化JSONレスポンスをストリーミングで受信し、
+        指定フィールドの文字列を逐次返します。
 
-        except Exception as e:
-            logger.error(f"非同期LLM API呼び出しに失敗: {str(e)}")
-            # 空のJSONオブジェクトを返す
-            return "{}"
+        Parameters:
+            messages (list[dict]): role/contentを持つメッセージのリスト
+            output_schema (pydantic.BaseModel): Pydanticモデルクラス
+            field (str): 逐次出力するトップレベルの文字列フィールド名
+            temperature (float): 生成の多様性（0～1）
+            priority (int): レート制限の優先度（ratelimit.PRIORITY_*、未指定の場合は呼び出し箇所の設定に従う）
+            hedge (bool): 最初のチャンクが遅い場合に別のデプロイメントへヘッジリクエストを送るかどうか
+            call_site (str): 呼び出し箇所（model_routing.DEFAULT_ROUTESのキー、未指定の場合は大型モデル）
+
+        Yields:
+            str: 受信済みのフィールド値の差分テキスト
+        """
+        extractor = JsonStringFieldExtractor(field)
+        route = self.router.route(call_site)
+        priority = route.priority if priority is None else priority
+        # ストリーミングは出力済みのテキストを取り消せないため、エスカレーションは行わない
+        pool = self._pool_for(route)
+        key = self._cassette_key(pool, messages, output_schema, temperature)
+        if self.cassette is not None and self.cassette.is_replay:
+            content = self.cassette.lookup(key)
+            if content is None:
+                logger.error("カセットに記録がありません: %s (%s)", output_schema.__name__, key[:12])
+                return
+            delta = extractor.feed(content)
+            if delta:
+                yield delta
+            return
+
+        label = call_site or output_schema.__name__
+        policy = self.retry_policy
+        tokens = self._estimate_request_tokens(messages)
+        started = time.monotonic()
+        deadline = started + policy.deadline
+        tried = set()
+        raw_chunks = []
+        outcome = "timeout"
+        # 要素を返す間は呼び出し元のタスクが入れ替わりうるため、スパンはyieldを含まない区間でのみ親として設定する
+        stream_span = start_span(
+            "llm.stream",
+            SPAN_KIND_CLIENT,
+            **{"llm.call_site": label, "llm.model": pool.primary.model_name, "llm.schema": output_schema.__name__},
+        )
+
+        def _launch(deployment, timeout):
+            return self._open_stream(deployment, messages, output_schema, temperature, timeout)
+
+        try:
+            # 最初のチャンクを受信する前の失敗に限り再試行する（出力済みのテキストは取り消せないため）
+            for attempt in range(1, policy.max_attempts + 1):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                deployment = pool.select(exclude=tried)
+                if deployment is None:
+                    outcome = "circuit_open"
+                    logger.error("サーキットブレーカーが開いているため呼び出しを見送ります: %s", label)
+                    return
+                if not deployment.circuit_breaker.allow():
+                    outcome = "circuit_open"
+                    tried.add(deployment)
+                    continue
+                with use_span(stream_span):
+                    admitted = await self._admit_async(deployment, tokens, priority, remaining)
+                if not admitted:
+                    deployment.circuit_breaker.release()
+                    outcome = "busy"
+                    logger.error(
+                        "混雑のため呼び出しを受け付けませんでした: %s", self._busy_failure(deployment, priority, 0)
+                    )
+                    return
+                timeout = max(min(policy.attempt_timeout, deadline - time.monotonic()), 0.001)
+                try:
+                    with use_span(stream_span):
+                        deployment, (stream, first, ttft) = await self._race_with_hedge(
+                            pool,
+                            deployment,
+                            _launch,
+                            timeout,
+                            label,
+                            tokens,
+                            priority,
+                            hedge,
+                            discard=self._discard_stream,
+                        )
+                except Exception as e:
+                    tried.add(deployment)
+                    with use_span(stream_span):
+                        failure, delay = self._next_attempt(e, attempt, deadline, label, deployment)
+                    outcome = failure.kind
+                    if delay is None:
+                        logger.error("ストリーミングLLM API呼び出しに失敗: %s: %s", failure.kind, failure.message)
+                        return
+                    await asyncio.sleep(delay)
+                    continue
+
+                record_ttft(label, deployment.model_name, ttft)
+                stream_span.set_attribute("llm.ttft", ttft)
+                stream_span.set_attribute("deployment", deployment.name)
+                # 受信の途中で呼び出し元が読むのをやめた場合はcancelledとして記録する
+                outcome = "cancelled"
+                completed = False
+                try:
+                    chunk = first
+                    while chunk is not None:
+                        raw_chunks.append(chunk)
+                        delta = extractor.feed(chunk)
+                        if delta:
+                            yield delta
+                        chunk = None
+                        while chunk is None:
+                            try:
+                                event = await stream.__anext__()
+                            except StopAsyncIteration:
+                                break
+                            if event.type == "content.delta":
+                                chunk = event.delta
+                    completed = True
+                except Exception as e:
+                    failure = classify_exception(e, attempt)
+                    outcome = failure.kind
+                    self._record_failure(deployment, failure)
+                    logger.error("ストリーミングLLM API呼び出しが途中で失敗: %s: %s", failure.kind, failure.message)
+                finally:
+                    deployment.end(ttft if completed else None)
+                    await stream.close()
+                if completed:
+                    outcome = "ok"
+                    self._record_success(pool, deployment, label, ttft, tokens, None)
+                    self._record(pool, key, messages, output_schema, temperature, "".join(raw_chunks))
+                return
+            logger.error("ストリーミングLLM API呼び出しを完了できませんでした: %s: %s", label, outcome)
+        finally:
+            stream_span.set_attribute("llm.outcome", outcome)
+            if outcome != "ok":
+                stream_span.set_error(outcome)
+            stream_span.end()
+            # ストリーミング応答には使用量が含まれないため、トークン数は推定値で記録する
+            record_llm_call(
+                label,
+                pool.primary.model_name,
+                time.monotonic() - started,
+                outcome,
+                self._estimate_prompt_tokens(messages) if raw_chunks else 0,
+                estimate_tokens("".join(raw_chunks)) if raw_chunks else 0,
+            )
 
     def _create_default_response(self, json_schema):
         """
@@ -183,3 +1162,240 @@ class OpenAIService:
                 elif details.get("type") == "object":
                     default_response[prop] = {}
         return default_response
+
+
+# -----------------------------------------------------#
+# 構造化出力のスキーマ                                 #
+# -----------------------------------------------------#
+@functools.lru_cache(maxsize=None)
+def response_format_for(output_schema):
+    """
+    Pydanticモデルをresponse_format（strictなjson_schema）に変換する（モデルクラスごとに1度だけ計算）。
+    SDKのparse()は呼び出しのたびにこの変換を行うため、変換済みのものをcreate()に渡して使い回します。
+
+    Parameters:
+        output_schema (pydantic.BaseModel): Pydanticモデルクラス
+
+    Returns:
+        dict: chat.completions.createのresponse_formatに渡す値
+    """
+    from openai.lib._parsing._completions import type_to_response_format_param
+
+    return type_to_response_format_param(output_schema)
+
+
+# -----------------------------------------------------#
+# リクエストの指紋                                     #
+# -----------------------------------------------------#
+@functools.lru_cache(maxsize=None)
+def _schema_digest(output_schema):
+    """Pydanticモデルのスキーマをハッシュ化する（モデルクラスごとに1度だけ計算）"""
+    schema = json.dumps(output_schema.model_json_schema(), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(schema.encode("utf-8")).hexdigest()
+
+
+def request_fingerprint(model_name, messages, output_schema, temperature):
+    """
+    LLMリクエストを一意に表すハッシュを返します（モデル・メッセージ・スキーマ・温度から算出）
+
+    Parameters:
+        model_name (str): モデル名（デプロイメント名）
+        messages (list[dict]): role/contentを持つメッセージのリスト
+        output_schema (pydantic.BaseModel): Pydanticモデルクラス
+        temperature (float): 生成の多様性
+
+    Returns:
+        str: SHA-256の16進文字列
+    """
+    payload = json.dumps(
+        {
+            "model": model_name,
+            "messages": messages,
+            "schema": _schema_digest(output_schema),
+            "temperature": temperature,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# -----------------------------------------------------#
+# トークン数の見積もり                                 #
+# -----------------------------------------------------#
+def estimate_tokens(text):
+    """
+    テキストのトークン数を概算します（tokenizerを使わない軽量な見積もり）。
+    ASCII文字は約4文字で1トークン、それ以外（日本語など）は1文字1トークンとして数えます。
+
+    Parameters:
+        text (str): 対象テキスト
+
+    Returns:
+        int: 推定トークン数
+    """
+    if not text:
+        return 0
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars) + 1
+
+
+# -----------------------------------------------------#
+# OpenAI サービスレジストリ                            #
+# -----------------------------------------------------#
+_service_registry: Dict[tuple, OpenAIService] = {}
+_service_registry_lock = threading.Lock()
+
+
+def get_openai_service(endpoint=ENDPOINT, api_key=API_KEY, model_name=MODEL_NAME, api_version=API_VERSION):
+    """
+    プロセス全体で共有するOpenAIServiceを取得します。
+    エンドポイント・デプロイメント・APIバージョンの組み合わせごとに1つだけ生成し、
+    クライアントとコネクションプールをセッション間で共有します。
+
+    Parameters:
+        endpoint (str): Azure OpenAIのエンドポイント
+        api_key (str): Azure OpenAIのAPIキー
+        model_name (str): 使用するモデル名（デプロイメント名）
+        api_version (str): APIバージョン
+
+    Returns:
+        OpenAIService: 共有のサービスインスタンス
+    """
+    key = (endpoint, model_name, api_version)
+    with _service_registry_lock:
+        service = _service_registry.get(key)
+        if service is None:
+            logger.info("OpenAIServiceを生成します: deployment=%s, api_version=%s", model_name, api_version)
+            service = OpenAIService(endpoint=endpoint, api_key=api_key, model_name=model_name, api_version=api_version)
+            _service_registry[key] = service
+    return service
+
+
+# -----------------------------------------------------#
+# ストリーミングJSONの逐次パーサー                     #
+# -----------------------------------------------------#
+class JsonStringFieldExtractor:
+    """
+    ストリーミングで届くJSONオブジェクトから、トップレベルの文字列フィールドの値を逐次取り出します。
+    エスケープシーケンスがチャンク境界で分割された場合は、続きが届くまで出力を保留します。
+    """
+
+    def __init__(self, field):
+        self.field = field
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._string_start = 0
+        self._last_string = None
+        self._current_key = None
+        self._in_value = False
+        self.done = False
+
+    def feed(self, chunk):
+        """
+        受信したチャンクを追加し、新たに確定したフィールド値のテキストを返します。
+
+        Parameters:
+            chunk (str): 受信したJSON文字列の断片
+
+        Returns:
+            str: 新たに確定したテキスト（なければ空文字）
+        """
+        if self.done:
+            return ""
+        self._buffer += chunk
+        output = []
+        while self._pos < len(self._buffer) and not self.done:
+            if self._in_value:
+                progressed = self._read_value_char(output)
+            else:
+                progressed = self._scan_structure_char()
+            if not progressed:
+                break
+        return "".join(output)
+
+    def _scan_structure_char(self):
+        """
+        対象フィールドの値が始まるまで、JSONの構造を1文字ずつ読み進める。
+        続きが未着で確定できない場合はFalseを返す。
+        """
+        char = self._buffer[self._pos]
+        if self._in_string:
+            if char == "\\":
+                if self._pos + 1 >= len(self._buffer):
+                    return False
+                self._pos += 2
+                return True
+            if char == '"':
+                self._in_string = False
+                if self._depth == 1:
+                    raw = self._buffer[self._string_start : self._pos]
+                    try:
+                        self._last_string = json.loads(f'"{raw}"')
+                    except ValueError:
+                        self._last_string = None
+            self._pos += 1
+            return True
+
+        if char == '"':
+            if self._depth == 1 and self._current_key == self.field:
+                self._in_value = True
+            else:
+                self._in_string = True
+                self._string_start = self._pos + 1
+            self._current_key = None
+        elif char == ":" and self._depth == 1:
+            self._current_key = self._last_string
+            self._last_string = None
+        elif char in "{[":
+            self._depth += 1
+            self._current_key = None
+        elif char in "}]":
+            self._depth -= 1
+            self._current_key = None
+        elif not char.isspace():
+            self._current_key = None
+            self._last_string = None
+        self._pos += 1
+        return True
+
+    def _read_value_char(self, output):
+        """
+        対象フィールドの値を1文字（またはエスケープシーケンス1つ）読み進める。
+        続きが未着で確定できない場合はFalseを返す。
+        """
+        char = self._buffer[self._pos]
+        if char == '"':
+            self._in_value = False
+            self.done = True
+            self._pos += 1
+            return True
+        if char != "\\":
+            output.append(char)
+            self._pos += 1
+            return True
+
+        remaining = len(self._buffer) - self._pos
+        if remaining < 2:
+            return False
+        if self._buffer[self._pos + 1] != "u":
+            output.append(json.loads(f'"{self._buffer[self._pos : self._pos + 2]}"'))
+            self._pos += 2
+            return True
+        if remaining < 6:
+            return False
+        code = int(self._buffer[self._pos + 2 : self._pos + 6], 16)
+        length = 6
+        if 0xD800 <= code <= 0xDBFF:
+            # サロゲートペアは下位側の\uXXXXが揃ってから復号する
+            if remaining < 12:
+                tail = self._buffer[self._pos + 6 : self._pos + 12]
+                if "\\u".startswith(tail[:2]):
+                    return False
+            elif self._buffer[self._pos + 6 : self._pos + 8] == "\\u":
+                length = 12
+        output.append(json.loads(f'"{self._buffer[self._pos : self._pos + length]}"', strict=False))
+        self._pos += length
+        return True
@@ -0,0 +1,6 @@
+# config.py
+from dotenv import load_dotenv
+
+# 環境変数を.envファイルから読み込む
+# 各モジュールはインポート時に設定値を読むため、環境変数を参照するモジュールは最初にこのモジュールをインポートする
+load_dotenv()
@@ -0,0 +1,255 @@
+# deployment_pool.py
+import json
+import os
+import random
+import threading
+from collections import deque
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+import config  # noqa: F401
+from ratelimit import get_rate_limiter
+from resilience import get_circuit_breaker
+
+# -----------------------------------------------------#
+# デプロイメントプールの設定                           #
+# -----------------------------------------------------#
+# 複数リージョンのデプロイメント（JSON配列、未指定の項目はAZURE_OPENAI_*の値を使う）
+# 例: [{"endpoint": "https://east.openai.azure.com"}, {"endpoint": "https://west.openai.azure.com", "api_key": "..."}]
+DEPLOYMENTS_JSON = os.getenv("AZURE_OPENAI_DEPLOYMENTS")
+# ヘッジリクエスト（応答が遅い場合に別デプロイメントへ重複して送る）の設定
+HEDGE_ENABLED = os.getenv("GRACHALLE_HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_QUANTILE = float(os.getenv("GRACHALLE_HEDGE_QUANTILE", "0.95"))
+HEDGE_MIN_DELAY = float(os.getenv("GRACHALLE_HEDGE_MIN_DELAY", "0.2"))  # 秒
+HEDGE_MIN_SAMPLES = int(os.getenv("GRACHALLE_HEDGE_MIN_SAMPLES", "20"))
+# 観測レイテンシの指数移動平均の重み
+LATENCY_EWMA_ALPHA = 0.2
+
+
+class DeploymentConfig(BaseModel):
+    """1つのデプロイメント（エンドポイントとモデルの組）の接続情報"""
+
+    endpoint: Optional[str] = Field(default=None, description="Azure OpenAIのエンドポイント")
+    api_key: Optional[str] = Field(default=None, description="Azure OpenAIのAPIキー")
+    model_name: Optional[str] = Field(default=None, description="モデル名（デプロイメント名）")
+    api_version: Optional[str] = Field(default=None, description="APIバージョン")
+
+
+def load_deployment_configs(endpoint, api_key, model_name, api_version, deployments_json=DEPLOYMENTS_JSON):
+    """
+    環境変数AZURE_OPENAI_DEPLOYMENTS（またはdeployments_json）からデプロイメントの一覧を読み込みます
+    （未設定の場合はNone）。各項目で省略された値は引数の値で補います。
+    """
+    if not deployments_json:
+        return None
+    configs = []
+    for item in json.loads(deployments_json):
+        config = DeploymentConfig.model_validate(item)
+        configs.append(
+            DeploymentConfig(
+                endpoint=config.endpoint or endpoint,
+                api_key=config.api_key or api_key,
+                model_name=config.model_name or model_name,
+                api_version=config.api_version or api_version,
+            )
+        )
+    return configs
+
+
+# -----------------------------------------------------#
+# レイテンシの観測                                     #
+# -----------------------------------------------------#
+class LatencyWindow:
+    """直近の観測レイテンシを保持し、分位点を求める"""
+
+    def __init__(self, size=256):
+        self._samples = deque(maxlen=size)
+
+    def observe(self, seconds):
+        self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def quantile(self, ratio):
+        """分位点（観測がない場合はNone）"""
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(int(ratio * len(ordered)), len(ordered) - 1)]
+
+
+class Deployment:
+    """
+    1つのデプロイメントへの接続と、その状態（処理中の件数・観測レイテンシ・サーキットブレーカー・レート制限）
+    """
+
+    def __init__(self, config: DeploymentConfig, http_limits):
+        """
+        Parameters:
+            config (DeploymentConfig): 接続情報
+            http_limits (dict): コネクションプールの設定（httpx.Limitsの引数）
+        """
+        self.config = config
+        self.endpoint = config.endpoint
+        self.model_name = config.model_name
+        self.http_limits = http_limits
+        # クライアントは必要時に初期化する（openai SDKのインポートも初回の生成まで遅らせる）
+        self._client = None
+        self._async_client = None
+        self._client_lock = threading.Lock()
+        # 同じデプロイメントを使うサービス間でサーキットブレーカーとクォータを共有する
+        self.circuit_breaker = get_circuit_breaker((config.endpoint, config.model_name))
+        self.rate_limiter = get_rate_limiter((config.endpoint, config.model_name))
+        self.outstanding = 0
+        self.ewma_latency = None
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        return f"{self.model_name}@{self.endpoint}"
+
+    def _client_options(self):
+        """同期・非同期クライアントに共通の設定"""
+        return {
+            "azure_endpoint": self.config.endpoint,
+            "api_key": self.config.api_key,
+            "api_version": self.config.api_version,
+            # 再試行はRetryPolicyで制御するため、SDK側の自動再試行は無効にする
+            "max_retries": 0,
+        }
+
+    @property
+    def client(self):
+        """
+        同期APIクライアントを取得（遅延初期化）
+        """
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import httpx
+                    from openai import AzureOpenAI, DefaultHttpxClient
+
+                    self._client = AzureOpenAI(
+                        http_client=DefaultHttpxClient(limits=httpx.Limits(**self.http_limits)),
+                        **self._client_options(),
+                    )
+        return self._client
+
+    def get_async_client(self):
+        """
+        非同期APIクライアントを取得（遅延初期化）
+        """
+        if self._async_client is None:
+            with self._client_lock:
+                if self._async_client is None:
+                    import httpx
+                    from openai import AsyncAzureOpenAI, DefaultAsyncHttpxClient
+
+                    self._async_client = AsyncAzureOpenAI(
+                        http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(**self.http_limits)),
+                        **self._client_options(),
+                    )
+        return self._async_client
+
+    def begin(self):
+        """呼び出しの開始を記録する"""
+        with self._lock:
+            self.outstanding += 1
+
+    def end(self, latency=None):
+        """呼び出しの終了を記録する（成功した場合はレイテンシも記録）"""
+        with self._lock:
+            self.outstanding -= 1
+            if latency is not None:
+                if self.ewma_latency is None:
+                    self.ewma_latency = latency
+                else:
+                    self.ewma_latency += LATENCY_EWMA_ALPHA * (latency - self.ewma_latency)
+
+
+# -----------------------------------------------------#
+# デプロイメントプール                                 #
+# -----------------------------------------------------#
+class DeploymentPool:
+    """
+    複数のデプロイメントから、処理中の件数と観測レイテンシに基づいて呼び出し先を選ぶプール。
+    呼び出しの種類ごとのレイテンシ分布も保持し、ヘッジリクエストの待ち時間の算出に使います。
+    """
+
+    def __init__(self, deployments, hedge_enabled=HEDGE_ENABLED):
+        """
+        Parameters:
+            deployments (list[Deployment]): デプロイメントの一覧（先頭が既定）
+            hedge_enabled (bool): ヘッジリクエストを有効にするかどうか
+        """
+        if not deployments:
+            raise ValueError("デプロイメントが1つも指定されていません")
+        self.deployments = deployments
+        self.hedge_enabled = hedge_enabled
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    @property
+    def primary(self):
+        return self.deployments[0]
+
+    def _expected_latency(self, deployment):
+        """未観測のデプロイメントは観測済みの最小値とみなし、まず試されるようにする"""
+        if deployment.ewma_latency is not None:
+            return deployment.ewma_latency
+        observed = [d.ewma_latency for d in self.deployments if d.ewma_latency is not None]
+        return min(observed) if observed else 1.0
+
+    def select(self, exclude=()):
+        """
+        呼び出し先を選びます（遮断中のデプロイメントは除外し、(処理中の件数+1)×平均レイテンシが最小のもの）
+
+        Parameters:
+            exclude (Iterable[Deployment]): 候補から外すデプロイメント（この呼び出しで失敗したものなど）
+
+        Returns:
+            Deployment: 呼び出し先（候補がない場合はNone）
+        """
+        candidates = [d for d in self.deployments if d not in exclude and not d.circuit_breaker.is_open()]
+        if not candidates:
+            # 失敗したデプロイメントしか残っていない場合は、遮断されていなければ再び使う
+            candidates = [d for d in self.deployments if not d.circuit_breaker.is_open()]
+        if not candidates:
+            return None
+        scored = [((d.outstanding + 1) * self._expected_latency(d), random.random(), d) for d in candidates]
+        return min(scored, key=lambda item: item[:2])[2]
+
+    def observe(self, label, seconds):
+        """呼び出しの種類ごとのレイテンシ（ストリーミングは最初のチャンクまで）を記録する"""
+        with self._lock:
+            window = self._latencies.get(label)
+            if window is None:
+                window = self._latencies[label] = LatencyWindow()
+            window.observe(seconds)
+
+    def hedge_delay(self, label):
+        """
+        ヘッジリクエストを送るまでの待ち時間（観測したレイテンシの分位点）を返します。
+        無効な場合・デプロイメントが1つの場合・観測が足りない場合はNoneを返します。
+        """
+        if not self.hedge_enabled or len(self.deployments) < 2:
+            return None
+        with self._lock:
+            window = self._latencies.get(label)
+            if window is None or len(window) < HEDGE_MIN_SAMPLES:
+                return None
+            return max(window.quantile(HEDGE_QUANTILE), HEDGE_MIN_DELAY)
+
+    def stats(self):
+        """デプロイメントごとの処理中の件数・平均レイテンシ・ブレーカーの状態を返す"""
+        return [
+            {
+                "deployment": d.name,
+                "outstanding": d.outstanding,
+                "ewma_latency": d.ewma_latency,
+                "circuit": d.circuit_breaker.state,
+            }
+            for d in self.deployments
+        ]
@@ -6,7 +6,8 @@ from typing import Optional
 
 from pydantic import BaseModel, Field
 
-from common import OpenAIService, logger
+from common import get_openai_service, logger
+from resilience import unwrap_llm_result
 
 # -----------------------------------------------------#
 # Pydanticモデル - Parallelizationパターン用           #
@@ -31,6 +32,22 @@ class EvaluationResult(BaseModel):
     result: str = Field(default="評価データを生成できませんでした。", description="会話に対する具体的なフィードバック")
 
 
+class TranscriptEvaluation(BaseModel):
+    """1件の会話の評価結果（各ステージの結果と最終レポート）を格納するモデル"""
+
+    score: Optional[int] = Field(default=None, description="会話の評価スコア (0-100)、算出できなかった場合はNone")
+    feedback: Optional[str] = Field(default=None, description="会話に対するフィードバック、生成できなかった場合はNone")
+    report: str = Field(description="評価レポート")
+
+
+class TurnAssessment(BaseModel):
+    """1ターン分のユーザー回答の評価を格納するモデル"""
+
+    score: int = Field(description="このターンの回答の評価スコア (0-100)")
+    mistakes: list[str] = Field(default_factory=list, description="回答に含まれる誤り（なければ空）")
+    feedback: str = Field(description="このターンの回答に対する短いフィードバック")
+
+
 # -----------------------------------------------------#
 # 評価結果　　　　　　　　　　　　　　　　                #
 # -----------------------------------------------------#
@@ -39,25 +56,37 @@ class EvaluationResult(BaseModel):
 class ConversationEvaluator:
     """会話の評価を行うための専用クラス"""
 
-    def __init__(self):
-        self.openai_service = OpenAIService()
+    def __init__(self, call_timeout: float = 60.0, openai_service=None):
+        """
+        Parameters:
+            call_timeout (float): 評価ステージ1回あたりのLLM呼び出しのタイムアウト秒数
+            openai_service (OpenAIService): 利用するサービス（未指定の場合はプロセス共有のものを利用）
+        """
+        self.openai_service = openai_service or get_openai_service()
         self.conversation_full = ""
+        self.call_timeout = call_timeout
+
+    @staticmethod
+    def format_conversation(conversation_history: list) -> str:
+        """会話履歴を評価プロンプトに渡すテキストに変換します"""
+        return "\n".join([f"{item['role']}: {item['content']}" for item in conversation_history])
 
     def set_conversation_history(self, conversation_history: list):
         """
         会話履歴を設定します
         """
-        self.conversation_full = "\n".join([f"{item['role']}: {item['content']}" for item in conversation_history])
-
-    async def examination_score(self, language: str, level: str) -> EvaluationResult:
-        """
-        会話履歴を評価し、スコアとフィードバックを生成します
-        """
-        # システムプロンプト
-        system_prompt = (
+        self.conversation_full = self.format_conversation(conversation_history)
+
+    # -----------------------------------------------------#
+    # プロンプトの組み立て                                 #
+    # -----------------------------------------------------#
+    @staticmethod
+    def build_score_prompt(language: str, level: str) -> str:
+        """スコア算出のシステムプロンプトを組み立てます（ユーザー入力は会話全文）"""
+        return (
             f"{language}の会話能力を評価してください。"
             f"評価対象は{level}レベルの学習者です。"
-            "以下の観点からuserの入力文について1-10点で評価し、具体的なフィードバックを提供してください：\n"
+            "以下の観点からuserの入力文について0-100点で評価し、具体的なフィードバックを提供してください：\n"
             "- 適切な表現の使用\n"
             "- 文法的な正確さ\n"
             "- 応答の適切さと流暢さ\n"
@@ -65,46 +94,97 @@ class ConversationEvaluator:
             "回答はJSON形式で、スコア(score)とフィードバック(feedback)を含めてください。"
         )
 
+    @staticmethod
+    def build_feedback_prompt(language: str, level: str) -> str:
+        """フィードバック生成のシステムプロンプトを組み立てます（ユーザー入力は会話全文）"""
+        return (
+            f"{language}の会話におけるユーザーの回答に対するフィードバックを生成してください。"
+            f"レベルは{level}です。以下の点について具体的にコメントしてください：\n"
+            "1. 語彙の使用\n"
+            "2. 文法\n"
+            "3. 発話の一貫性\n"
+            "4. コミュニケーション能力\n"
+            "5. 強みと改善点\n"
+            "フィードバックは日本語で、具体的な例を挙げてください。"
+        )
+
+    @staticmethod
+    def build_report_prompt(score, feedback) -> tuple[str, str]:
+        """評価レポート生成のシステムプロンプトとユーザー入力を組み立てます"""
+        system_prompt = (
+            "以下の評価情報を確認してレポートとしてユーザーに返答してください。"
+            "レポートには、スコア、フィードバック、強みと改善点を含めてください。"
+            "出力は日本語で、具体的な例を挙げてください。"
+            "■評価情報\n"
+            f"スコア(100点満点): {score}\n"
+            f"フィードバック: {feedback}\n"
+        )
+        user_content = f"公平公正な評価結果を提供してください。"
+        return system_prompt, user_content
+
+    @staticmethod
+    def build_turn_prompt(language: str, level: str, question: str, answer: str) -> tuple[str, str]:
+        """ターン別評価のシステムプロンプトとユーザー入力を組み立てます"""
+        system_prompt = (
+            f"{language}の会話能力を評価してください。"
+            f"評価対象は{level}レベルの学習者です。"
+            "試験官の質問に対するユーザーの回答を、表現の適切さ・文法的な正確さ・応答の適切さ・語彙の観点から"
+            "0-100点で評価し、誤りの一覧と短いフィードバックを日本語でJSON形式で返してください。"
+        )
+        user_content = f"assistant: {question}\nuser: {answer}"
+        return system_prompt, user_content
+
+    # -----------------------------------------------------#
+    # 評価ステージ                                         #
+    # -----------------------------------------------------#
+    async def examination_score(self, language: str, level: str, conversation_full: str = None) -> EvaluationResult:
+        """
+        会話履歴を評価し、スコアとフィードバックを生成します
+        （conversation_fullを省略した場合はset_conversation_historyで設定した会話を評価）
+        """
+        # システムプロンプト
+        system_prompt = self.build_score_prompt(language, level)
+        if conversation_full is None:
+            conversation_full = self.conversation_full
+
         try:
 
             # JSONで評価結果を取得
-            result = await self.openai_service.call_llm_with_json_output_async(
-                system_prompt, self.conversation_full, EvaluationScore
+            result = unwrap_llm_result(
+                await self.openai_service.call_llm_with_json_output_async(
+                    system_prompt, conversation_full, EvaluationScore, call_site="evaluation_score"
+                )
             )
 
             return result
 
         except Exception as e:
-            logger.error(f"会話評価中にエラーが発生しました: {str(e)}")
+            logger.error("会話評価中にエラーが発生しました: %s", e)
             return "評価処理中にエラーが発生しました。一般的なフィードバック：会話の継続性を保ち、質問に直接回答するよう心がけてください。"
 
-    async def examination_feedback(self, language: str, level: str) -> str:
+    async def examination_feedback(self, language: str, level: str, conversation_full: str = None) -> str:
         """
         ユーザーの回答に対するフィードバックコメントを生成します
+        （conversation_fullを省略した場合はset_conversation_historyで設定した会話を評価）
         """
 
         # システムプロンプト
-        system_prompt = (
-            f"{language}の会話におけるユーザーの回答に対するフィードバックを生成してください。"
-            f"レベルは{level}です。以下の点について具体的にコメントしてください：\n"
-            "1. 語彙の使用\n"
-            "2. 文法\n"
-            "3. 発話の一貫性\n"
-            "4. コミュニケーション能力\n"
-            "5. 強みと改善点\n"
-            "フィードバックは日本語で、具体的な例を挙げてください。"
-        )
+        system_prompt = self.build_feedback_prompt(language, level)
+        if conversation_full is None:
+            conversation_full = self.conversation_full
 
         try:
             # フィードバックを取得
-            result = await self.openai_service.call_llm_with_json_output_async(
-                system_prompt, self.conversation_full, EvaluationFeedback
+            result = unwrap_llm_result(
+                await self.openai_service.call_llm_with_json_output_async(
+                    system_prompt, conversation_full, EvaluationFeedback, call_site="evaluation_feedback"
+                )
             )
 
             return result
 
         except Exception as e:
-            logger.error(f"フィードバック生成中にエラーが発生しました: {str(e)}")
+            logger.error("フィードバック生成中にエラーが発生しました: %s", e)
             return "フィードバックを生成できませんでした。会話の内容を見直してください。"
 
     async def result_report(self, score, feedback) -> str:
@@ -112,29 +192,170 @@ class ConversationEvaluator:
         スコアとフィードバック内容を統合し詳細な評価レポートを生成します
         """
 
-        system_prompt = (
-            "以下の評価情報を確認してレポートとしてユーザーに返答してください。"
-            "レポートには、スコア、フィードバック、強みと改善点を含めてください。"
-            "出力は日本語で、具体的な例を挙げてください。"
-            "■評価情報\n"
-            f"スコア(100点満点): {score}\n"
-            f"フィードバック: {feedback}\n"
-        )
-
-        user_content = f"公平公正な評価結果を提供してください。"
+        system_prompt, user_content = self.build_report_prompt(score, feedback)
 
         try:
             # 詳細分析を取得
-            result = await self.openai_service.call_llm_with_json_output_async(
-                system_prompt, user_content, EvaluationResult
+            result = unwrap_llm_result(
+                await self.openai_service.call_llm_with_json_output_async(
+                    system_prompt, user_content, EvaluationResult, call_site="evaluation_report"
+                )
             )
 
             return result.result
 
         except Exception as e:
-            logger.error(f"詳細レポート生成中にエラーが発生しました: {str(e)}")
+            logger.error("詳細レポート生成中にエラーが発生しました: %s", e)
             return "詳細な言語分析を生成できませんでした。"
 
+    async def _with_timeout(self, coro, stage: str):
+        """
+        評価ステージをタイムアウト付きで実行します。失敗時はNoneを返します
+        """
+        try:
+            return await asyncio.wait_for(coro, timeout=self.call_timeout)
+        except asyncio.TimeoutError:
+            logger.error("%sがタイムアウトしました（%s秒）", stage, self.call_timeout)
+        except Exception as e:
+            logger.error("%s中にエラーが発生しました: %s", stage, e)
+        return None
+
+    async def evaluate_stream(self, language: str, level: str):
+        """
+        スコア算出とフィードバック生成を並列に実行し、評価レポートをセクション単位で逐次返します。
+        いずれかのステージが失敗・タイムアウトした場合も、得られた結果のみでレポートを作成します。
+
+        Yields:
+            str: 評価結果のセクション（スコア → 詳細レポートの順）
+        """
+        score_task = asyncio.create_task(self._with_timeout(self.examination_score(language, level), "スコア算出"))
+        feedback_task = asyncio.create_task(
+            self._with_timeout(self.examination_feedback(language, level), "フィードバック生成")
+        )
+        try:
+            score = await score_task
+            score_value = score.score if isinstance(score, EvaluationScore) else None
+            if score_value is None:
+                yield "■スコア: 算出できませんでした\n\n"
+            else:
+                yield f"■スコア: {score_value}/100\n\n"
+
+            feedback = await feedback_task
+            feedback_text = feedback.feedback if isinstance(feedback, EvaluationFeedback) else None
+        finally:
+            for task in (score_task, feedback_task):
+                if not task.done():
+                    task.cancel()
+
+        if score_value is None and feedback_text is None:
+            yield EvaluationResult().result
+            return
+
+        report = await self._with_timeout(
+            self.result_report(
+                score_value if score_value is not None else "算出できませんでした",
+                feedback_text or "フィードバックを生成できませんでした。",
+            ),
+            "詳細レポート生成",
+        )
+        yield report or "詳細な言語分析を生成できませんでした。"
+
+    async def assess_turn(self, language: str, level: str, question: str, answer: str):
+        """
+        試験官の質問に対するユーザーの1ターン分の回答を評価します（試験中にバックグラウンドで実行）
+
+        Returns:
+            TurnAssessment: 評価結果（失敗・タイムアウトした場合はNone）
+        """
+        system_prompt, user_content = self.build_turn_prompt(language, level, question, answer)
+
+        result = await self._with_timeout(
+            self.openai_service.call_llm_with_json_output_async(
+                system_prompt, user_content, TurnAssessment, call_site="turn_assessment"
+            ),
+            "ターン評価",
+        )
+        return result if isinstance(result, TurnAssessment) else None
+
+    async def report_stream_from_assessments(self, assessments: list[dict]):
+        """
+        試験中に算出済みのターン別評価を集計し、評価レポートをセクション単位で逐次返します。
+        LLM呼び出しは最終レポートの1回のみです。
+
+        Parameters:
+            assessments (list[dict]): ターン別評価（turn, score, mistakes, feedbackを含む）
+
+        Yields:
+            str: 評価結果のセクション（スコア → 詳細レポートの順）
+        """
+        assessments = sorted(assessments, key=lambda item: item["turn"])
+        score_value = round(sum(item["score"] for item in assessments) / len(assessments))
+        yield f"■スコア: {score_value}/100\n\n"
+
+        feedback_lines = []
+        for item in assessments:
+            feedback_lines.append(f"ターン{item['turn']}: {item['feedback']}")
+            feedback_lines.extend([f"  - 誤り: {mistake}" for mistake in item["mistakes"]])
+        report = await self._with_timeout(
+            self.result_report(score_value, "\n".join(feedback_lines)), "詳細レポート生成"
+        )
+        yield report or "詳細な言語分析を生成できませんでした。"
+
+    async def evaluate_transcript(
+        self,
+        conversation_history: list,
+        language: str,
+        level: str,
+        score: Optional[int] = None,
+        feedback: Optional[str] = None,
+    ) -> TranscriptEvaluation:
+        """
+        保存済みの会話履歴を評価します。インスタンスの状態を変更しないため、複数の会話を並行に評価できます。
+        scoreまたはfeedbackを指定した場合は、そのステージのLLM呼び出しを省略します（Batch APIの結果を使う場合など）。
+
+        Parameters:
+            conversation_history (list): role/contentを持つ会話履歴
+            language (str): 出題言語
+            level (str): 出題難易度
+            score (int): 算出済みのスコア
+            feedback (str): 生成済みのフィードバック
+
+        Returns:
+            TranscriptEvaluation: スコア・フィードバック・評価レポート
+        """
+        conversation_full = self.format_conversation(conversation_history)
+        stages = []
+        if score is None:
+            stages.append(self._with_timeout(self.examination_score(language, level, conversation_full), "スコア算出"))
+        if feedback is None:
+            stages.append(
+                self._with_timeout(self.examination_feedback(language, level, conversation_full), "フィードバック生成")
+            )
+        for result in await asyncio.gather(*stages):
+            if isinstance(result, EvaluationScore):
+                score = result.score
+            elif isinstance(result, EvaluationFeedback):
+                feedback = result.feedback
+
+        if score is None and feedback is None:
+            return TranscriptEvaluation(report=EvaluationResult().result)
+        report = await self._with_timeout(
+            self.result_report(
+                score if score is not None else "算出できませんでした",
+                feedback or "フィードバックを生成できませんでした。",
+            ),
+            "詳細レポート生成",
+        )
+        return TranscriptEvaluation(
+            score=score, feedback=feedback, report=report or "詳細な言語分析を生成できませんでした。"
+        )
+
+    async def evaluate(self, language: str, level: str) -> str:
+        """
+        スコア算出とフィードバック生成を並列に実行し、評価レポート全文を返します
+        """
+        return "".join([section async for section in self.evaluate_stream(language, level)])
+
 
 if __name__ == "__main__":
     # 非同期関数を定義
@@ -153,13 +374,9 @@ if __name__ == "__main__":
         language = "日本語"
         level = "初級"
 
-        score = await evaluator.examination_score(language, level)
-        feedback = await evaluator.examination_feedback(language, level)
-        result = await evaluator.result_report(score, feedback)
-
-        print(score)
-        print(feedback)
-        print(f"{result}")
+        async for section in evaluator.evaluate_stream(language, level):
+            print(section, end="", flush=True)
+        print()
 
     # 非同期関数を実行するためのイベントループを使用
     import asyncio
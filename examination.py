@@ -1,12 +1,20 @@
 # prompt_chaining.py
 import asyncio
+import os
 import random
 from datetime import datetime
 from typing import Optional
 
 from pydantic import BaseModel, Field
 
-from common import OpenAIService, logger
+from common import estimate_tokens, get_openai_service, logger
+from resilience import LLMFailure, unwrap_llm_result
+from variant_cache import VARIANT_TEMPERATURE, get_opener_cache
+
+# 会話履歴としてLLMに送るトークン数の上限（超えた分は古い発話から窓の外に出す）
+CONTEXT_TOKEN_BUDGET = int(os.getenv("GRACHALLE_CONTEXT_TOKEN_BUDGET", "2000"))
+# 窓の外に出た発話を要約して保持するかどうか
+CONTEXT_SUMMARIZATION = os.getenv("GRACHALLE_CONTEXT_SUMMARIZATION", "false").lower() == "true"
 
 # -----------------------------------------------------#
 # Pydanticモデル - Parallelizationパターン用           #
@@ -22,6 +30,10 @@ class ConversationState(BaseModel):
     mistakes: list[str] = Field(default_factory=list, description="ユーザーの間違いリスト")
     turn_count: int = Field(default=0, description="会話のターン数")
     examination_mode: bool = Field(default=True, description="試験モードかどうか")
+    turn_assessments: list[dict] = Field(default_factory=list, description="試験中に算出したターン別の評価")
+    summary: str = Field(default="", description="コンテキスト窓から外れた会話の要約")
+    window_start: int = Field(default=0, description="LLMに送る会話履歴の先頭インデックス")
+    window_tokens: int = Field(default=0, description="LLMに送る会話履歴の推定トークン数")
 
 
 class ConversationalText(BaseModel):
@@ -32,85 +44,290 @@ class ConversationalText(BaseModel):
     message: str = Field(description="試験における会話文")
 
 
+class ConversationSummary(BaseModel):
+    """
+    コンテキスト窓から外れた会話の要約を表すモデル。
+    """
+
+    summary: str = Field(description="これまでの会話の要約")
+
+
 # -----------------------------------------------------#
 # 試験出題　　　　　　　　　　　　　　　　                #
 # -----------------------------------------------------#
 
 
 class ConversationalChat:
-    def __init__(self):
+    def __init__(
+        self,
+        openai_service=None,
+        context_token_budget: int = CONTEXT_TOKEN_BUDGET,
+        summarize: bool = CONTEXT_SUMMARIZATION,
+    ):
+        """
+        Parameters:
+            openai_service (OpenAIService): 利用するサービス（未指定の場合はプロセス共有のものを利用）
+            context_token_budget (int): LLMに送る会話履歴のトークン数上限
+            summarize (bool): 窓から外れた会話をバックグラウンドで要約するかどうか
+        """
         self.state = ConversationState()
-        self.openai_service = OpenAIService()
-
-    async def initialize_conversation(self, language: str, level: str) -> str:
-        """会話式試験を初期化し、最初の質問を生成します"""
-
-        # 初期状態の設定 - 引数の値を使用
-        self.state = ConversationState(
-            language=language,
-            level=level,
-        )
-
-        # 会話のコンテキスト設定と最初の質問を生成
+        self.openai_service = openai_service or get_openai_service()
+        self.context_token_budget = context_token_budget
+        self.summarize = summarize
+        # (言語, 難易度)ごとの第一声はセッション間で共有するキャッシュから返す
+        self.opener_cache = get_opener_cache()
+        # 窓から外れたが、まだ要約に反映していない発話
+        self._evicted_messages = []
+        self._summary_task = None
+
+    def _build_opening_prompt(self, language: str, level: str):
+        """最初の質問を生成するためのプロンプトを組み立てます"""
         system_prompt = (
             f"あなたは{language}の会話試験官です。{level}レベルの{language}で会話を行います。"
             "質問は簡潔で、明確で、回答しやすいものにしてください。"
         )
-
         user_prompt = f"{language}で{level}レベルの会話をしましょう。"
+        return system_prompt, user_prompt
+
+    def _build_continue_messages(self):
+        """
+        次の質問を生成するためのメッセージ列を組み立てます。
+        システムプロンプトはセッション中固定とし、会話履歴はトークン予算内の直近の発話のみを
+        チャットメッセージとして続けることで、プロンプトのプレフィックスキャッシュが効くようにします。
+        """
+        system_prompt = (
+            f"あなたは{self.state.language}の会話試験官です。"
+            f"ユーザーの回答に基づいて次の質問を生成してください。"
+            f"{self.state.language}で{self.state.level}レベルの会話を続けてください。"
+        )
+        messages = [{"role": "system", "content": system_prompt}]
+        if self.state.summary:
+            messages.append({"role": "system", "content": f"これまでの会話の要約:\n{self.state.summary}"})
+        messages.extend(self.state.conversation_history[self.state.window_start :])
+        return messages
+
+    def _append_message(self, role: str, content: str):
+        """
+        会話履歴に発話を追加し、トークン予算を超えた分だけ古い発話を窓の外に出します。
+        履歴全体を再計算せず、窓のトークン数を差分で更新します。
+        """
+        history = self.state.conversation_history
+        history.append({"role": role, "content": content})
+        self.state.window_tokens += estimate_tokens(content)
+
+        # 最新の発話は必ず窓に残す
+        while self.state.window_tokens > self.context_token_budget and self.state.window_start < len(history) - 1:
+            evicted = history[self.state.window_start]
+            self.state.window_tokens -= estimate_tokens(evicted["content"])
+            self.state.window_start += 1
+            if self.summarize:
+                self._evicted_messages.append(evicted)
+
+    def _mark(self):
+        """会話履歴の現在の位置を返します（_rollbackで以降の発話の追加を取り消すために使用）"""
+        return (
+            len(self.state.conversation_history),
+            self.state.window_start,
+            self.state.window_tokens,
+            len(self._evicted_messages),
+        )
 
+    def _rollback(self, mark):
+        """_markの時点より後に追加した発話を取り消し、窓の位置とトークン数も元に戻します"""
+        length, window_start, window_tokens, evicted = mark
+        del self.state.conversation_history[length:]
+        self.state.window_start = window_start
+        self.state.window_tokens = window_tokens
+        del self._evicted_messages[evicted:]
+
+    def _record_assistant_message(self, message: str):
+        """試験官の発話を会話履歴に追加します"""
+        self._append_message("assistant", message)
+        self.state.turn_count += 1
+        self._schedule_summary()
+
+    def _schedule_summary(self):
+        """窓から外れた発話があれば、バックグラウンドで要約を更新します"""
+        if not self._evicted_messages or (self._summary_task is not None and not self._summary_task.done()):
+            return
+        evicted, self._evicted_messages = self._evicted_messages, []
+        # 完了前に会話状態が入れ替わっても、要約は依頼した時点の会話状態にのみ反映する
+        self._summary_task = asyncio.create_task(self._update_summary(self.state, evicted))
+
+    def _cancel_summary(self):
+        """実行中の要約の更新をキャンセルします（会話状態を入れ替える場合に使用）"""
+        task, self._summary_task = self._summary_task, None
+        if task is not None and not task.done():
+            # 常駐イベントループ以外のスレッドから呼ばれても安全にキャンセルする
+            task.get_loop().call_soon_threadsafe(task.cancel)
+
+    async def _update_summary(self, state: ConversationState, evicted: list[dict]):
+        """既存の要約に窓から外れた発話を統合します"""
+        system_prompt = (
+            "あなたは会話試験の記録係です。"
+            "これまでの要約と新たに追加する会話を統合し、話題・ユーザーの回答内容・誤りを簡潔に要約してください。"
+        )
+        transcript = "\n".join([f"{item['role']}: {item['content']}" for item in evicted])
+        user_content = f"これまでの要約:\n{state.summary or 'なし'}\n\n追加する会話:\n{transcript}"
         try:
-            # JSON出力ではなく通常のテキスト出力に変更
-            first_conv = await self.openai_service.call_llm_with_json_output_async(
-                system_prompt, user_prompt, ConversationalText
+            result = unwrap_llm_result(
+                await self.openai_service.call_llm_with_json_output_async(
+                    system_prompt, user_content, ConversationSummary, call_site="summary"
+                )
             )
-            print(f"first_conv: {first_conv}")
-
-            # 会話履歴に追加
-            self.state.conversation_history.append({"role": "assistant", "content": first_conv.message})
-            self.state.turn_count += 1
+            state.summary = result.summary
+        except Exception as e:
+            logger.error("会話要約の更新に失敗しました: %s", e)
 
+    def _start_state(self, language: str, level: str):
+        """試験の初期状態を設定します"""
+        self.state = ConversationState(
+            language=language,
+            level=level,
+        )
+        self._cancel_summary()
+        self._evicted_messages = []
+
+    def restore_state(self, state: ConversationState):
+        """
+        保存済みの会話状態から再開します（別のワーカーでセッションを引き継ぐ場合に使用）。
+        保存時点で要約に反映されていなかった発話は要約の対象外となります。
+        """
+        self.state = state
+        self._cancel_summary()
+        self._evicted_messages = []
+
+    def reset_state(self):
+        """会話状態を初期状態に戻します（実行中の要約の更新はキャンセル）"""
+        self.restore_state(ConversationState())
+
+    async def generate_opener(self, language: str, level: str):
+        """
+        最初の質問を生成します（会話状態は変更しません）。
+        (言語, 難易度)ごとに生成済みのバリエーションが揃っていればキャッシュから返します。
+
+        Returns:
+            str: 最初の質問（生成に失敗した場合はNone）
+        """
+        cached = self.opener_cache.get(language, level)
+        if cached is not None:
+            logger.info("試験官の第一声をキャッシュから返します")
+            return cached
+
+        system_prompt, user_prompt = self._build_opening_prompt(language, level)
+        try:
+            # JSON出力ではなく通常のテキスト出力に変更
+            first_conv = unwrap_llm_result(
+                await self.openai_service.call_llm_with_json_output_async(
+                    system_prompt, user_prompt, ConversationalText, temperature=VARIANT_TEMPERATURE, call_site="opener"
+                )
+            )
+            logger.debug("試験官の第一声: %s", first_conv.message)
+            self.opener_cache.add(language, level, first_conv.message)
             return first_conv.message
 
         except Exception as e:
-            logger.error(f"会話初期化中にエラーが発生しました: {str(e)}")
+            logger.error("会話初期化中にエラーが発生しました: %s", e)
+            return None
+
+    async def initialize_conversation(self, language: str, level: str) -> str:
+        """会話式試験を初期化し、最初の質問を生成します"""
+
+        # 初期状態の設定 - 引数の値を使用
+        self._start_state(language, level)
+
+        # 会話のコンテキスト設定と最初の質問を生成
+        first_message = await self.generate_opener(language, level)
+        if first_message is None:
             return f"{language}で会話を始めましょう。あなたの趣味について教えてください。"
 
+        # 会話履歴に追加
+        self._record_assistant_message(first_message)
+        return first_message
+
+    def start_with_opener(self, language: str, level: str, first_message: str):
+        """生成済みの最初の質問で会話式試験を初期化します（先行生成した第一声の適用用）"""
+        self._start_state(language, level)
+        self._record_assistant_message(first_message)
+
+    async def initialize_conversation_stream(self, language: str, level: str):
+        """会話式試験を初期化し、最初の質問をトークン単位で逐次返します"""
+
+        self._start_state(language, level)
+        cached = self.opener_cache.get(language, level)
+        if cached is not None:
+            logger.info("試験官の第一声をキャッシュから返します")
+            self._record_assistant_message(cached)
+            yield cached
+            return
+
+        system_prompt, user_prompt = self._build_opening_prompt(language, level)
+        chunks = []
+        async for delta in self.openai_service.stream_llm_with_json_output_async(
+            system_prompt, user_prompt, ConversationalText, temperature=VARIANT_TEMPERATURE, call_site="opener"
+        ):
+            chunks.append(delta)
+            yield delta
+
+        if not chunks:
+            logger.error("会話初期化のストリーミング応答が空でした")
+            yield f"{language}で会話を始めましょう。あなたの趣味について教えてください。"
+            return
+        first_message = "".join(chunks)
+        self.opener_cache.add(language, level, first_message)
+        self._record_assistant_message(first_message)
+
     async def continue_conversation(self, user_input: str) -> str:
         """ユーザーの入力に基づいて会話を続け、次の会話文を生成します"""
 
-        # 会話履歴をフォーマット
-        formatted_history = "\n".join(
-            [f"{item['role']}: {item['content']}" for item in self.state.conversation_history]
-        )
-
         # ユーザーの入力を会話履歴に追加
-        self.state.conversation_history.append({"role": "user", "content": user_input})
-
-        # 次の質問を生成
-        system_prompt = (
-            f"あなたは{self.state.language}の会話試験官です。"
-            f"ユーザーの回答に基づいて次の質問を生成してください。"
-            f"{self.state.language}で{self.state.level}レベルの会話を続けてください。"
-            f"直近の会話:\n{formatted_history}"
-        )
+        mark = self._mark()
+        self._append_message("user", user_input)
 
         try:
-            # JSON出力ではなく通常のテキスト出力に変更
-            next_conv = await self.openai_service.call_llm_with_json_output_async(
-                system_prompt, user_input, ConversationalText
+            # 次の質問を生成
+            next_conv = unwrap_llm_result(
+                # 試験官の返答は待ち時間が体感に直結するため、遅い場合は別のデプロイメントにも送る
+                await self.openai_service.call_llm_with_messages_async(
+                    self._build_continue_messages(), ConversationalText, hedge=True, call_site="continue"
+                )
             )
 
             # 会話履歴に追加
-            self.state.conversation_history.append({"role": "assistant", "content": next_conv.message})
-            self.state.turn_count += 1
+            self._record_assistant_message(next_conv.message)
 
             return next_conv.message
 
         except Exception as e:
-            logger.error(f"会話継続中にエラーが発生しました: {str(e)}")
+            logger.error("会話継続中にエラーが発生しました: %s", e)
+            # 応答できなかったターンの入力は履歴に残さない（次の入力でuserの発話が連続しないように）
+            self._rollback(mark)
             return "会話を続けることができませんでした。もう一度お試しください。"
 
+    async def continue_conversation_stream(self, user_input: str):
+        """
+        ユーザーの入力に基づいて会話を続け、次の会話文をトークン単位で逐次返します。
+        応答を1文字も受信できなかった場合は、入力を会話履歴から取り除き、最後の要素としてLLMFailureを返します。
+        """
+
+        mark = self._mark()
+        self._append_message("user", user_input)
+
+        chunks = []
+        # 試験官の返答は待ち時間が体感に直結するため、最初のチャンクが遅い場合は別のデプロイメントにも送る
+        async for delta in self.openai_service.stream_llm_with_messages_async(
+            self._build_continue_messages(), ConversationalText, hedge=True, call_site="continue"
+        ):
+            chunks.append(delta)
+            yield delta
+
+        if not chunks:
+            logger.error("会話継続のストリーミング応答が空でした")
+            self._rollback(mark)
+            yield LLMFailure(kind="empty_stream", message="会話継続のストリーミング応答が空でした")
+            return
+        self._record_assistant_message("".join(chunks))
+
     async def end_examination(self) -> str:
         """試験を終了して最終評価を取得します"""
         # 会話終了処理を実装
@@ -124,6 +341,41 @@ class ConversationalChat:
             f"お疲れ様でした！"
         )
 
+    def record_turn_assessment(self, turn: int, assessment):
+        """
+        ターン別の評価結果を記録し、現在のスコア（平均）と間違いリストを更新します
+
+        Parameters:
+            turn (int): 評価したユーザー回答のターン番号（1始まり）
+            assessment (TurnAssessment): ターン別の評価結果
+        """
+        self.state.turn_assessments.append(
+            {"turn": turn, "score": assessment.score, "mistakes": assessment.mistakes, "feedback": assessment.feedback}
+        )
+        self.state.score = round(
+            sum(item["score"] for item in self.state.turn_assessments) / len(self.state.turn_assessments)
+        )
+        self.state.mistakes.extend(assessment.mistakes)
+
+    def discard_turn_assessment(self, turn: int):
+        """
+        ターン別の評価結果を取り消し、現在のスコアと間違いリストを残りの評価から計算し直します
+        （試験官が応答できず、そのターンの回答を受け付け直す場合に使用）
+        """
+        assessments = [item for item in self.state.turn_assessments if item["turn"] != turn]
+        if len(assessments) == len(self.state.turn_assessments):
+            return
+        self.state.turn_assessments = assessments
+        self.state.score = round(sum(item["score"] for item in assessments) / len(assessments)) if assessments else 0
+        self.state.mistakes = [mistake for item in assessments for mistake in item["mistakes"]]
+
+    def last_assistant_message(self):
+        """直近の試験官の発話を取得する"""
+        for item in reversed(self.state.conversation_history):
+            if item["role"] == "assistant":
+                return item["content"]
+        return ""
+
     def get_conversation_history(self):
         """会話履歴を取得する"""
         return self.state.conversation_history
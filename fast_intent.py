@@ -0,0 +1,194 @@
+# fast_intent.py
+import os
+import re
+import threading
+import unicodedata
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+from common import logger
+from telemetry import record_fast_intent
+
+# ルールベースの高速判定を有効にするかどうか
+FAST_PATH_ENABLED = os.getenv("GRACHALLE_FAST_PATH", "true").lower() == "true"
+
+
+# -----------------------------------------------------#
+# 辞書（正規化後の値 → 表記ゆれのパターン）            #
+# -----------------------------------------------------#
+def _word(*words):
+    """英字の語は単語境界付きで、それ以外はそのままマッチさせるパターンを作る"""
+    return "|".join(rf"(?<![a-z]){w}(?![a-z])" if w.isascii() else w for w in words)
+
+
+LANGUAGE_LEXICON = {
+    "英語": _word("英語", "英会話", "english"),
+    "フランス語": _word("フランス語", "仏語", "french", "français", "francais"),
+    "ドイツ語": _word("ドイツ語", "独語", "german", "deutsch"),
+    "スペイン語": _word("スペイン語", "spanish", "español", "espanol"),
+    "イタリア語": _word("イタリア語", "italian", "italiano"),
+    "ポルトガル語": _word("ポルトガル語", "portuguese"),
+    "ロシア語": _word("ロシア語", "russian"),
+    "中国語": _word("中国語", "中文", "chinese", "mandarin"),
+    "韓国語": _word("韓国語", "ハングル", "korean"),
+    "日本語": _word("日本語", "japanese"),
+}
+
+LEVEL_LEXICON = {
+    "初級": _word(
+        "初級", "初心者", "入門", "ビギナー", "beginner", "beginners", "elementary", "basic", "easy", "a1", "a2"
+    ),
+    "中級": _word("中級", "intermediate", "b1", "b2"),
+    "上級": _word("上級", "advanced", "expert", "fluent", "c1", "c2"),
+}
+
+REQUEST_PATTERN = re.compile(
+    _word("試験", "テスト", "受験", "検定", "模試", "exam", "examination", "test", "quiz", "assessment")
+)
+# 否定・取り消しを含む入力は判定が難しいためLLMに委ねる
+NEGATION_PATTERN = re.compile(
+    "ない|ません|やめ|結構です|不要|キャンセル|" + _word("not", "don't", "dont", "no", "cancel", "never")
+)
+
+_LANGUAGE_PATTERNS = {value: re.compile(pattern) for value, pattern in LANGUAGE_LEXICON.items()}
+_LEVEL_PATTERNS = {value: re.compile(pattern) for value, pattern in LEVEL_LEXICON.items()}
+
+
+class RuleMatch(BaseModel):
+    """
+    ルールベース判定の結果を格納するモデル。
+    """
+
+    is_request_for_examination: bool = Field(default=False, description="試験開始のリクエストと判定できたか")
+    language: Optional[str] = Field(default=None, description="正規化済みの出題言語（一意に判定できない場合はNone）")
+    level: Optional[str] = Field(default=None, description="正規化済みの出題難易度（一意に判定できない場合はNone）")
+    negated: bool = Field(default=False, description="否定・取り消しの表現を含むか")
+
+
+# -----------------------------------------------------#
+# ルールベース意図判定                                 #
+# -----------------------------------------------------#
+class RuleBasedIntentClassifier:
+    """
+    定型的な試験リクエストをキーワード・正規表現で判定する軽量な分類器。
+    確信を持って判定できる入力だけを即答し、それ以外はLLMによる判定に委ねます。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    @staticmethod
+    def normalize(text):
+        """全角・半角や大文字・小文字の揺れを吸収します"""
+        return unicodedata.normalize("NFKC", text or "").lower()
+
+    @staticmethod
+    def _match_one(patterns, text):
+        """辞書のうち一意にマッチした正規化値を返す（0件または複数件の場合はNone）"""
+        found = [value for value, pattern in patterns.items() if pattern.search(text)]
+        return found[0] if len(found) == 1 else None
+
+    def classify(self, user_input):
+        """
+        ユーザー入力をルールで判定します。
+
+        Parameters:
+            user_input (str): ユーザー入力
+
+        Returns:
+            RuleMatch: 判定結果
+        """
+        text = self.normalize(user_input)
+        return RuleMatch(
+            is_request_for_examination=bool(REQUEST_PATTERN.search(text)),
+            language=self._match_one(_LANGUAGE_PATTERNS, text),
+            level=self._match_one(_LEVEL_PATTERNS, text),
+            negated=bool(NEGATION_PATTERN.search(text)),
+        )
+
+    def match_hearing(self, user_input):
+        """
+        試験開始の意図・出題言語・難易度がすべて確信を持って判定できた場合のみ結果を返します。
+
+        Returns:
+            RuleMatch: 判定結果（確信が持てない場合はNone）
+        """
+        match = self.classify(user_input)
+        confident = not match.negated and match.is_request_for_examination and match.language and match.level
+        self._record("hearing", bool(confident))
+        return match if confident else None
+
+    def match_examination_info(self, user_input, need_language=True, need_level=True):
+        """
+        不足している試験情報がすべて確信を持って判定できた場合のみ結果を返します。
+
+        Parameters:
+            user_input (str): ユーザー入力
+            need_language (bool): 出題言語が必要か
+            need_level (bool): 出題難易度が必要か
+
+        Returns:
+            RuleMatch: 判定結果（確信が持てない場合はNone）
+        """
+        match = self.classify(user_input)
+        confident = (
+            not match.negated
+            and (need_language or need_level)
+            and (match.language or not need_language)
+            and (match.level or not need_level)
+        )
+        self._record("extract", bool(confident))
+        return match if confident else None
+
+    def _record(self, stage, hit):
+        """判定件数を集計し、/metricsにも反映する"""
+        with self._lock:
+            hits, total = self._counts.get(stage, (0, 0))
+            self._counts[stage] = (hits + int(hit), total + 1)
+        record_fast_intent(stage, hit)
+
+    def hit_rates(self):
+        """
+        ステージごとの判定件数とルールベースで即答できた割合を返します。
+
+        Returns:
+            dict: {stage: {"hits": int, "total": int, "hit_rate": float}}
+        """
+        with self._lock:
+            return {
+                stage: {"hits": hits, "total": total, "hit_rate": hits / total if total else 0.0}
+                for stage, (hits, total) in self._counts.items()
+            }
+
+
+_default_classifier = RuleBasedIntentClassifier()
+
+
+def canonicalize_language(language):
+    """出題言語を正規化値に揃える（辞書にない場合は正規化した文字列をそのまま返す）"""
+    text = RuleBasedIntentClassifier.normalize(language).strip()
+    return RuleBasedIntentClassifier._match_one(_LANGUAGE_PATTERNS, text) or text
+
+
+def canonicalize_level(level):
+    """出題難易度を正規化値に揃える（辞書にない場合は正規化した文字列をそのまま返す）"""
+    text = RuleBasedIntentClassifier.normalize(level).strip()
+    return RuleBasedIntentClassifier._match_one(_LEVEL_PATTERNS, text) or text
+
+
+def get_rule_classifier():
+    """プロセス共有のルールベース分類器を取得する（ヒット率はプロセス単位で集計）"""
+    return _default_classifier
+
+
+if __name__ == "__main__":
+    classifier = get_rule_classifier()
+    while True:
+        user_input = input("入力: ")
+        if not user_input:
+            break
+        print(classifier.classify(user_input))
+        print(classifier.match_hearing(user_input) is not None, classifier.hit_rates())
+    logger.info("ルールベース判定のヒット率: %s", classifier.hit_rates())
@@ -5,7 +5,10 @@ from typing import Optional
 
 from pydantic import BaseModel, Field
 
-from common import OpenAIService, logger
+from common import get_openai_service, logger
+from fast_intent import FAST_PATH_ENABLED, get_rule_classifier
+from resilience import LLMFailure, LLMServiceError, unwrap_llm_result
+from variant_cache import VARIANT_TEMPERATURE, get_confirmation_cache
 
 
 # -----------------------------------------------------#
@@ -18,6 +21,7 @@ class ExaminationStartIntent(BaseModel):
 
     description: str = Field(description="ユーザー入力の生テキスト")
     is_request_for_examination: bool = Field(description="入力テキストが試験開始のリクエストであるかどうか")
+    confidence: float = Field(default=1.0, description="判定の確信度（0～1）")
 
 
 class ExaminationInformation(BaseModel):
@@ -27,6 +31,18 @@ class ExaminationInformation(BaseModel):
 
     language: Optional[str] = Field(default=None, description="出題言語（解析できない場合はNone）")
     level: Optional[str] = Field(default=None, description="出題難易度（解析できない場合はNone）")
+    confidence: float = Field(default=1.0, description="判定の確信度（0～1）")
+
+
+class HearingResult(BaseModel):
+    """
+    試験開始の意図と試験情報（出題言語・難易度）を1回の呼び出しでまとめて抽出するモデル。
+    """
+
+    is_request_for_examination: bool = Field(description="入力テキストが試験開始のリクエストであるかどうか")
+    language: Optional[str] = Field(default=None, description="出題言語（解析できない場合はNone）")
+    level: Optional[str] = Field(default=None, description="出題難易度（解析できない場合はNone）")
+    confidence: float = Field(default=1.0, description="判定の確信度（0～1）")
 
 
 class ConfirmationMessage(BaseModel):
@@ -41,8 +57,35 @@ class ConfirmationMessage(BaseModel):
 # 意図抽出　　　　　　　　　　　　　　　　                #
 # -----------------------------------------------------#
 class IntentExtract:
-    def __init__(self):
-        self.openai_service = OpenAIService()
+    DETECT_INTENT_PROMPT = (
+        "以下のユーザーのテキストが試験開始のリクエストであるかを判断し、"
+        "その結果をJSON形式で返してください。"
+        "出題言語と難易度は後続のステップで抽出します。"
+    )
+    EXTRACT_INFO_PROMPT = (
+        "以下のユーザーのテキストから試験の出題言語と難易度を抽出し、"
+        "その結果をJSON形式で返してください。"
+        "出題言語は英語、フランス語など、出題難易度は初級、中級、上級などです。"
+    )
+    HEARING_PROMPT = (
+        "以下のユーザーのテキストが試験開始のリクエストであるかを判断し、"
+        "あわせて試験の出題言語と難易度を抽出して、その結果をJSON形式で返してください。"
+        "出題言語は英語、フランス語など、出題難易度は初級、中級、上級などです。"
+        "出題言語や難易度が読み取れない場合はnullとしてください。"
+    )
+    CONFIRMATION_PROMPT = (
+        "以下の出題言語と難易度に基づいて、試験開始の確認メッセージを生成してください。"
+        "確認メッセージは、出題言語と難易度を含む文である必要があります。"
+        "また確認メッセージに続けて、ユーザーからの初回入力を促すよう会話導入を別センテンスとして出力。"
+        "会話導入は出題言語: {language}, 出題難易度: {level}に必ず従って会話の導入を誘導してください。"
+    )
+
+    def __init__(self, openai_service=None, use_fast_path=FAST_PATH_ENABLED):
+        self.openai_service = openai_service or get_openai_service()
+        # 定型的な入力はルールベースで即答し、LLM呼び出しを省略する
+        self.rule_classifier = get_rule_classifier() if use_fast_path else None
+        # (言語, 難易度)ごとの確認メッセージはセッション間で共有するキャッシュから返す
+        self.confirmation_cache = get_confirmation_cache()
 
     def detect_intent(self, user_input):
         """
@@ -50,19 +93,17 @@ class IntentExtract:
         """
 
         logger.info("入力が試験開始のリクエストであるかを確認中")
-        system_prompt = (
-            "以下のユーザーのテキストが試験開始のリクエストであるかを判断し、"
-            "その結果をJSON形式で返してください。"
-            "出題言語と難易度は後続のステップで抽出します。"
-        )
-
         try:
-            result = self.openai_service.call_llm_with_json_output(system_prompt, user_input, ExaminationStartIntent)
-            logger.info(f"試験受験意図の検出結果: {result.is_request_for_examination}")
+            result = unwrap_llm_result(
+                self.openai_service.call_llm_with_json_output(
+                    self.DETECT_INTENT_PROMPT, user_input, ExaminationStartIntent, call_site="detect_intent"
+                )
+            )
+            logger.info("試験受験意図の検出結果: %s", result.is_request_for_examination)
             return result
 
         except Exception as e:
-            logger.error(f"意図検出に失敗しました: {str(e)}")
+            logger.error("意図検出に失敗しました: %s", e)
             return ExaminationStartIntent(description=user_input, is_request_for_examination=False)
 
     def extract_examination_info(self, user_input):
@@ -70,18 +111,17 @@ class IntentExtract:
         ステップ2: ユーザー入力から受けたい試験情報を抽出します。
         """
         logger.info("試験情報を抽出中")
-        system_prompt = (
-            "以下のユーザーのテキストから試験の出題言語と難易度を抽出し、"
-            "その結果をJSON形式で返してください。"
-            "出題言語は英語、フランス語など、出題難易度は初級、中級、上級などです。"
-        )
         try:
-            result = self.openai_service.call_llm_with_json_output(system_prompt, user_input, ExaminationInformation)
+            result = unwrap_llm_result(
+                self.openai_service.call_llm_with_json_output(
+                    self.EXTRACT_INFO_PROMPT, user_input, ExaminationInformation, call_site="extract_info"
+                )
+            )
 
-            logger.info(f"情報抽出結果: " f"出題言語={result.language}, 出題難易度={result.level}")
+            logger.info("情報抽出結果: 出題言語=%s, 出題難易度=%s", result.language, result.level)
             return result
         except Exception as e:
-            logger.error(f"予約情報の抽出に失敗しました: {str(e)}")
+            logger.error("予約情報の抽出に失敗しました: %s", e)
             return ExaminationInformation()
 
     def generate_confirmation(self, language, level):
@@ -89,23 +129,114 @@ class IntentExtract:
         ステップ3: 試験情報をユーザーに共有するメッセージを提供します。
         """
         logger.info("試験情報の確認メッセージを生成中")
-        system_prompt = (
-            "以下の出題言語と難易度に基づいて、試験開始の確認メッセージを生成してください。"
-            "確認メッセージは、出題言語と難易度を含む文である必要があります。"
-            "また確認メッセージに続けて、ユーザーからの初回入力を促すよう会話導入を別センテンスとして出力。"
-            "会話導入は出題言語: {language}, 出題難易度: {level}に必ず従って会話の導入を誘導してください。"
-        )
-
         try:
-            result = self.openai_service.call_llm_with_json_output(
-                system_prompt, f"出題言語: {language}, 出題難易度: {level}", ConfirmationMessage
+            result = unwrap_llm_result(
+                self.openai_service.call_llm_with_json_output(
+                    self.CONFIRMATION_PROMPT,
+                    f"出題言語: {language}, 出題難易度: {level}",
+                    ConfirmationMessage,
+                    call_site="confirmation",
+                )
             )
-            logger.info(f"確認メッセージ生成結果: {result.confirmation_message}")
+            logger.debug("確認メッセージ生成結果: %s", result.confirmation_message)
             return result
         except Exception as e:
-            logger.error(f"確認メッセージの生成に失敗しました: {str(e)}")
+            logger.error("確認メッセージの生成に失敗しました: %s", e)
             return ConfirmationMessage(confirmation_message="試験情報の確認に失敗しました。再度お試しください。")
 
+    async def hear_async(self, user_input):
+        """
+        ステップ1+2: 試験開始の意図検出と試験情報の抽出を1回の非同期呼び出しでまとめて行います。
+        LLM呼び出し自体が失敗した場合はLLMFailureを返します。
+        """
+        if self.rule_classifier is not None:
+            match = self.rule_classifier.match_hearing(user_input)
+            if match is not None:
+                logger.info("ルールベースで判定しました: 出題言語=%s, 出題難易度=%s", match.language, match.level)
+                return HearingResult(is_request_for_examination=True, language=match.language, level=match.level)
+
+        logger.info("試験開始の意図と試験情報をまとめて抽出中")
+        try:
+            result = unwrap_llm_result(
+                await self.openai_service.call_llm_with_json_output_async(
+                    self.HEARING_PROMPT, user_input, HearingResult, call_site="hearing"
+                )
+            )
+            logger.info(
+                "ヒアリング結果: 試験受験意図=%s, 出題言語=%s, 出題難易度=%s",
+                result.is_request_for_examination,
+                result.language,
+                result.level,
+            )
+            return result
+        except LLMServiceError as e:
+            # 呼び出し自体の失敗は「試験リクエストではない」と区別して呼び出し元に返す
+            logger.error("ヒアリングに失敗しました: %s", e)
+            return e.failure
+        except Exception as e:
+            logger.error("ヒアリングに失敗しました: %s", e)
+            return HearingResult(is_request_for_examination=False)
+
+    async def extract_examination_info_async(self, user_input, need_language=True, need_level=True):
+        """
+        ステップ2: ユーザー入力から受けたい試験情報を非同期で抽出します。
+        不足している項目がルールベースで判定できた場合はLLMを呼び出しません。
+        LLM呼び出し自体が失敗した場合はLLMFailureを返します。
+        """
+        if self.rule_classifier is not None:
+            match = self.rule_classifier.match_examination_info(user_input, need_language, need_level)
+            if match is not None:
+                logger.info("ルールベースで判定しました: 出題言語=%s, 出題難易度=%s", match.language, match.level)
+                return ExaminationInformation(language=match.language, level=match.level)
+
+        logger.info("試験情報を抽出中")
+        try:
+            result = unwrap_llm_result(
+                await self.openai_service.call_llm_with_json_output_async(
+                    self.EXTRACT_INFO_PROMPT, user_input, ExaminationInformation, call_site="extract_info"
+                )
+            )
+            logger.info("情報抽出結果: 出題言語=%s, 出題難易度=%s", result.language, result.level)
+            return result
+        except LLMServiceError as e:
+            logger.error("予約情報の抽出に失敗しました: %s", e)
+            return e.failure
+        except Exception as e:
+            logger.error("予約情報の抽出に失敗しました: %s", e)
+            return ExaminationInformation()
+
+    async def generate_confirmation_async(self, language, level):
+        """
+        ステップ3: 試験情報をユーザーに共有するメッセージを非同期で生成します。
+        (言語, 難易度)ごとに生成済みのバリエーションが揃っていればキャッシュから返します。
+        生成に失敗した場合はLLMFailureを返します（呼び出し元は試験を開始せずにヒアリングを続ける）。
+        """
+        cached = self.confirmation_cache.get(language, level)
+        if cached is not None:
+            logger.info("確認メッセージをキャッシュから返します")
+            return ConfirmationMessage(confirmation_message=cached)
+
+        logger.info("試験情報の確認メッセージを生成中")
+        try:
+            result = unwrap_llm_result(
+                await self.openai_service.call_llm_with_json_output_async(
+                    self.CONFIRMATION_PROMPT,
+                    f"出題言語: {language}, 出題難易度: {level}",
+                    ConfirmationMessage,
+                    temperature=VARIANT_TEMPERATURE,
+                    call_site="confirmation",
+                )
+            )
+            logger.debug("確認メッセージ生成結果: %s", result.confirmation_message)
+            self.confirmation_cache.add(language, level, result.confirmation_message)
+            return result
+        except LLMServiceError as e:
+            logger.error("確認メッセージの生成に失敗しました: %s", e)
+            return e.failure
+        except Exception as e:
+            logger.error("確認メッセージの生成に失敗しました: %s", e)
+            return LLMFailure(kind="parse_error", message=str(e))
+
 
 # -----------------------------------------------------#
 # ユーザーインターフェース                              #
@@ -118,7 +249,7 @@ class GraChalleInterface:
         """
         試験開始のための情報抽出を実施。
         """
-        logger.info(f"ユーザー入力を処理しています: {user_input}")
+        logger.info("ユーザー入力を処理しています: %s", user_input)
 
         # ステップ1: 意図検出
         intent_result = self.intent_extract.detect_intent(user_input)
@@ -135,16 +266,16 @@ class GraChalleInterface:
         if examination_info.language is None:
             language_input = input("試験で出題される言語を指定してください: ")
             enhanced_input = f"{user_input} {language_input}"
-            logger.info(f"言語入力: {enhanced_input}")
+            logger.info("言語入力: %s", enhanced_input)
 
             examination_info = self.intent_extract.extract_examination_info(enhanced_input)
-            logger.info(f"{examination_info.language} が抽出されました")
+            logger.info("%s が抽出されました", examination_info.language)
 
         if examination_info.level is None:
             level_input = input("出題難易度を指定してください: ")
             enhanced_input = f"{user_input} {level_input}"
             examination_info = self.intent_extract.extract_examination_info(enhanced_input)
-            logger.info(f"{examination_info.level} が抽出されました")
+            logger.info("%s が抽出されました", examination_info.level)
 
         # ステップ4: 確認メッセージ生成
         if examination_info.language and examination_info.level:
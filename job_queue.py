@@ -0,0 +1,448 @@
+# job_queue.py
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+import config  # noqa: F401
+from common import logger
+from telemetry import record_job, watch_job_queue
+
+# -----------------------------------------------------#
+# ジョブキューの設定                                   #
+# -----------------------------------------------------#
+# SQLiteのファイルパス（未指定の場合はキューを使わず、評価をリクエスト内で実行する）
+JOB_QUEUE_PATH = os.getenv("GRACHALLE_JOB_QUEUE_PATH")
+# 処理中のジョブの占有期限（秒）。ワーカーが停止した場合、期限切れ後に別のワーカーが処理し直す
+JOB_LEASE_SECONDS = float(os.getenv("GRACHALLE_JOB_LEASE_SECONDS", "120"))
+# 1ジョブあたりの最大試行回数と、失敗後に再び処理するまでの基準秒数（試行ごとに倍にする）
+JOB_MAX_ATTEMPTS = int(os.getenv("GRACHALLE_JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY = float(os.getenv("GRACHALLE_JOB_RETRY_DELAY", "5"))
+# キューが空の場合の確認間隔（秒）。ジョブの状態を待つ側の確認間隔にも使う
+JOB_POLL_INTERVAL = float(os.getenv("GRACHALLE_JOB_POLL_INTERVAL", "0.5"))
+# ワーカー1つあたりの同時処理数
+JOB_WORKER_CONCURRENCY = int(os.getenv("GRACHALLE_JOB_WORKER_CONCURRENCY", "8"))
+# Webアプリ・APIサーバーのプロセス内で動かすワーカーの同時処理数（0の場合は別プロセスのワーカーのみ）
+JOB_INPROCESS_CONCURRENCY = int(os.getenv("GRACHALLE_JOB_INPROCESS_CONCURRENCY", "0"))
+# 完了したジョブを保持する秒数
+JOB_RETENTION = float(os.getenv("GRACHALLE_JOB_RETENTION", "86400"))
+
+# ジョブの状態
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+JOB_STATUSES = (QUEUED, RUNNING, SUCCEEDED, FAILED)
+
+
+class Job(BaseModel):
+    """キューに登録されたジョブ"""
+
+    job_id: str = Field(description="ジョブID")
+    key: str = Field(description="冪等キー（同じキーのジョブは1件のみ登録される）")
+    kind: str = Field(description="ジョブの種類（ワーカーの処理関数の選択に使う）")
+    status: str = Field(default=QUEUED, description="状態（queued, running, succeeded, failed）")
+    payload: str = Field(description="処理関数に渡す入力（JSON文字列）")
+    result: Optional[str] = Field(default=None, description="処理関数の戻り値（成功時）")
+    error: Optional[str] = Field(default=None, description="直近の失敗の内容")
+    attempts: int = Field(default=0, description="これまでの試行回数")
+    max_attempts: int = Field(default=JOB_MAX_ATTEMPTS, description="最大試行回数")
+    available_at: float = Field(description="処理を開始できる時刻（UNIX時間）")
+    lease_until: Optional[float] = Field(default=None, description="処理中のワーカーの占有期限（UNIX時間）")
+    worker_id: Optional[str] = Field(default=None, description="処理中のワーカー")
+    created_at: float = Field(description="登録時刻（UNIX時間）")
+    updated_at: float = Field(description="最終更新時刻（UNIX時間）")
+
+    @property
+    def done(self):
+        return self.status in (SUCCEEDED, FAILED)
+
+
+# -----------------------------------------------------#
+# ジョブキュー                                         #
+# -----------------------------------------------------#
+class JobQueue:
+    """
+    SQLite（WALモード）に保存する永続ジョブキュー。複数のプロセスから同じファイルを共有できます。
+    ワーカーはジョブを占有期限（リース）付きで取り出し、処理中は期限を延長します。
+    ワーカーが停止して期限が切れたジョブは、最大試行回数まで別のワーカーが処理し直します。
+    """
+
+    _SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        "job_id TEXT PRIMARY KEY, key TEXT NOT NULL UNIQUE, kind TEXT NOT NULL, status TEXT NOT NULL, "
+        "payload TEXT NOT NULL, result TEXT, error TEXT, attempts INTEGER NOT NULL, max_attempts INTEGER NOT NULL, "
+        "available_at REAL NOT NULL, lease_until REAL, worker_id TEXT, created_at REAL NOT NULL, "
+        "updated_at REAL NOT NULL)"
+    )
+    # 待機中のジョブと、占有期限の切れた処理中のジョブのうち最も古いものを1件取り出す（1文で行うため重複しない）
+    _CLAIM = (
+        "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, worker_id = ?, updated_at = ? "
+        "WHERE job_id = (SELECT job_id FROM jobs WHERE kind IN ({kinds}) AND ("
+        "(status = 'queued' AND available_at <= ?) OR (status = 'running' AND lease_until < ?)"
+        ") ORDER BY available_at LIMIT 1) RETURNING *"
+    )
+
+    def __init__(self, path):
+        """
+        Parameters:
+            path (str): SQLiteのファイルパス
+        """
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(self._SCHEMA)
+        connection.execute("CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, available_at)")
+        connection.commit()
+
+    def _connection(self):
+        """スレッドごとの接続を取得する"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def submit(self, kind, key, payload, max_attempts=JOB_MAX_ATTEMPTS):
+        """
+        ジョブを登録します。同じキーのジョブが既にあれば、登録せずにそのジョブを返します（冪等）。
+
+        Parameters:
+            kind (str): ジョブの種類
+            key (str): 冪等キー
+            payload (str): 処理関数に渡す入力（JSON文字列）
+            max_attempts (int): 最大試行回数
+
+        Returns:
+            Job: 登録した（または登録済みの）ジョブ
+        """
+        now = time.time()
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT INTO jobs (job_id, key, kind, status, payload, attempts, max_attempts, available_at, "
+                "created_at, updated_at) VALUES (?, ?, ?, 'queued', ?, 0, ?, ?, ?, ?) ON CONFLICT(key) DO NOTHING",
+                (uuid.uuid4().hex, key, kind, payload, max_attempts, now, now, now),
+            )
+            row = connection.execute("SELECT * FROM jobs WHERE key = ?", (key,)).fetchone()
+        return Job(**dict(row))
+
+    def get(self, job_id) -> Optional[Job]:
+        """ジョブを取得する（存在しない場合はNone）"""
+        row = self._connection().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return Job(**dict(row)) if row is not None else None
+
+    def claim(self, worker_id, kinds, lease_seconds=JOB_LEASE_SECONDS) -> Optional[Job]:
+        """
+        処理するジョブを1件取り出し、占有期限を設定します（取り出せるジョブがない場合はNone）。
+        占有期限が切れ、最大試行回数に達したジョブは失敗として確定します。
+
+        Parameters:
+            worker_id (str): ワーカーの識別子
+            kinds (Iterable[str]): 処理できるジョブの種類
+            lease_seconds (float): 占有期限（秒）
+        """
+        kinds = list(kinds)
+        now = time.time()
+        with self._connection() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = 'failed', error = COALESCE(error, '処理中のワーカーが応答しなくなりました'), "
+                "lease_until = NULL, worker_id = NULL, updated_at = ? "
+                "WHERE status = 'running' AND lease_until < ? AND attempts >= max_attempts",
+                (now, now),
+            )
+            row = connection.execute(
+                self._CLAIM.format(kinds=", ".join("?" * len(kinds))),
+                (now + lease_seconds, worker_id, now, *kinds, now, now),
+            ).fetchone()
+        return Job(**dict(row)) if row is not None else None
+
+    def _update_owned(self, job_id, worker_id, assignments, values):
+        """自身が占有している処理中のジョブのみを更新する（占有期限が切れて別のワーカーに移った場合はFalse）"""
+        with self._connection() as connection:
+            updated = connection.execute(
+                f"UPDATE jobs SET {assignments}, updated_at = ? WHERE job_id = ? AND worker_id = ? AND status = 'running'",
+                (*values, time.time(), job_id, worker_id),
+            ).rowcount
+        return updated > 0
+
+    def heartbeat(self, job_id, worker_id, lease_seconds=JOB_LEASE_SECONDS):
+        """処理中のジョブの占有期限を延長する（占有を失っていた場合はFalse）"""
+        return self._update_owned(job_id, worker_id, "lease_until = ?", (time.time() + lease_seconds,))
+
+    def complete(self, job_id, worker_id, result):
+        """ジョブの成功を記録する（占有を失っていた場合はFalse）"""
+        return self._update_owned(
+            job_id,
+            worker_id,
+            "status = 'succeeded', result = ?, error = NULL, lease_until = NULL, worker_id = NULL",
+            (result,),
+        )
+
+    def fail(self, job_id, worker_id, error, retry_delay=JOB_RETRY_DELAY):
+        """
+        ジョブの失敗を記録する（最大試行回数に達していなければretry_delay秒後に再び処理できるようにする）
+        """
+        return self._update_owned(
+            job_id,
+            worker_id,
+            "status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END, error = ?, "
+            "available_at = ?, lease_until = NULL, worker_id = NULL",
+            (error, time.time() + retry_delay),
+        )
+
+    def release(self, job_id, worker_id):
+        """ワーカーの停止などで処理を中断したジョブを、試行回数を数えずに待機中に戻す"""
+        return self._update_owned(
+            job_id,
+            worker_id,
+            "status = 'queued', attempts = attempts - 1, available_at = ?, lease_until = NULL, worker_id = NULL",
+            (time.time(),),
+        )
+
+    def counts(self):
+        """種類・状態ごとのジョブ数を返す（登録済みの種類については0件の状態も含む）"""
+        rows = self._connection().execute("SELECT kind, status, COUNT(*) FROM jobs GROUP BY kind, status").fetchall()
+        counts = {}
+        for kind in {row[0] for row in rows}:
+            for status in JOB_STATUSES:
+                counts[(kind, status)] = 0
+        for kind, status, count in rows:
+            counts[(kind, status)] = count
+        return counts
+
+    def purge(self, retention=JOB_RETENTION):
+        """完了してからretention秒以上経ったジョブを削除し、件数を返す"""
+        with self._connection() as connection:
+            return connection.execute(
+                "DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND updated_at < ?",
+                (time.time() - retention,),
+            ).rowcount
+
+    async def wait(self, job_id, timeout=None, poll_interval=JOB_POLL_INTERVAL):
+        """
+        ジョブが完了するまで待ちます（別プロセスのワーカーが処理するため、一定間隔で状態を確認する）
+
+        Parameters:
+            job_id (str): ジョブID
+            timeout (float): 待機する最大秒数（Noneの場合は無制限）
+            poll_interval (float): 状態の確認間隔（秒）
+
+        Returns:
+            Job: 完了した、または期限までに完了しなかった時点のジョブ（存在しない場合はNone）
+        """
+        async for job in self.watch(job_id, timeout, poll_interval):
+            if job is None or job.done:
+                return job
+        return await asyncio.to_thread(self.get, job_id)
+
+    async def watch(self, job_id, timeout=None, poll_interval=JOB_POLL_INTERVAL):
+        """
+        ジョブの状態が変わるたびにジョブを返します（完了・削除されるか、期限に達すると終了）
+
+        Yields:
+            Job: 状態が変わった時点のジョブ（削除された場合はNone）
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        last = None
+        while True:
+            job = await asyncio.to_thread(self.get, job_id)
+            state = None if job is None else (job.status, job.attempts)
+            if job is None or state != last:
+                yield job
+                if job is None or job.done:
+                    return
+                last = state
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            await asyncio.sleep(poll_interval)
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """
+    プロセス共有のジョブキューを取得する（GRACHALLE_JOB_QUEUE_PATHが未設定の場合はNone）
+    """
+    global _job_queue
+    if not JOB_QUEUE_PATH:
+        return None
+    with _job_queue_lock:
+        if _job_queue is None:
+            logger.info("ジョブキューを使用します: %s", JOB_QUEUE_PATH)
+            _job_queue = JobQueue(JOB_QUEUE_PATH)
+            watch_job_queue(_job_queue)
+    return _job_queue
+
+
+# -----------------------------------------------------#
+# ワーカー                                             #
+# -----------------------------------------------------#
+class JobWorker:
+    """
+    キューからジョブを取り出し、種類ごとの非同期の処理関数で処理するワーカー。
+    同時処理数を上限として空きができるたびに取り出すため、登録が集中しても一定のペースで処理します。
+    """
+
+    def __init__(
+        self,
+        queue,
+        handlers,
+        concurrency=JOB_WORKER_CONCURRENCY,
+        lease_seconds=JOB_LEASE_SECONDS,
+        poll_interval=JOB_POLL_INTERVAL,
+        retry_delay=JOB_RETRY_DELAY,
+    ):
+        """
+        Parameters:
+            queue (JobQueue): ジョブキュー
+            handlers (dict[str, Callable[[str], Awaitable[str]]]): ジョブの種類ごとの処理関数（入力と戻り値はJSON文字列）
+            concurrency (int): 同時処理数
+            lease_seconds (float): 占有期限（秒）。処理中はこの3分の1の間隔で延長する
+            poll_interval (float): キューが空の場合の確認間隔（秒）
+            retry_delay (float): 失敗後に再び処理するまでの基準秒数
+        """
+        self.queue = queue
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._loop = None
+        self._stopping = None
+
+    async def run(self):
+        """stopが呼ばれるまでジョブを処理する（停止時は処理中のジョブを待機中に戻す）"""
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        stopping = asyncio.create_task(self._stopping.wait())
+        tasks = set()
+        logger.info("ジョブワーカーを開始します: %s (同時処理数: %s)", self.worker_id, self.concurrency)
+        try:
+            while not stopping.done():
+                if len(tasks) >= self.concurrency:
+                    # 空きができるか、停止するまで待つ
+                    await asyncio.wait(tasks | {stopping}, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                job = await asyncio.to_thread(self.queue.claim, self.worker_id, self.handlers, self.lease_seconds)
+                if job is None:
+                    await asyncio.wait({stopping}, timeout=self.poll_interval)
+                    continue
+                task = asyncio.create_task(self._process(job))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            stopping.cancel()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(stopping, *tasks, return_exceptions=True)
+            logger.info("ジョブワーカーを停止しました: %s", self.worker_id)
+
+    def stop(self):
+        """ワーカーを停止する（別スレッドからも呼べる）"""
+        if self._loop is not None and self._stopping is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+
+    async def _heartbeat(self, job, processing):
+        """占有期限を定期的に延長し、占有を失った場合は処理を打ち切る"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not await asyncio.to_thread(self.queue.heartbeat, job.job_id, self.worker_id, self.lease_seconds):
+                logger.warning("ジョブの占有が別のワーカーに移ったため処理を打ち切ります: %s", job.job_id)
+                processing.cancel()
+                return
+
+    async def _process(self, job):
+        started = time.monotonic()
+        waited = time.time() - job.available_at if job.attempts == 1 else None
+        processing = asyncio.create_task(self.handlers[job.kind](job.payload))
+        heartbeat = asyncio.create_task(self._heartbeat(job, processing))
+        outcome = "cancelled"
+        try:
+            result = await asyncio.shield(processing)
+            outcome = "ok"
+            await asyncio.to_thread(self.queue.complete, job.job_id, self.worker_id, result)
+        except asyncio.CancelledError:
+            if not processing.done():
+                # ワーカーの停止による中断（別のワーカーが改めて処理する）
+                processing.cancel()
+                await asyncio.to_thread(self.queue.release, job.job_id, self.worker_id)
+                raise
+        except Exception as e:
+            outcome = "error"
+            delay = self.retry_delay * 2 ** (job.attempts - 1)
+            logger.error("ジョブの処理に失敗しました: %s %s (試行%s回目): %s", job.kind, job.job_id, job.attempts, e)
+            await asyncio.to_thread(self.queue.fail, job.job_id, self.worker_id, str(e) or type(e).__name__, delay)
+        finally:
+            heartbeat.cancel()
+            record_job(job.kind, outcome, time.monotonic() - started, waited)
+
+
+def _worker_process(concurrency):
+    """ワーカープロセスの本体（SIGTERM・SIGINTで処理中のジョブを戻して終了する）"""
+    # main.pyがこのモジュールを読み込むため、処理関数はワーカーの起動時に読み込む
+    from main import JOB_HANDLERS
+
+    queue = get_job_queue()
+    worker = JobWorker(queue, JOB_HANDLERS, concurrency=concurrency)
+
+    async def _run():
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, worker.stop)
+        await worker.run()
+
+    asyncio.run(_run())
+
+
+def run_worker_processes(processes, concurrency):
+    """
+    ワーカープロセスを起動し、すべて終了するまで待ちます（Ctrl+Cで全プロセスを停止）
+
+    Parameters:
+        processes (int): ワーカープロセス数
+        concurrency (int): プロセスごとの同時処理数
+    """
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=_worker_process, args=(concurrency,), daemon=False) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ジョブキュー（試験終了時の評価など）を処理するワーカーを起動します")
+    parser.add_argument("--processes", type=int, default=1, help="ワーカープロセス数")
+    parser.add_argument("--concurrency", type=int, default=JOB_WORKER_CONCURRENCY, help="プロセスごとの同時処理数")
+    parser.add_argument("--purge", action="store_true", help="保持期間を過ぎた完了済みのジョブを削除して終了する")
+    args = parser.parse_args()
+
+    if not JOB_QUEUE_PATH:
+        raise SystemExit("GRACHALLE_JOB_QUEUE_PATHでジョブキューのファイルを指定してください")
+    if args.purge:
+        logger.info("完了済みのジョブを削除しました: %s件", get_job_queue().purge())
+    elif args.processes == 1:
+        _worker_process(args.concurrency)
+    else:
+        run_worker_processes(args.processes, args.concurrency)
@@ -0,0 +1,180 @@
+# loadtest.py
+import argparse
+import asyncio
+import os
+import random
+import time
+from collections import defaultdict
+
+# 試験の流れ（ヒアリング → 確認 → 会話 → 評価）を模擬する受験者の入力
+OPENING_REQUESTS = [
+    "英語の初級で試験を受けたい",
+    "French intermediate exam please",
+    "英語の試験を受けたいです",
+    "スペイン語の上級テストをお願いします",
+]
+ANSWERS = [
+    "I like playing soccer with my friends.",
+    "I usually go shopping on weekends.",
+    "I want to visit Canada because of the nature.",
+    "I eat rice and miso soup for breakfast.",
+]
+
+
+def percentile(values, ratio):
+    """最近傍順位法でパーセンタイルを求める"""
+    ordered = sorted(values)
+    index = max(int(round(ratio * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def _next_input(state, step):
+    """現在の状態に応じた受験者の入力を返す"""
+    if state == "hearing":
+        return random.choice(OPENING_REQUESTS) if step == 0 else "初級でお願いします"
+    if state == "before":
+        return "はい、始めてください"
+    if state == "evaluating":
+        return "終了します"
+    return random.choice(ANSWERS)
+
+
+async def run_candidate(candidate_id, openai_service, max_turns, timings, failures, ledgers=None):
+    """
+    1人の受験者としてヒアリングから評価まで試験を進め、状態遷移ごとの所要時間を記録します
+    （ledgersを指定した場合は、セッションの料金台帳を追加する）
+    """
+    from main import GraChalleInterface
+
+    interface = GraChalleInterface(openai_service, max_turns=max_turns)
+    if ledgers is not None:
+        ledgers.append(interface.cost_ledger)
+    # ヒアリングのやり直しなどを考慮しても必ず終わるように上限を設ける
+    for step in range(max_turns + 6):
+        before = interface.state_label
+        started = time.perf_counter()
+        try:
+            await interface.run_async(_next_input(before, step))
+        except Exception as e:
+            failures[before] += 1
+            print(f"[candidate {candidate_id}] {before}で失敗しました: {e}")
+            return False
+        after = "finished" if before == "evaluating" else interface.state_label
+        timings[f"{before}->{after}"].append(time.perf_counter() - started)
+        if after == "finished":
+            return True
+    failures["incomplete"] += 1
+    return False
+
+
+async def run_load(endpoints, sessions, concurrency, max_turns, small_model=None):
+    """
+    N人の受験者を同時実行数の上限付きで並行に試験させます（接続先が複数の場合はデプロイメントプールとして使う）。
+    small_modelを指定した場合は、同じ接続先に置いた小型モデルにヒアリングなどを振り分けます。
+    """
+    from common import API_VERSION, MODEL_NAME, OpenAIService
+    from deployment_pool import DeploymentConfig
+
+    api_key = os.getenv("AZURE_OPENAI_API_KEY") or "mock-key"
+    openai_service = OpenAIService(
+        endpoint=endpoints[0],
+        api_key=api_key,
+        deployments=[
+            DeploymentConfig(endpoint=endpoint, api_key=api_key, model_name=MODEL_NAME, api_version=API_VERSION)
+            for endpoint in endpoints
+        ],
+        small_deployments=(
+            [
+                DeploymentConfig(endpoint=endpoint, api_key=api_key, model_name=small_model, api_version=API_VERSION)
+                for endpoint in endpoints
+            ]
+            if small_model
+            else None
+        ),
+    )
+    timings = defaultdict(list)
+    failures = defaultdict(int)
+    ledgers = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _bounded(candidate_id):
+        async with semaphore:
+            return await run_candidate(candidate_id, openai_service, max_turns, timings, failures, ledgers)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*[_bounded(i) for i in range(sessions)])
+    elapsed = time.perf_counter() - started
+    for deployment in openai_service.pool.deployments:
+        if deployment.rate_limiter is not None:
+            print(f"レートリミッター ({deployment.name}): {deployment.rate_limiter.stats()}")
+    print(f"デプロイメント: {openai_service.pool.stats()}")
+    if openai_service.small_pool is not openai_service.pool:
+        print(f"デプロイメント（小型モデル）: {openai_service.small_pool.stats()}")
+    print_costs(ledgers)
+    return timings, failures, sum(results), elapsed
+
+
+def print_costs(ledgers):
+    """全セッションの料金台帳を呼び出し箇所ごとに合算して表示する"""
+    totals = defaultdict(lambda: defaultdict(float))
+    for ledger in ledgers:
+        for call_site, entry in ledger.summary().items():
+            for name, value in entry.items():
+                totals[call_site][name] += value
+    print(f"\n{'call_site':<24}{'calls':>8}{'prompt':>10}{'compl.':>10}{'cost($)':>12}{'mean(ms)':>10}")
+    for call_site, entry in sorted(totals.items(), key=lambda item: -item[1]["cost"]):
+        print(
+            f"{call_site:<24}{int(entry['calls']):>8}{int(entry['prompt_tokens']):>10}"
+            f"{int(entry['completion_tokens']):>10}{entry['cost']:>12.4f}"
+            f"{entry['seconds'] / entry['calls'] * 1000:>10.1f}"
+        )
+
+
+def print_report(timings, failures, completed, sessions, elapsed):
+    """状態遷移ごとのレイテンシ分布とスループットを表示する"""
+    print(f"\n===== 負荷試験結果 ({completed}/{sessions} セッション完了, {elapsed:.2f}秒) =====")
+    print(f"{'transition':<24}{'count':>8}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}")
+    for transition, values in sorted(timings.items()):
+        print(
+            f"{transition:<24}{len(values):>8}"
+            f"{percentile(values, 0.50) * 1000:>10.1f}"
+            f"{percentile(values, 0.95) * 1000:>10.1f}"
+            f"{percentile(values, 0.99) * 1000:>10.1f}"
+        )
+    for state, count in sorted(failures.items()):
+        print(f"失敗: {state} x {count}")
+    print(f"スループット: {completed / elapsed:.2f} sessions/sec")
+
+
+if __name__ == "__main__":
+    from mock_server import add_mock_arguments, settings_from_args
+
+    parser = argparse.ArgumentParser(description="試験フロー全体の負荷試験を実行します")
+    parser.add_argument("--sessions", type=int, default=50, help="模擬受験者の総数")
+    parser.add_argument("--concurrency", type=int, default=20, help="同時に試験を進める受験者数")
+    parser.add_argument("--max-turns", type=int, default=3, help="1試験あたりの会話ターン数")
+    parser.add_argument(
+        "--endpoint",
+        action="append",
+        default=None,
+        help="接続先（複数指定でデプロイメントプール、未指定の場合はモックサーバーを同一プロセスで起動）",
+    )
+    parser.add_argument("--port", type=int, default=8765, help="同一プロセスで起動するモックサーバーの先頭ポート")
+    parser.add_argument("--deployments", type=int, default=1, help="同一プロセスで起動するモックサーバーの数")
+    parser.add_argument("--small-model", default=None, help="ヒアリングなどを振り分ける小型モデルのデプロイメント名")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    if args.endpoint is None:
+        from mock_server import start_mock_server
+
+        args.endpoint = []
+        for i in range(args.deployments):
+            port = args.port + i if args.port else 0
+            server = start_mock_server(port=port, settings=settings_from_args(args))
+            args.endpoint.append(f"http://127.0.0.1:{server.server_address[1]}")
+
+    timings, failures, completed, elapsed = asyncio.run(
+        run_load(args.endpoint, args.sessions, args.concurrency, args.max_turns, args.small_model)
+    )
+    print_report(timings, failures, completed, args.sessions, elapsed)
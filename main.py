@@ -1,91 +1,544 @@
 # main.py
 import asyncio
+import hashlib
+import json
 import logging
+import time
+import uuid
 
-from evaluator import ConversationEvaluator
-from examination import ConversationalChat
-from intent import IntentExtract
+from pydantic import BaseModel, Field
+
+from common import get_openai_service
+from evaluator import (
+    ConversationEvaluator,
+    EvaluationFeedback,
+    EvaluationResult,
+    EvaluationScore,
+    TurnAssessment,
+)
+from examination import ConversationalChat, ConversationalText, ConversationSummary
+from intent import (
+    ConfirmationMessage,
+    ExaminationInformation,
+    ExaminationStartIntent,
+    HearingResult,
+    IntentExtract,
+)
+from job_queue import FAILED, SUCCEEDED, get_job_queue
+from resilience import LLMFailure
+from runtime import get_background_loop, iterate_sync, run_sync
+from session_store import SessionSnapshot
+from structured_logging import bind_log_context, unbind_log_context
+from telemetry import (
+    CostLedger,
+    LedgerEntry,
+    bind_ledger,
+    record_transition,
+    unbind_ledger,
+)
+from tracing import (
+    bind_span,
+    span,
+    start_profile,
+    start_span,
+    traced_stream,
+    unbind_span,
+)
 
 # ロガーの参照
 logger = logging.getLogger(__name__)
 
+# LLMが混雑・障害で応答できない場合の案内（受験者のターンを消費しない）
+UNAVAILABLE_MESSAGE = "ただいま混み合っています。少し時間をおいてから、もう一度入力してください。"
+
+# 試験終了時の評価をジョブキューで処理する場合のジョブの種類と案内
+EVALUATION_JOB = "evaluation"
+EVALUATION_ACCEPTED_MESSAGE = "試験はこれで終了です。評価を受け付けました。結果がまとまるまで少々お待ちください。"
+EVALUATION_PENDING_MESSAGE = "評価を作成しています。もうしばらくお待ちください。"
+
+
+class EvaluationJobResult(BaseModel):
+    """評価ジョブの処理結果"""
+
+    report: str = Field(description="評価レポート")
+    cost: dict[str, LedgerEntry] = Field(default_factory=dict, description="評価にかかったLLM呼び出しの料金台帳")
+
 
 # -----------------------------------------------------#
 # メインアプリケーションエントリーポイント               #
 # -----------------------------------------------------#
 class GraChalleInterface:
-    def __init__(self):
-        self.intent_extract = IntentExtract()
-        self.examination = ConversationalChat()
-        self.evaluator = ConversationEvaluator()
+    def __init__(self, openai_service=None, max_turns=3, session_id=None, job_queue=None):
+        # セッションの識別子と、このセッションのLLM呼び出しの料金台帳
+        self.session_id = session_id or uuid.uuid4().hex
+        self.cost_ledger = CostLedger(self.session_id)
+        # OpenAIServiceはプロセス共有のものを各コンポーネントで使い回す
+        self.intent_extract = IntentExtract(openai_service)
+        self.examination = ConversationalChat(openai_service)
+        self.evaluator = ConversationEvaluator(openai_service=openai_service)
 
         self.IS_REQUEST_EXAMINATION = False
         self.LANGAGE = None
         self.LEVEL = None
 
         self.exam_status = "hearing"  # "hearing", "before", "started", "finished"
+        # 確認メッセージ返却時に先行生成を開始した試験官の第一声
+        self._pending_opener = None
+        # スナップショットから再開した場合の、生成済みの第一声
+        self._prefetched_opener = None
+        # 試験中にバックグラウンドで実行しているターン別評価
+        self._turn_scoring_tasks = []
         self.conversation_turns = 0
-        self.MAX_TURNS = 3  # 最大会話ターン数
+        self.MAX_TURNS = max_turns  # 最大会話ターン数
+        # セッションストアに保存した版数（ターンごとに増やす）
+        self.version = 0
+        # 試験終了時の評価を処理するジョブキュー（未設定の場合はリクエスト内で評価する）
+        self.job_queue = job_queue if job_queue is not None else get_job_queue()
+        self.evaluation_job_id = None
+        self.evaluation_report = None
+        # このセッションのターンを必ずプロファイルするかどうか（Falseの場合は設定した割合でサンプリング）
+        self.profile = False
 
-    async def _evaluator(self, conversation_full):
-        evaluator = ConversationEvaluator()
-        evaluator.set_conversation_history(conversation_full)
+    async def _score_turn(self, turn, question, answer):
+        """ユーザーの1ターン分の回答を評価し、会話状態に記録します"""
+        with span("evaluator.assess_turn", turn=turn):
+            assessment = await self.evaluator.assess_turn(self.LANGAGE, self.LEVEL, question, answer)
+        if assessment is not None:
+            self.examination.record_turn_assessment(turn, assessment)
+
+    def _cancel_turn_scoring(self):
+        """実行中のターン別評価をキャンセルします"""
+        for task in self._turn_scoring_tasks:
+            if not task.done():
+                task.get_loop().call_soon_threadsafe(task.cancel)
+        self._turn_scoring_tasks = []
+
+    async def _evaluator_stream(self, conversation_full):
+        """
+        試験中に算出したターン別評価が揃っていればそれを集計し、
+        揃っていなければスコア算出とフィードバック生成を並列に実行して、評価レポートをセクション単位で返します
+        """
+        if self._turn_scoring_tasks:
+            await asyncio.gather(*self._turn_scoring_tasks, return_exceptions=True)
+            self._turn_scoring_tasks = []
+        assessments = self.examination.state.turn_assessments
+        if assessments and len(assessments) >= self.conversation_turns:
+            logger.info("\nターン別評価を集計して評価レポートを作成します")
+            async for section in self.evaluator.report_stream_from_assessments(assessments):
+                yield section
+            return
+
+        self.evaluator.set_conversation_history(conversation_full)
         logger.info("\n会話の評価を開始します")
-        score = await evaluator.examination_score(self.LANGAGE, self.LEVEL)
-        feedback = await evaluator.examination_feedback(self.LANGAGE, self.LEVEL)
-        result = await evaluator.result_report(score, feedback)
-        return result
+        async for section in self.evaluator.evaluate_stream(self.LANGAGE, self.LEVEL):
+            yield section
+
+    async def _evaluator(self, conversation_full):
+        return "".join([section async for section in self._evaluator_stream(conversation_full)])
+
+    # -----------------------------------------------------#
+    # 評価ジョブ                                           #
+    # -----------------------------------------------------#
+    async def submit_evaluation_async(self):
+        """
+        会話ターンを終えた試験の評価をジョブとして登録します。
+        冪等キーはセッションIDと会話履歴から作るため、再読み込みなどで再送しても同じ会話の評価は1件のみです。
+
+        Returns:
+            Job: 登録した（または登録済みの）ジョブ
+        """
+        # 実行中のターン別評価を待ってからスナップショットに含め、ワーカーでの採点し直しを避ける
+        if self._turn_scoring_tasks:
+            await asyncio.gather(*self._turn_scoring_tasks, return_exceptions=True)
+            self._turn_scoring_tasks = []
+        history = json.dumps(self.examination.get_conversation_history(), sort_keys=True, ensure_ascii=False)
+        key = f"{EVALUATION_JOB}:{self.session_id}:{hashlib.sha256(history.encode('utf-8')).hexdigest()[:16]}"
+        job = await asyncio.to_thread(self.job_queue.submit, EVALUATION_JOB, key, self.snapshot().model_dump_json())
+        self.evaluation_job_id = job.job_id
+        logger.info("評価ジョブを登録しました: %s (%s)", job.job_id, job.status)
+        return job
+
+    def _apply_evaluation(self, job):
+        """成功した評価ジョブの評価レポートと料金をセッションに取り込む（1回のみ）"""
+        if job.status != SUCCEEDED or self.evaluation_report is not None:
+            return
+        result = EvaluationJobResult.model_validate_json(job.result)
+        self.cost_ledger.merge(result.cost)
+        self.evaluation_report = result.report
+
+    async def poll_evaluation_async(self):
+        """
+        評価ジョブの状態を確認し、成功していれば評価レポートをセッションに取り込みます
+
+        Returns:
+            Job: 評価ジョブ（未登録・削除済みの場合はNone）
+        """
+        if self.job_queue is None or self.evaluation_job_id is None:
+            return None
+        job = await asyncio.to_thread(self.job_queue.get, self.evaluation_job_id)
+        if job is not None:
+            self._apply_evaluation(job)
+        return job
+
+    async def wait_evaluation_async(self, timeout=None):
+        """
+        評価ジョブの完了を待ちます
+
+        Parameters:
+            timeout (float): 待機する最大秒数（Noneの場合は無制限）
+
+        Returns:
+            Job: 完了した、または期限までに完了しなかった時点の評価ジョブ（未登録・削除済みの場合はNone）
+        """
+        if self.job_queue is None or self.evaluation_job_id is None:
+            return None
+        job = await self.job_queue.wait(self.evaluation_job_id, timeout)
+        if job is not None:
+            self._apply_evaluation(job)
+        return job
+
+    async def _evaluation_job_stream(self):
+        """評価ジョブを登録し、以降の入力には処理状況か評価レポートを返す"""
+        if self.evaluation_report is None:
+            job = await self.poll_evaluation_async()
+            if job is None:
+                await self.submit_evaluation_async()
+                yield EVALUATION_ACCEPTED_MESSAGE
+                return
+            if job.status == FAILED:
+                # ワーカーで処理できなかった場合は、このリクエスト内で評価する
+                logger.error("評価ジョブが失敗したため、リクエスト内で評価します: %s: %s", job.job_id, job.error)
+                sections = []
+                async for section in self._evaluator_stream(self.examination.get_conversation_history()):
+                    sections.append(section)
+                    yield section
+                self.evaluation_report = "".join(sections)
+                return
+            if job.status != SUCCEEDED:
+                yield EVALUATION_PENDING_MESSAGE
+                return
+        yield self.evaluation_report
 
     async def run_async(self, user_input):
+        """
+        ユーザー入力を処理し、応答全文を返します
+        """
+        return "".join([chunk async for chunk in self.run_stream_async(user_input)])
+
+    @property
+    def state_label(self):
+        """状態遷移の集計用ラベル（会話ターンを終えて評価待ちの状態を"evaluating"として区別する）"""
+        if self.exam_status == "started" and self.conversation_turns >= self.MAX_TURNS:
+            return "evaluating"
+        return self.exam_status
+
+    async def run_stream_async(self, user_input):
+        """
+        ユーザー入力を処理し、応答を逐次返します
+        （試験官の発話はトークン単位、評価レポートはセクション単位で出力）
+        状態遷移ごとの所要時間を記録し、LLM呼び出しはこのセッションの料金台帳に記録します。
+        トレースが有効な場合はターン全体を1つのトレースとし、プロファイル対象のターンはスタックファイルを出力します。
+        """
+        before = self.state_label
+        started = time.perf_counter()
+        first_chunk = None
+        turn_span = start_span("turn", **{"session.id": self.session_id, "exam.state": before})
+        profiler = start_profile(self.session_id, forced=self.profile)
+        agen = self._dispatch_stream(user_input)
+        try:
+            while True:
+                # 同期ブリッジでは要素ごとに別タスクで進むため、台帳・スパン・ログの文脈は要素を取り出すたびに設定する
+                token = bind_ledger(self.cost_ledger)
+                span_token = bind_span(turn_span)
+                log_token = bind_log_context(session_id=self.session_id, stage=before)
+                try:
+                    chunk = await agen.__anext__()
+                except StopAsyncIteration:
+                    break
+                except Exception as e:
+                    turn_span.record_exception(e)
+                    raise
+                finally:
+                    unbind_log_context(log_token)
+                    unbind_span(span_token)
+                    unbind_ledger(token)
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - started
+                    turn_span.add_event("first_chunk")
+                yield chunk
+        finally:
+            await agen.aclose()
+            after = "finished" if before == "evaluating" else self.state_label
+            turn_span.set_attribute("exam.transition", f"{before}->{after}")
+            if profiler is not None:
+                turn_span.set_attribute("profile.path", profiler.stop())
+                logger.info("ターンのスタックファイルを出力します: %s", profiler.path)
+            turn_span.end()
+        record_transition(f"{before}->{after}", time.perf_counter() - started, first_chunk)
+
+    async def _dispatch_stream(self, user_input):
+        """現在の状態に応じてユーザー入力を処理し、応答を逐次返します"""
         logger.info("会話式外国語試験を開始します")
         if self.exam_status == "hearing":
-            # ステップ1: 意図検出
+            examination_info = None
+            # ステップ1+2: 意図検出と情報抽出を1回の非同期呼び出しで実施
             if not self.IS_REQUEST_EXAMINATION:
-                content = self.intent_extract.detect_intent(user_input)
-                self.IS_REQUEST_EXAMINATION = content.is_request_for_examination
+                with span("intent.hear"):
+                    examination_info = await self.intent_extract.hear_async(user_input)
+                if isinstance(examination_info, LLMFailure):
+                    yield UNAVAILABLE_MESSAGE
+                    return
+                self.IS_REQUEST_EXAMINATION = examination_info.is_request_for_examination
             # 試験リクエストでない場合は終了
             if not self.IS_REQUEST_EXAMINATION:
                 logger.info("入力は試験リクエストではありません")
-                return "申し訳ありませんが、関係のない入力のため終了します。"
-            # ステップ2: 情報抽出
-            if self.LANGAGE is None or self.LEVEL is None:
-                examination_info = self.intent_extract.extract_examination_info(user_input)
+                yield "申し訳ありませんが、関係のない入力のため終了します。"
+                return
+            # ステップ2: 不足している情報のみ追加で抽出
+            if examination_info is None and (self.LANGAGE is None or self.LEVEL is None):
+                with span("intent.extract_examination_info"):
+                    examination_info = await self.intent_extract.extract_examination_info_async(
+                        user_input, need_language=self.LANGAGE is None, need_level=self.LEVEL is None
+                    )
+                if isinstance(examination_info, LLMFailure):
+                    yield UNAVAILABLE_MESSAGE
+                    return
+            if examination_info is not None:
                 if self.LANGAGE is None:
-                    logger.info(f"抽出された言語: {examination_info.language}")
+                    logger.info("抽出された言語: %s", examination_info.language)
                     self.LANGAGE = examination_info.language
                 if self.LEVEL is None:
-                    logger.info(f"抽出されたレベル: {examination_info.level}")
+                    logger.info("抽出されたレベル: %s", examination_info.level)
                     self.LEVEL = examination_info.level
             # ステップ3: 不足情報の入力促進
             if self.LANGAGE is None:
-                return "試験で出題される言語を指定してください。"
+                yield "試験で出題される言語を指定してください。"
+                return
             if self.LEVEL is None:
-                return "出題難易度を指定してください。"
-            confirmation = self.intent_extract.generate_confirmation(
-                self.LANGAGE,
-                self.LEVEL,
-            )
+                yield "出題難易度を指定してください。"
+                return
+            with span("intent.generate_confirmation"):
+                confirmation = await self.intent_extract.generate_confirmation_async(
+                    self.LANGAGE,
+                    self.LEVEL,
+                )
+            if isinstance(confirmation, LLMFailure):
+                # 確認できていないまま試験を始めないよう、ヒアリングの状態のまま次の入力を待つ
+                yield UNAVAILABLE_MESSAGE
+                return
             self.exam_status = "before"
-            return confirmation.confirmation_message
+            # 次のターンを待たずに第一声の生成を先行して開始する
+            self._pending_opener = asyncio.create_task(self.examination.generate_opener(self.LANGAGE, self.LEVEL))
+            yield confirmation.confirmation_message
+            return
         if self.exam_status == "before":
-            # 試験開始
-            first_conv = await self.examination.initialize_conversation(self.LANGAGE, self.LEVEL)
+            # 試験開始（先行生成した第一声があればそれを使う）
+            pending_opener, self._pending_opener = self._pending_opener, None
+            with span("examination.await_opener", prefetched=pending_opener is not None):
+                first_message = await pending_opener if pending_opener is not None else self._prefetched_opener
+            self._prefetched_opener = None
+            if first_message is not None:
+                self.examination.start_with_opener(self.LANGAGE, self.LEVEL, first_message)
+                self.exam_status = "started"
+                yield first_message
+                return
+            async for chunk in traced_stream(
+                "examination.initialize", self.examination.initialize_conversation_stream(self.LANGAGE, self.LEVEL)
+            ):
+                yield chunk
             self.exam_status = "started"
-            return first_conv
+            return
+        if self.conversation_turns >= self.MAX_TURNS and self.job_queue is not None:
+            # 試験を終了して評価をジョブとして登録（応答はすぐに返し、評価はワーカーが処理する）
+            async for chunk in traced_stream("evaluation.job", self._evaluation_job_stream()):
+                yield chunk
+            return
         if self.conversation_turns >= self.MAX_TURNS:
             # 試験を終了して評価を実行
             conversation_history = self.examination.get_conversation_history()
-            response = await self._evaluator(conversation_history)
-            return response
-        response = await self.examination.continue_conversation(user_input)
+            async for section in traced_stream("evaluation.inline", self._evaluator_stream(conversation_history)):
+                yield section
+            return
+        # 回答の評価は次の質問の生成と並行してバックグラウンドで進める
+        question = self.examination.last_assistant_message()
+        scoring = asyncio.create_task(self._score_turn(self.conversation_turns + 1, question, user_input))
+        self._turn_scoring_tasks.append(scoring)
+        failure = None
+        async for chunk in traced_stream(
+            "examination.continue", self.examination.continue_conversation_stream(user_input)
+        ):
+            if isinstance(chunk, LLMFailure):
+                failure = chunk
+                continue
+            yield chunk
+        if failure is not None:
+            # 試験官が応答できなかったターンは数えず、同じターンの回答をもう一度受け付ける
+            scoring.cancel()
+            self._turn_scoring_tasks.remove(scoring)
+            self.examination.discard_turn_assessment(self.conversation_turns + 1)
+            yield UNAVAILABLE_MESSAGE
+            return
         self.conversation_turns += 1
-        return response
+
+    def reset(self):
+        """
+        セッションを初期状態に戻します（先行生成中の第一声はキャンセル）
+        """
+        if self._pending_opener is not None and not self._pending_opener.done():
+            # 常駐イベントループ以外のスレッドから呼ばれても安全にキャンセルする
+            self._pending_opener.get_loop().call_soon_threadsafe(self._pending_opener.cancel)
+        self._pending_opener = None
+        self._prefetched_opener = None
+        self._cancel_turn_scoring()
+        self.examination.reset_state()
+        self.IS_REQUEST_EXAMINATION = False
+        self.LANGAGE = None
+        self.LEVEL = None
+        self.exam_status = "hearing"
+        self.conversation_turns = 0
+        self.evaluation_job_id = None
+        self.evaluation_report = None
+
+    def snapshot(self) -> SessionSnapshot:
+        """
+        現在の状態をセッションストアに保存できる形で返します。
+        先行生成中の第一声は完了していれば含め、実行中のターン別評価は含みません
+        （別のワーカーで再開した場合は、評価時に会話全体から採点し直します）。
+        """
+        opener = None
+        pending = self._pending_opener
+        if pending is not None and pending.done() and not pending.cancelled() and pending.exception() is None:
+            opener = pending.result()
+        return SessionSnapshot(
+            session_id=self.session_id,
+            version=self.version,
+            exam_status=self.exam_status,
+            is_request_examination=self.IS_REQUEST_EXAMINATION,
+            language=self.LANGAGE,
+            level=self.LEVEL,
+            conversation_turns=self.conversation_turns,
+            max_turns=self.MAX_TURNS,
+            conversation=self.examination.state,
+            pending_opener=opener or self._prefetched_opener,
+            cost=self.cost_ledger.entries,
+            evaluation_job_id=self.evaluation_job_id,
+            evaluation_report=self.evaluation_report,
+        )
+
+    def restore(self, snapshot: SessionSnapshot):
+        """
+        スナップショットの状態から再開します（実行中の先行生成・ターン別評価は破棄）
+        """
+        self.reset()
+        self.session_id = snapshot.session_id
+        self.version = snapshot.version
+        self.exam_status = snapshot.exam_status
+        self.IS_REQUEST_EXAMINATION = snapshot.is_request_examination
+        self.LANGAGE = snapshot.language
+        self.LEVEL = snapshot.level
+        self.conversation_turns = snapshot.conversation_turns
+        self.MAX_TURNS = snapshot.max_turns
+        self.examination.restore_state(snapshot.conversation)
+        self._prefetched_opener = snapshot.pending_opener
+        self.cost_ledger = CostLedger(snapshot.session_id)
+        self.cost_ledger.entries = dict(snapshot.cost)
+        self.evaluation_job_id = snapshot.evaluation_job_id
+        self.evaluation_report = snapshot.evaluation_report
+
+    @classmethod
+    def from_snapshot(cls, snapshot: SessionSnapshot, openai_service=None):
+        """スナップショットからインターフェースを作成します"""
+        interface = cls(openai_service, max_turns=snapshot.max_turns, session_id=snapshot.session_id)
+        interface.restore(snapshot)
+        return interface
 
     def run(self, user_input):
         """
         同期版インターフェース（非同期関数をラップ）
+        ターンごとにイベントループを作り直さず、プロセス共有の常駐イベントループ上で実行します。
         """
-        return asyncio.run(self.run_async(user_input))
+        return run_sync(self.run_async(user_input))
+
+    def run_stream(self, user_input):
+        """
+        同期版ストリーミングインターフェース（Streamlitの`st.write_stream`向け）
+        """
+        return iterate_sync(self.run_stream_async(user_input))
+
+
+# -----------------------------------------------------#
+# 起動時のウォームアップ                               #
+# -----------------------------------------------------#
+# 試験の流れで使う構造化出力のスキーマ（ウォームアップ時にresponse_formatへの変換を済ませる）
+STRUCTURED_OUTPUT_SCHEMAS = (
+    ExaminationStartIntent,
+    ExaminationInformation,
+    HearingResult,
+    ConfirmationMessage,
+    ConversationalText,
+    ConversationSummary,
+    EvaluationScore,
+    EvaluationFeedback,
+    EvaluationResult,
+    TurnAssessment,
+)
+
+
+async def warm_up_async(openai_service=None):
+    """
+    最初の受験者が来る前に、スキーマの変換とデプロイメントへの接続を済ませます
+    （APIサーバーは起動時に待ち、Streamlitは常駐イベントループで待たずに実行する）
+
+    Parameters:
+        openai_service (OpenAIService): 対象のサービス（未指定の場合はプロセス共有のもの）
+
+    Returns:
+        int: 接続できたデプロイメントの数
+    """
+    openai_service = openai_service or get_openai_service()
+    return await openai_service.warm_up_async(STRUCTURED_OUTPUT_SCHEMAS)
+
+
+def start_warm_up(openai_service=None):
+    """
+    ウォームアップを常駐イベントループで開始し、完了を待たずに返します
+
+    Returns:
+        concurrent.futures.Future: ウォームアップの完了を通知する
+    """
+    return asyncio.run_coroutine_threadsafe(warm_up_async(openai_service), get_background_loop().loop)
+
+
+# -----------------------------------------------------#
+# 評価ジョブの処理関数（ワーカーで実行）               #
+# -----------------------------------------------------#
+async def run_evaluation_job(payload):
+    """
+    評価ジョブを処理します（スナップショットから試験を復元して評価する）
+
+    Parameters:
+        payload (str): 評価を登録した時点のSessionSnapshot（JSON文字列）
+
+    Returns:
+        str: EvaluationJobResult（JSON文字列）
+    """
+    snapshot = SessionSnapshot.model_validate_json(payload)
+    interface = GraChalleInterface.from_snapshot(snapshot, get_openai_service())
+    # 評価の分のみを集計し、受け取ったセッション側で台帳に加算する
+    ledger = CostLedger(snapshot.session_id)
+    token = bind_ledger(ledger)
+    log_token = bind_log_context(session_id=snapshot.session_id, stage=EVALUATION_JOB)
+    try:
+        with span("job.evaluation", **{"session.id": snapshot.session_id}):
+            report = await interface._evaluator(interface.examination.get_conversation_history())
+    finally:
+        unbind_log_context(log_token)
+        unbind_ledger(token)
+    return EvaluationJobResult(report=report, cost=ledger.entries).model_dump_json()
+
+
+# ジョブの種類ごとの処理関数（job_queue.pyのワーカーが使う）
+JOB_HANDLERS = {EVALUATION_JOB: run_evaluation_job}
 
 
 # 単独実行の場合のサンプルコード
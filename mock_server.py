@@ -0,0 +1,315 @@
+# mock_server.py
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from common import logger
+
+COMPLETIONS_PATH = re.compile(r"^/openai/deployments/(?P<deployment>[^/]+)/chat/completions$")
+
+SAMPLE_QUESTIONS = [
+    "What do you usually do on weekends?",
+    "Could you tell me about your favorite food?",
+    "Where would you like to travel next, and why?",
+    "How do you usually spend your mornings?",
+    "What kind of music do you enjoy?",
+]
+
+# 判定の確信度を低く返す割合（小型モデルからのエスカレーションの確認用）
+LOW_CONFIDENCE_SHARE = 0.1
+
+
+def _confidence():
+    return 0.3 if random.random() < LOW_CONFIDENCE_SHARE else 0.9
+
+
+# スキーマ名ごとに、もっともらしい応答値を返すための上書き設定
+SCHEMA_OVERRIDES = {
+    "ExaminationStartIntent": lambda user_text: {
+        "description": user_text,
+        "is_request_for_examination": True,
+        "confidence": _confidence(),
+    },
+    "ExaminationInformation": lambda user_text: {"language": "英語", "level": "初級", "confidence": _confidence()},
+    "HearingResult": lambda user_text: {
+        "is_request_for_examination": True,
+        "language": "英語",
+        "level": "初級",
+        "confidence": _confidence(),
+    },
+    "ConfirmationMessage": lambda user_text: {
+        "confirmation_message": "英語の初級レベルで試験を開始します。準備ができたら返信してください。"
+    },
+    "ConversationalText": lambda user_text: {"message": random.choice(SAMPLE_QUESTIONS)},
+    "EvaluationScore": lambda user_text: {"score": random.randint(50, 95)},
+    "EvaluationFeedback": lambda user_text: {"feedback": "語彙は適切ですが、時制の誤りが見られます。"},
+    "EvaluationResult": lambda user_text: {"result": "総合的に良好です。時制の一致を意識するとさらに良くなります。"},
+    "TurnAssessment": lambda user_text: {
+        "score": random.randint(50, 95),
+        "mistakes": ["時制の誤り"],
+        "feedback": "質問に適切に答えられています。",
+    },
+}
+
+
+# -----------------------------------------------------#
+# スキーマからの応答生成                               #
+# -----------------------------------------------------#
+def build_payload(schema, defs=None):
+    """
+    JSONスキーマを満たす値を生成します（上書き設定のないスキーマ用の汎用生成）
+    """
+    defs = defs if defs is not None else schema.get("$defs", {})
+    if "$ref" in schema:
+        return build_payload(defs[schema["$ref"].split("/")[-1]], defs)
+    if "anyOf" in schema:
+        candidates = [option for option in schema["anyOf"] if option.get("type") != "null"]
+        return build_payload(candidates[0], defs) if candidates else None
+
+    schema_type = schema.get("type")
+    if schema_type == "object":
+        return {name: build_payload(prop, defs) for name, prop in schema.get("properties", {}).items()}
+    if schema_type == "array":
+        return [build_payload(schema.get("items", {"type": "string"}), defs)]
+    if schema_type == "integer":
+        return random.randint(0, 100)
+    if schema_type == "number":
+        return round(random.uniform(0, 100), 1)
+    if schema_type == "boolean":
+        return True
+    return "サンプル"
+
+
+def payload_for_request(body):
+    """リクエストのresponse_formatに合わせた応答のJSON文字列を返す"""
+    response_format = body.get("response_format") or {}
+    json_schema = response_format.get("json_schema") or {}
+    messages = body.get("messages") or []
+    user_text = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+
+    override = SCHEMA_OVERRIDES.get(json_schema.get("name"))
+    if override is not None:
+        payload = override(user_text)
+    elif json_schema.get("schema"):
+        payload = build_payload(json_schema["schema"])
+    else:
+        payload = {"message": random.choice(SAMPLE_QUESTIONS)}
+    return json.dumps(payload, ensure_ascii=False)
+
+
+# -----------------------------------------------------#
+# モックサーバー                                       #
+# -----------------------------------------------------#
+class MockSettings:
+    """モックサーバーの挙動（遅延分布・エラー率・ストリーミング）の設定"""
+
+    def __init__(
+        self,
+        latency_median=0.8,
+        latency_sigma=0.4,
+        error_rate=0.0,
+        throttle_share=0.7,
+        retry_after=1.0,
+        chunk_size=4,
+        chunk_interval=0.02,
+    ):
+        """
+        Parameters:
+            latency_median (float): 応答遅延（ストリーミング時は最初のトークンまで）の中央値（秒）
+            latency_sigma (float): 応答遅延の対数正規分布のσ
+            error_rate (float): エラー応答を返す割合（0～1）
+            throttle_share (float): エラーのうち429（レート制限）とする割合、残りは500
+            retry_after (float): 429応答に付与するRetry-After（秒）
+            chunk_size (int): ストリーミング時に1チャンクで送る文字数
+            chunk_interval (float): ストリーミング時のチャンク間隔（秒）
+        """
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.throttle_share = throttle_share
+        self.retry_after = retry_after
+        self.chunk_size = chunk_size
+        self.chunk_interval = chunk_interval
+
+    def sample_latency(self):
+        """対数正規分布に従う遅延を生成する"""
+        if self.latency_median <= 0:
+            return 0.0
+        return random.lognormvariate(0, self.latency_sigma) * self.latency_median
+
+
+class MockAzureOpenAIHandler(BaseHTTPRequestHandler):
+    """Azure OpenAIのchat completions（構造化出力）を模擬するハンドラー"""
+
+    settings = MockSettings()
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug("mock: " + format % args)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        # ウォームアップ用のモデル一覧
+        if self.path.split("?")[0] == "/openai/models":
+            self._send_json(200, {"object": "list", "data": []})
+            return
+        self._send_json(404, {"error": {"code": "NotFound", "message": self.path}})
+
+    def do_POST(self):
+        match = COMPLETIONS_PATH.match(self.path.split("?")[0])
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if match is None:
+            self._send_json(404, {"error": {"code": "NotFound", "message": self.path}})
+            return
+
+        settings = self.settings
+        time.sleep(settings.sample_latency())
+        if random.random() < settings.error_rate:
+            if random.random() < settings.throttle_share:
+                self._send_json(
+                    429,
+                    {"error": {"code": "429", "message": "Rate limit is exceeded."}},
+                    {"Retry-After": str(settings.retry_after)},
+                )
+            else:
+                self._send_json(500, {"error": {"code": "InternalServerError", "message": "mock failure"}})
+            return
+
+        content = payload_for_request(body)
+        deployment = match.group("deployment")
+        if body.get("stream"):
+            self._stream(deployment, content, body)
+        else:
+            self._send_json(200, self._completion(deployment, content, body))
+
+    def _usage(self, content, body):
+        prompt_chars = sum(len(str(m.get("content", ""))) for m in body.get("messages") or [])
+        prompt_tokens = prompt_chars // 2 + 1
+        completion_tokens = len(content) // 2 + 1
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    def _completion(self, deployment, content, body):
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": deployment,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": self._usage(content, body),
+        }
+
+    def _stream(self, deployment, content, body):
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        def _chunk(delta, finish_reason=None, usage=None):
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": deployment,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            if usage is not None:
+                payload["usage"] = usage
+            self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        size = max(self.settings.chunk_size, 1)
+        for start in range(0, len(content), size):
+            delta = {"content": content[start : start + size]}
+            if start == 0:
+                delta["role"] = "assistant"
+            _chunk(delta)
+            time.sleep(self.settings.chunk_interval)
+        _chunk({}, "stop", self._usage(content, body))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+class _MockHTTPServer(ThreadingHTTPServer):
+    # 多数のセッションが同時に接続しても接続エラーにならないよう、待ち受けキューを広げる
+    request_queue_size = 512
+
+
+def start_mock_server(host="127.0.0.1", port=8765, settings=None):
+    """
+    モックサーバーをバックグラウンドスレッドで起動します。
+
+    Returns:
+        ThreadingHTTPServer: 起動したサーバー（shutdown()で停止）
+    """
+    handler = type("ConfiguredMockHandler", (MockAzureOpenAIHandler,), {"settings": settings or MockSettings()})
+    server = _MockHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-azure-openai", daemon=True).start()
+    logger.info("モックAzure OpenAIサーバーを起動しました: http://%s:%s", host, server.server_address[1])
+    return server
+
+
+def add_mock_arguments(parser):
+    """モックサーバーの挙動に関するコマンドライン引数を追加する"""
+    parser.add_argument("--latency-median", type=float, default=0.8, help="応答遅延の中央値（秒）")
+    parser.add_argument("--latency-sigma", type=float, default=0.4, help="応答遅延の対数正規分布のσ")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="エラー応答の割合（0～1）")
+    parser.add_argument("--throttle-share", type=float, default=0.7, help="エラーのうち429とする割合")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429応答のRetry-After（秒）")
+    parser.add_argument("--chunk-size", type=int, default=4, help="ストリーミング時の1チャンクの文字数")
+    parser.add_argument("--chunk-interval", type=float, default=0.02, help="ストリーミング時のチャンク間隔（秒）")
+
+
+def settings_from_args(args):
+    """コマンドライン引数からモックサーバーの設定を作る"""
+    return MockSettings(
+        latency_median=args.latency_median,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        throttle_share=args.throttle_share,
+        retry_after=args.retry_after,
+        chunk_size=args.chunk_size,
+        chunk_interval=args.chunk_interval,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Azure OpenAIのモックサーバーを起動します")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    server = start_mock_server(args.host, args.port, settings_from_args(args))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,142 @@
+# model_routing.py
+import os
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+import config  # noqa: F401
+from deployment_pool import load_deployment_configs
+from ratelimit import PRIORITY_CONVERSATION, PRIORITY_EVALUATION, PRIORITY_HEARING
+from resilience import LLMFailure
+
+# -----------------------------------------------------#
+# モデル振り分けの設定                                 #
+# -----------------------------------------------------#
+TIER_SMALL = "small"  # 小型・高速なモデル（意図判定や抽出など）
+TIER_LARGE = "large"  # 大型モデル（AZURE_OPENAI_MODEL）
+TIERS = (TIER_SMALL, TIER_LARGE)
+
+# 小型モデルのデプロイメント名（未指定の場合は小型の呼び出しも大型モデルで処理する）
+MODEL_SMALL = os.getenv("AZURE_OPENAI_MODEL_SMALL")
+# 小型モデルを別のエンドポイントに置く場合のデプロイメント一覧（形式はAZURE_OPENAI_DEPLOYMENTSと同じ）
+DEPLOYMENTS_SMALL_JSON = os.getenv("AZURE_OPENAI_DEPLOYMENTS_SMALL")
+# 呼び出し箇所ごとの振り分けの上書き（例: "hearing=large,summary=large"）
+MODEL_ROUTES = os.getenv("GRACHALLE_MODEL_ROUTES", "")
+# 小型モデルの判定の確信度がこの値を下回った場合は大型モデルで判定し直す
+ESCALATION_THRESHOLD = float(os.getenv("GRACHALLE_ESCALATION_THRESHOLD", "0.6"))
+
+
+class Route(BaseModel):
+    """呼び出し箇所ごとの振り分け先"""
+
+    tier: str = Field(default=TIER_LARGE, description="モデルの区分（small/large）")
+    priority: int = Field(default=PRIORITY_CONVERSATION, description="レート制限の優先度（ratelimit.PRIORITY_*）")
+    escalate: bool = Field(
+        default=False, description="小型モデルの結果が失敗・低確信度の場合に大型モデルで呼び直すかどうか"
+    )
+
+
+# 呼び出し箇所 → 振り分け先
+DEFAULT_ROUTES = {
+    # ヒアリング（意図判定・試験情報の抽出）は呼び出し件数が多く、小型モデルで十分に判定できる
+    "hearing": Route(tier=TIER_SMALL, priority=PRIORITY_HEARING, escalate=True),
+    "detect_intent": Route(tier=TIER_SMALL, priority=PRIORITY_HEARING, escalate=True),
+    "extract_info": Route(tier=TIER_SMALL, priority=PRIORITY_HEARING, escalate=True),
+    "confirmation": Route(tier=TIER_SMALL, priority=PRIORITY_HEARING),
+    "summary": Route(tier=TIER_SMALL),
+    # 試験官の発話と評価は品質を優先して大型モデルを使う
+    "opener": Route(tier=TIER_LARGE),
+    "continue": Route(tier=TIER_LARGE),
+    "turn_assessment": Route(tier=TIER_LARGE),
+    "evaluation_score": Route(tier=TIER_LARGE, priority=PRIORITY_EVALUATION),
+    "evaluation_feedback": Route(tier=TIER_LARGE, priority=PRIORITY_EVALUATION),
+    "evaluation_report": Route(tier=TIER_LARGE, priority=PRIORITY_EVALUATION),
+}
+
+
+def parse_route_overrides(text):
+    """
+    "呼び出し箇所=区分"のカンマ区切りを辞書に変換します。
+
+    Parameters:
+        text (str): 上書き設定（例: "hearing=large,summary=large"）
+
+    Returns:
+        dict[str, str]: 呼び出し箇所 → 区分
+    """
+    overrides = {}
+    for item in (text or "").split(","):
+        if not item.strip():
+            continue
+        call_site, _, tier = item.partition("=")
+        call_site, tier = call_site.strip(), tier.strip().lower()
+        if call_site not in DEFAULT_ROUTES:
+            raise ValueError(f"未知の呼び出し箇所です: {call_site}（{', '.join(DEFAULT_ROUTES)}のいずれか）")
+        if tier not in TIERS:
+            raise ValueError(f"未知のモデル区分です: {call_site}={tier}（{', '.join(TIERS)}のいずれか）")
+        overrides[call_site] = tier
+    return overrides
+
+
+def load_small_deployment_configs(large_configs, endpoint, api_key, api_version):
+    """
+    小型モデルのデプロイメント一覧を返します（小型モデルが設定されていない場合はNone）。
+    AZURE_OPENAI_DEPLOYMENTS_SMALLがなければ、大型モデルと同じエンドポイントに小型モデルを置いたものとみなします。
+
+    Parameters:
+        large_configs (list[DeploymentConfig]): 大型モデルのデプロイメント一覧
+        endpoint (str): 省略時に補うエンドポイント
+        api_key (str): 省略時に補うAPIキー
+        api_version (str): 省略時に補うAPIバージョン
+
+    Returns:
+        list[DeploymentConfig]: 小型モデルのデプロイメント一覧
+    """
+    if DEPLOYMENTS_SMALL_JSON:
+        return load_deployment_configs(endpoint, api_key, MODEL_SMALL, api_version, DEPLOYMENTS_SMALL_JSON)
+    if not MODEL_SMALL:
+        return None
+    return [config.model_copy(update={"model_name": MODEL_SMALL}) for config in large_configs]
+
+
+# -----------------------------------------------------#
+# モデルルーター                                       #
+# -----------------------------------------------------#
+class ModelRouter:
+    """
+    呼び出し箇所（call_site）から、使うモデルの区分・レート制限の優先度・エスカレーションの有無を決めます。
+    """
+
+    def __init__(self, overrides=None, escalation_threshold=ESCALATION_THRESHOLD):
+        """
+        Parameters:
+            overrides (dict[str, str]): 呼び出し箇所 → 区分の上書き（未指定の場合はGRACHALLE_MODEL_ROUTES）
+            escalation_threshold (float): 大型モデルで呼び直す確信度の閾値
+        """
+        if overrides is None:
+            overrides = parse_route_overrides(MODEL_ROUTES)
+        self.routes = {
+            call_site: route.model_copy(update={"tier": overrides[call_site]}) if call_site in overrides else route
+            for call_site, route in DEFAULT_ROUTES.items()
+        }
+        self.escalation_threshold = escalation_threshold
+
+    def route(self, call_site: Optional[str]) -> Route:
+        """呼び出し箇所の振り分け先（未指定・未登録の場合は大型モデル・会話の優先度）"""
+        if call_site is None:
+            return Route()
+        route = self.routes.get(call_site)
+        if route is None:
+            raise ValueError(f"未知の呼び出し箇所です: {call_site}")
+        return route
+
+    def needs_escalation(self, route: Route, result) -> bool:
+        """
+        小型モデルの結果を大型モデルで呼び直すべきかどうか。
+        呼び出しが失敗した場合と、結果の確信度（confidence）が閾値を下回る場合に呼び直します。
+        """
+        if not route.escalate or route.tier != TIER_SMALL:
+            return False
+        if isinstance(result, LLMFailure):
+            return result.kind != "replay_miss"
+        return getattr(result, "confidence", 1.0) < self.escalation_threshold
@@ -0,0 +1,315 @@
+# ratelimit.py
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+
+import config  # noqa: F401
+
+# -----------------------------------------------------#
+# レート制限の設定                                     #
+# -----------------------------------------------------#
+# デプロイメントのクォータ（0の場合はその軸の制限を行わない）
+RATE_LIMIT_RPM = int(os.getenv("AZURE_OPENAI_RPM_LIMIT", "0"))
+RATE_LIMIT_TPM = int(os.getenv("AZURE_OPENAI_TPM_LIMIT", "0"))
+# 1リクエストあたりの出力トークンの見積もり（実際の使用量で後から精算する）
+MAX_OUTPUT_TOKENS_ESTIMATE = int(os.getenv("GRACHALLE_MAX_OUTPUT_TOKENS_ESTIMATE", "512"))
+# 待ち行列の上限（超えた場合、新規セッションの呼び出しは待たせずに「混雑中」として即座に断る）
+RATE_LIMIT_MAX_QUEUE = int(os.getenv("GRACHALLE_RATE_LIMIT_MAX_QUEUE", "100"))
+# バケットに溜められる量（何秒分のクォータまでバーストを許すか）
+RATE_LIMIT_BURST_SECONDS = float(os.getenv("GRACHALLE_RATE_LIMIT_BURST_SECONDS", "10"))
+
+# 優先度（値が小さいほど優先）
+PRIORITY_EVALUATION = 0  # 試験終了時の評価
+PRIORITY_CONVERSATION = 1  # 試験中の会話
+PRIORITY_HEARING = 2  # 新規セッションのヒアリング
+PRIORITY_NAMES = {
+    PRIORITY_EVALUATION: "evaluation",
+    PRIORITY_CONVERSATION: "conversation",
+    PRIORITY_HEARING: "hearing",
+}
+
+
+class TokenBucket:
+    """
+    一定の速度で補充されるトークンバケット。
+    容量を超える要求でも、バケットが満杯であれば残高を負にして通す（大きなリクエストが永久に待たないように）。
+    """
+
+    def __init__(self, per_minute, burst_seconds=RATE_LIMIT_BURST_SECONDS, clock=time.monotonic):
+        self.rate = per_minute / 60.0
+        self.capacity = max(self.rate * burst_seconds, 1.0)
+        self.available = self.capacity
+        self._updated = clock()
+
+    def refill(self, now):
+        self.available = min(self.capacity, self.available + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def time_until(self, amount):
+        """amountを消費できるようになるまでの秒数"""
+        shortage = min(amount, self.capacity) - self.available
+        return max(shortage / self.rate, 0.0)
+
+    def consume(self, amount):
+        self.available -= amount
+
+    def refund(self, amount):
+        self.available = min(self.capacity, self.available + amount)
+
+
+class _Waiter:
+    """待ち行列の1要素（優先度 → 到着順で並ぶ）"""
+
+    def __init__(self, priority, seq, tokens, notify):
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.notify = notify
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+# -----------------------------------------------------#
+# レートリミッター                                     #
+# -----------------------------------------------------#
+class RateLimiter:
+    """
+    リクエスト数（RPM）と推定トークン数（TPM）の2つのトークンバケットで呼び出しを平準化するリミッター。
+    待ち行列は優先度順に処理し、待ち行列が深い場合は新規セッションの呼び出しを待たせずに断ります。
+    """
+
+    def __init__(
+        self, rpm=RATE_LIMIT_RPM, tpm=RATE_LIMIT_TPM, max_queue_depth=RATE_LIMIT_MAX_QUEUE, clock=time.monotonic
+    ):
+        """
+        Parameters:
+            rpm (int): 1分あたりのリクエスト数の上限（0の場合は制限しない）
+            tpm (int): 1分あたりのトークン数の上限（0の場合は制限しない）
+            max_queue_depth (int): 待ち行列の上限
+            clock (callable): 補充量と一時停止の判定に使う時計（秒を返す関数。テストで差し替える）
+        """
+        self._clock = clock
+        self.requests = TokenBucket(rpm, clock=clock) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm, clock=clock) if tpm > 0 else None
+        self.max_queue_depth = max_queue_depth
+        self._waiters = []
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self.admitted = {priority: 0 for priority in PRIORITY_NAMES}
+        self.rejected = {priority: 0 for priority in PRIORITY_NAMES}
+
+    @property
+    def queue_depth(self):
+        """待ち行列の長さ"""
+        return len(self._waiters)
+
+    def _admission_limit(self, priority):
+        """
+        優先度ごとの受付上限。
+        試験中の会話と評価は断らず（呼び出しの期限まで待たせる）、新規セッションのヒアリングのみ即座に断る。
+        """
+        if priority >= PRIORITY_HEARING:
+            return self.max_queue_depth
+        return None
+
+    def _wait_time(self, tokens, now):
+        """ロック取得済みの状態で、tokensを消費できるまでの秒数を返す"""
+        wait = max(self._paused_until - now, 0.0)
+        for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+            if bucket is not None:
+                bucket.refill(now)
+                wait = max(wait, bucket.time_until(amount))
+        return wait
+
+    def _consume(self, waiter_tokens, priority):
+        if self.requests is not None:
+            self.requests.consume(1)
+        if self.tokens is not None:
+            self.tokens.consume(waiter_tokens)
+        self.admitted[priority] += 1
+
+    def _enqueue(self, priority, tokens, notify):
+        """
+        ロック取得済みの状態で受付を判定し、待ち行列に入れます。
+
+        Returns:
+            _Waiter: 待ち行列の要素（即時に通過した場合はNone、受付を断った場合はFalse）
+        """
+        now = self._clock()
+        if not self._waiters and self._wait_time(tokens, now) <= 0:
+            self._consume(tokens, priority)
+            return None
+        limit = self._admission_limit(priority)
+        if limit is not None and len(self._waiters) >= limit:
+            self.rejected[priority] += 1
+            return False
+        waiter = _Waiter(priority, next(self._seq), tokens, notify)
+        heapq.heappush(self._waiters, waiter)
+        return waiter
+
+    def _try_dequeue(self, waiter):
+        """
+        ロック取得済みの状態で、先頭のwaiterが通過できるか判定します。
+
+        Returns:
+            float: 通過した場合は0、先頭で待つ場合は待機秒数、先頭でない場合はNone
+        """
+        if not self._waiters or self._waiters[0] is not waiter:
+            return None
+        wait = self._wait_time(waiter.tokens, self._clock())
+        if wait > 0:
+            return wait
+        heapq.heappop(self._waiters)
+        self._consume(waiter.tokens, waiter.priority)
+        self._notify_head()
+        return 0.0
+
+    def _remove(self, waiter):
+        """キャンセル・タイムアウトした要素を待ち行列から取り除く"""
+        if waiter in self._waiters:
+            head_changed = self._waiters[0] is waiter
+            self._waiters.remove(waiter)
+            heapq.heapify(self._waiters)
+            if head_changed:
+                self._notify_head()
+
+    def _notify_head(self):
+        if self._waiters:
+            self._waiters[0].notify()
+
+    def try_acquire(self, tokens, priority=PRIORITY_CONVERSATION):
+        """
+        待たずに枠を確保できる場合のみ確保します（ヘッジリクエストなど、待つ価値のない呼び出し用）
+
+        Returns:
+            bool: 確保できた場合はTrue
+        """
+        with self._lock:
+            if self._waiters or self._wait_time(tokens, self._clock()) > 0:
+                return False
+            self._consume(tokens, priority)
+            return True
+
+    async def acquire(self, tokens, priority=PRIORITY_CONVERSATION):
+        """
+        リクエスト1件とtokens分の枠を非同期で確保します（期限はasyncio.wait_forなどで呼び出し元が制御）
+
+        Parameters:
+            tokens (int): 推定トークン数（プロンプト + 出力上限）
+            priority (int): 優先度
+
+        Returns:
+            bool: 確保できた場合はTrue、待ち行列が深く受付を断った場合はFalse
+        """
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        with self._lock:
+            waiter = self._enqueue(priority, tokens, lambda: loop.call_soon_threadsafe(event.set))
+        if waiter is None:
+            return True
+        if waiter is False:
+            return False
+        try:
+            while True:
+                with self._lock:
+                    event.clear()
+                    wait = self._try_dequeue(waiter)
+                if wait == 0:
+                    return True
+                try:
+                    # 先頭でなければ先頭になるまで、先頭であれば補充を待つ（割り込みがあれば起こされる）
+                    await asyncio.wait_for(event.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._lock:
+                self._remove(waiter)
+
+    def acquire_blocking(self, tokens, priority=PRIORITY_CONVERSATION, timeout=None):
+        """
+        acquireの同期版（同期APIの呼び出し用）
+
+        Parameters:
+            tokens (int): 推定トークン数
+            priority (int): 優先度
+            timeout (float): 待機の上限秒数
+
+        Returns:
+            bool: 確保できた場合はTrue、受付を断ったか期限を超えた場合はFalse
+        """
+        event = threading.Event()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            waiter = self._enqueue(priority, tokens, event.set)
+        if waiter is None:
+            return True
+        if waiter is False:
+            return False
+        try:
+            while True:
+                with self._lock:
+                    event.clear()
+                    wait = self._try_dequeue(waiter)
+                if wait == 0:
+                    return True
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    wait = remaining if wait is None else min(wait, remaining)
+                event.wait(wait)
+        finally:
+            with self._lock:
+                self._remove(waiter)
+
+    def reconcile(self, estimated_tokens, actual_tokens):
+        """実際のトークン使用量が判明したら、見積もりとの差をバケットに精算する"""
+        if self.tokens is None or actual_tokens is None:
+            return
+        with self._lock:
+            if actual_tokens < estimated_tokens:
+                self.tokens.refund(estimated_tokens - actual_tokens)
+            else:
+                self.tokens.consume(actual_tokens - estimated_tokens)
+
+    def pause(self, seconds):
+        """429応答を受けた場合に、Retry-Afterの間は新たな呼び出しを通さない"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, self._clock() + seconds)
+
+    def stats(self):
+        """待ち行列の長さと優先度別の受付数・拒否数を返す"""
+        with self._lock:
+            waiting = {name: 0 for name in PRIORITY_NAMES.values()}
+            for waiter in self._waiters:
+                waiting[PRIORITY_NAMES.get(waiter.priority, str(waiter.priority))] += 1
+            return {
+                "queue_depth": len(self._waiters),
+                "waiting": waiting,
+                "admitted": {PRIORITY_NAMES[p]: count for p, count in self.admitted.items()},
+                "rejected": {PRIORITY_NAMES[p]: count for p, count in self.rejected.items()},
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(key):
+    """
+    デプロイメント（エンドポイントとモデル名の組）ごとのプロセス共有リミッターを取得する
+    （RPM・TPMのいずれも設定されていない場合はNone）
+    """
+    if RATE_LIMIT_RPM <= 0 and RATE_LIMIT_TPM <= 0:
+        return None
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = RateLimiter()
+            _limiters[key] = limiter
+    return limiter
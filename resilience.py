@@ -0,0 +1,242 @@
+# resilience.py
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+import config  # noqa: F401
+
+# -----------------------------------------------------#
+# 呼び出しポリシーの設定                               #
+# -----------------------------------------------------#
+LLM_MAX_ATTEMPTS = int(os.getenv("GRACHALLE_LLM_MAX_ATTEMPTS", "3"))
+LLM_DEADLINE = float(os.getenv("GRACHALLE_LLM_DEADLINE", "45"))  # 1回の呼び出し（再試行込み）の期限（秒）
+LLM_ATTEMPT_TIMEOUT = float(os.getenv("GRACHALLE_LLM_ATTEMPT_TIMEOUT", "20"))  # 1試行あたりのタイムアウト（秒）
+LLM_BACKOFF_BASE = float(os.getenv("GRACHALLE_LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("GRACHALLE_LLM_BACKOFF_MAX", "8"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("GRACHALLE_BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("GRACHALLE_BREAKER_RESET_TIMEOUT", "30"))
+
+
+# -----------------------------------------------------#
+# 失敗結果                                             #
+# -----------------------------------------------------#
+class LLMFailure(BaseModel):
+    """
+    LLM呼び出しの失敗を表す結果モデル。
+    以前の空文字列"{}"の代わりに返し、呼び出し元が失敗の種類を判別できるようにします。
+    """
+
+    kind: str = Field(
+        description="失敗の種類（timeout, rate_limited, server_error, connection, client_error, "
+        "parse_error, circuit_open, replay_miss, empty_stream）"
+    )
+    message: str = Field(default="", description="失敗の詳細")
+    attempts: int = Field(default=0, description="実施した試行回数")
+    retry_after: Optional[float] = Field(default=None, description="サーバーが指定した再試行までの秒数")
+    retryable: bool = Field(default=False, description="再試行で回復する可能性があるか")
+
+
+class LLMServiceError(Exception):
+    """LLM呼び出しの失敗結果を例外として扱うためのラッパー"""
+
+    def __init__(self, failure: LLMFailure):
+        super().__init__(f"{failure.kind}: {failure.message}")
+        self.failure = failure
+
+
+def unwrap_llm_result(result):
+    """
+    LLM呼び出しの結果が失敗であれば例外を送出し、成功であればそのまま返します。
+    呼び出し元の既存のフォールバック処理（except節）に失敗を流すために使います。
+    """
+    if isinstance(result, LLMFailure):
+        raise LLMServiceError(result)
+    return result
+
+
+def _retry_after_seconds(headers):
+    """Retry-After（またはretry-after-ms）ヘッダーから待機秒数を取り出す"""
+    if headers is None:
+        return None
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is not None:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+
+def classify_exception(error, attempts):
+    """
+    例外をLLMFailureに分類します。
+
+    Parameters:
+        error (Exception): 発生した例外
+        attempts (int): その時点までの試行回数
+
+    Returns:
+        LLMFailure: 失敗結果
+    """
+    import openai
+
+    message = str(error) or type(error).__name__
+    if isinstance(error, (asyncio.TimeoutError, openai.APITimeoutError)):
+        return LLMFailure(kind="timeout", message=message, attempts=attempts, retryable=True)
+    if isinstance(error, openai.APIConnectionError):
+        return LLMFailure(kind="connection", message=message, attempts=attempts, retryable=True)
+    if isinstance(error, openai.APIStatusError):
+        retry_after = _retry_after_seconds(error.response.headers)
+        if error.status_code == 429:
+            return LLMFailure(
+                kind="rate_limited", message=message, attempts=attempts, retry_after=retry_after, retryable=True
+            )
+        if error.status_code >= 500 or error.status_code in (408, 409):
+            return LLMFailure(
+                kind="server_error", message=message, attempts=attempts, retry_after=retry_after, retryable=True
+            )
+        return LLMFailure(kind="client_error", message=message, attempts=attempts)
+    return LLMFailure(kind="parse_error", message=message, attempts=attempts)
+
+
+# -----------------------------------------------------#
+# 再試行ポリシー                                       #
+# -----------------------------------------------------#
+class RetryPolicy:
+    """
+    呼び出し全体の期限・1試行あたりのタイムアウト・ジッター付き指数バックオフを定めるポリシー。
+    """
+
+    def __init__(
+        self,
+        max_attempts=LLM_MAX_ATTEMPTS,
+        deadline=LLM_DEADLINE,
+        attempt_timeout=LLM_ATTEMPT_TIMEOUT,
+        backoff_base=LLM_BACKOFF_BASE,
+        backoff_max=LLM_BACKOFF_MAX,
+    ):
+        """
+        Parameters:
+            max_attempts (int): 最大試行回数
+            deadline (float): 再試行を含めた呼び出し全体の期限（秒）
+            attempt_timeout (float): 1試行あたりのタイムアウト（秒）
+            backoff_base (float): バックオフの基準秒数
+            backoff_max (float): バックオフの上限秒数
+        """
+        self.max_attempts = max_attempts
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def backoff(self, attempt, retry_after=None):
+        """
+        次の試行までの待機秒数を返します。
+        Retry-Afterが指定されていればそれを優先し、なければフルジッター付きの指数バックオフとします。
+        """
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max * 4)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1))))
+
+
+# -----------------------------------------------------#
+# サーキットブレーカー                                 #
+# -----------------------------------------------------#
+class CircuitBreaker:
+    """
+    デプロイメント単位のサーキットブレーカー。
+    連続失敗が閾値に達すると一定時間呼び出しを遮断し、その後は少数の試行（半開状態）で回復を確認します。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        """
+        Parameters:
+            failure_threshold (int): 遮断するまでの連続失敗回数
+            reset_timeout (float): 遮断してから半開状態で試行を許可するまでの秒数
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """呼び出しを許可するかどうかを返します（半開状態では同時に1件のみ許可）"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def release(self):
+        """allowで許可された呼び出しを送らずに取りやめた場合に、半開状態の試行枠を返します"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def is_open(self):
+        """遮断中で、まだ半開状態に移れないかどうか（状態は変更しない）"""
+        with self._lock:
+            return self.state == self.OPEN and time.monotonic() - self._opened_at < self.reset_timeout
+
+    def record_success(self):
+        """成功を記録し、遮断状態を解除します"""
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        """失敗を記録し、閾値に達するか半開状態での試行が失敗した場合は遮断します"""
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def retry_after(self):
+        """遮断が解除されるまでの残り秒数"""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(self.reset_timeout - (time.monotonic() - self._opened_at), 0.0)
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(key):
+    """
+    デプロイメント（エンドポイントとモデル名の組）ごとのプロセス共有サーキットブレーカーを取得する
+    """
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker()
+            _breakers[key] = breaker
+    return breaker
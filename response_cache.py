@@ -0,0 +1,264 @@
+# response_cache.py
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import config  # noqa: F401
+
+# common.pyから読み込まれるため、ロガーはこのモジュールで取得する
+logger = logging.getLogger(__name__)
+
+# -----------------------------------------------------#
+# 応答キャッシュの設定                                 #
+# -----------------------------------------------------#
+RESPONSE_CACHE_ENABLED = os.getenv("GRACHALLE_RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+# 応答の有効期限（秒）
+RESPONSE_CACHE_TTL = float(os.getenv("GRACHALLE_RESPONSE_CACHE_TTL", "3600"))
+# メモリ上に保持する応答の合計サイズの上限（バイト）
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("GRACHALLE_RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# SQLiteに保存する場合のファイルパス（未指定の場合はメモリのみ）と、保存する合計サイズの上限（バイト）
+RESPONSE_CACHE_PATH = os.getenv("GRACHALLE_RESPONSE_CACHE_PATH")
+RESPONSE_CACHE_DB_MAX_BYTES = int(os.getenv("GRACHALLE_RESPONSE_CACHE_DB_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+# -----------------------------------------------------#
+# SQLiteの保存先（2次キャッシュ）                      #
+# -----------------------------------------------------#
+class SQLiteResponseStore:
+    """
+    応答をSQLite（WALモード）に保存する2次キャッシュ。プロセスの再起動後や、同じファイルを共有する別のワーカーでも使えます。
+    書き込みは専用スレッドで行い、呼び出し元を待たせません。
+    """
+
+    # この回数の書き込みごとに期限切れの削除と合計サイズの確認を行う
+    PRUNE_EVERY = 200
+
+    def __init__(self, path, max_bytes=RESPONSE_CACHE_DB_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="grachalle-response-cache")
+        self._writes = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, expires_at REAL NOT NULL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS responses_created_at ON responses (created_at)")
+        connection.commit()
+
+    def _connection(self):
+        """スレッドごとの接続を取得する"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        """有効期限内の応答を返す（なければNone）"""
+        row = (
+            self._connection()
+            .execute("SELECT value FROM responses WHERE key = ? AND expires_at > ?", (key, time.time()))
+            .fetchone()
+        )
+        return row[0] if row is not None else None
+
+    def put(self, key, value, ttl):
+        """応答の保存を書き込み用スレッドに依頼する"""
+        self._writer.submit(self._write, key, value, ttl)
+
+    def _write(self, key, value, ttl):
+        now = time.time()
+        try:
+            with self._connection() as connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, size, created_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, len(value.encode("utf-8")), now, now + ttl),
+                )
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self._prune(now)
+        except sqlite3.Error as e:
+            logger.warning("応答キャッシュの保存に失敗しました: %s", e)
+
+    def _prune(self, now):
+        """期限切れの応答を削除し、合計サイズが上限を超えていれば古いものから削除する"""
+        with self._connection() as connection:
+            connection.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+            total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                # 上限の9割まで減らし、毎回の削除にならないようにする
+                excess = total - self.max_bytes * 0.9
+                connection.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM ("
+                    "SELECT key, size, SUM(size) OVER (ORDER BY created_at) AS running FROM responses"
+                    ") WHERE running - size < ?)",
+                    (excess,),
+                )
+
+    def close(self):
+        self._writer.shutdown(wait=True)
+
+
+# -----------------------------------------------------#
+# 応答キャッシュ                                       #
+# -----------------------------------------------------#
+class ResponseCache:
+    """
+    リクエストのハッシュ（common.request_fingerprint）をキーとして、構造化出力の応答（JSON文字列）を保持するキャッシュ。
+    メモリ上はLRUとTTLで破棄し、合計サイズをバイト数で制限します。SQLiteの2次キャッシュを併用できます。
+    同じリクエストが同時に届いた場合は、先着の1件のみが呼び出しを行い、残りはその結果を待ちます（single-flight）。
+    """
+
+    def __init__(self, ttl=RESPONSE_CACHE_TTL, max_bytes=RESPONSE_CACHE_MAX_BYTES, store=None):
+        """
+        Parameters:
+            ttl (float): 応答の有効期限（秒）
+            max_bytes (int): メモリ上に保持する応答の合計サイズの上限（バイト）
+            store (SQLiteResponseStore): 2次キャッシュ（Noneの場合はメモリのみ）
+        """
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.store = store
+        self._entries = OrderedDict()  # key -> (有効期限, 応答のJSON文字列, サイズ)
+        self._bytes = 0
+        self._inflight = {}  # key -> Future
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def _size(key, value):
+        return len(key) + len(value.encode("utf-8"))
+
+    def _remove(self, key):
+        """ロック取得済みの状態でエントリを削除する"""
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def _lookup(self, key):
+        """ロック取得済みの状態でメモリ上の応答を返す（期限切れ・未登録の場合はNone）"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def get_local(self, key):
+        """メモリ上の応答を返す（期限切れ・未登録の場合はNone）"""
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                self.hits += 1
+            return value
+
+    def get(self, key):
+        """メモリ、2次キャッシュの順に応答を探す（2次キャッシュで見つかった場合はメモリにも載せる）"""
+        value = self.get_local(key)
+        if value is None and self.store is not None:
+            value = self.store.get(key)
+            if value is not None:
+                self._put_local(key, value)
+                with self._lock:
+                    self.hits += 1
+        return value
+
+    def _put_local(self, key, value):
+        size = self._size(key, value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def put(self, key, value):
+        """応答を保存する（2次キャッシュへの書き込みは非同期）"""
+        self._put_local(key, value)
+        if self.store is not None:
+            self.store.put(key, value, self.ttl)
+
+    def join(self, key):
+        """
+        同じキーの処理中の呼び出しに合流する
+
+        Returns:
+            tuple[Future, bool]: 結果を受け取るFutureと、自身が呼び出しを行うべきかどうか（先着の場合True）
+                Futureの結果は、成功時は応答のJSON文字列、失敗時はLLMFailure、先着の呼び出しが中断された場合はNone
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            # 参照してから合流するまでの間に、先着の呼び出しが完了して保存された場合
+            value = self._lookup(key)
+            if value is not None:
+                self.hits += 1
+                future = Future()
+                future.set_result(value)
+                return future, False
+            future = self._inflight[key] = Future()
+            self.misses += 1
+            return future, True
+
+    def finish(self, key, future, result, value=None):
+        """
+        先着の呼び出しの完了を通知する
+
+        Parameters:
+            key (str): キー
+            future (Future): joinで受け取ったFuture
+            result (object): 待っている呼び出しに渡す結果（呼び出しが中断された場合はNone）
+            value (str): キャッシュに保存する応答のJSON文字列（成功時のみ）
+        """
+        if value is not None:
+            self.put(key, value)
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+            }
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    プロセス共有の応答キャッシュを取得する（GRACHALLE_RESPONSE_CACHE_ENABLEDがfalseの場合はNone）
+    """
+    global _response_cache
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            store = SQLiteResponseStore(RESPONSE_CACHE_PATH) if RESPONSE_CACHE_PATH else None
+            _response_cache = ResponseCache(store=store)
+    return _response_cache
@@ -0,0 +1,137 @@
+# runtime.py
+import asyncio
+import atexit
+import threading
+
+from common import logger
+
+
+# -----------------------------------------------------#
+# 常駐イベントループ                                   #
+# -----------------------------------------------------#
+class BackgroundEventLoop:
+    """
+    プロセス全体で共有する常駐イベントループ。
+    専用スレッドでループを回し続け、同期コードからスレッドセーフにコルーチンを投入できます。
+    ループが会話ターンをまたいで生存するため、非同期クライアントのコネクションプールが再利用されます。
+    """
+
+    def __init__(self, name="grachalle-event-loop"):
+        self._name = name
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        """
+        イベントループとスレッドを起動します（遅延初期化）
+        """
+        with self._lock:
+            if self._loop is not None and self._thread.is_alive():
+                return self._loop
+            loop = asyncio.new_event_loop()
+            started = threading.Event()
+
+            def _run():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(started.set)
+                loop.run_forever()
+
+            thread = threading.Thread(target=_run, name=self._name, daemon=True)
+            thread.start()
+            started.wait()
+            self._loop = loop
+            self._thread = thread
+            logger.info("常駐イベントループを起動しました")
+            return loop
+
+    @property
+    def loop(self):
+        """常駐イベントループを取得する"""
+        return self._ensure_started()
+
+    def run(self, coro, timeout=None):
+        """
+        コルーチンを常駐イベントループ上で実行し、結果を同期的に返します。
+
+        Parameters:
+            coro (coroutine): 実行するコルーチン
+            timeout (float): 待機する最大秒数（Noneの場合は無制限）
+
+        Returns:
+            object: コルーチンの戻り値
+        """
+        loop = self._ensure_started()
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("常駐イベントループのスレッドから同期ブリッジを呼び出すことはできません")
+        future = asyncio.run_coroutine_threadsafe(coro, loop)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def iterate(self, agen, timeout=None):
+        """
+        非同期ジェネレータを常駐イベントループ上で進め、同期ジェネレータとして要素を返します。
+        Streamlitの`st.write_stream`などから逐次出力を受け取るためのブリッジです。
+
+        Parameters:
+            agen (async_generator): 実行する非同期ジェネレータ
+            timeout (float): 各要素を待機する最大秒数（Noneの場合は無制限）
+
+        Yields:
+            object: 非同期ジェネレータが生成した要素
+        """
+
+        async def _next():
+            return await agen.__anext__()
+
+        try:
+            while True:
+                try:
+                    yield self.run(_next(), timeout)
+                except StopAsyncIteration:
+                    return
+        finally:
+            # 途中で打ち切られた場合もジェネレータの後処理をループ上で実行する
+            self.run(agen.aclose(), timeout)
+
+    def stop(self):
+        """
+        イベントループを停止し、スレッドの終了を待ちます
+        """
+        with self._lock:
+            if self._loop is None:
+                return
+            loop, thread = self._loop, self._thread
+            self._loop = None
+            self._thread = None
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=5)
+        if not loop.is_running():
+            loop.close()
+
+
+_default_loop = BackgroundEventLoop()
+atexit.register(_default_loop.stop)
+
+
+def get_background_loop():
+    """プロセス共有の常駐イベントループを取得する"""
+    return _default_loop
+
+
+def run_sync(coro, timeout=None):
+    """
+    コルーチンをプロセス共有の常駐イベントループで実行し、結果を返します。
+    """
+    return _default_loop.run(coro, timeout)
+
+
+def iterate_sync(agen, timeout=None):
+    """
+    非同期ジェネレータをプロセス共有の常駐イベントループで進め、同期ジェネレータとして返します。
+    """
+    return _default_loop.iterate(agen, timeout)
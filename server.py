@@ -0,0 +1,557 @@
+# server.py
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from urllib.parse import parse_qs
+
+import config  # noqa: F401
+from common import WARM_UP_ENABLED, get_openai_service, logger
+from job_queue import JOB_INPROCESS_CONCURRENCY, JobWorker, get_job_queue
+from main import JOB_HANDLERS, GraChalleInterface, warm_up_async
+from session_store import get_session_store
+from telemetry import REGISTRY
+from tracing import PROFILE_ON_REQUEST
+
+# -----------------------------------------------------#
+# サーバー設定                                         #
+# -----------------------------------------------------#
+MAX_SESSIONS = int(os.getenv("GRACHALLE_MAX_SESSIONS", "1000"))
+SESSION_IDLE_TIMEOUT = float(os.getenv("GRACHALLE_SESSION_IDLE_TIMEOUT", "1800"))  # 秒
+SESSION_SWEEP_INTERVAL = float(os.getenv("GRACHALLE_SESSION_SWEEP_INTERVAL", "60"))  # 秒
+MAX_BODY_BYTES = 64 * 1024
+
+
+class HTTPError(Exception):
+    """ステータスコード付きでJSONのエラー応答を返すための例外"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+# -----------------------------------------------------#
+# セッション管理                                       #
+# -----------------------------------------------------#
+class Session:
+    """1人の受験者の試験状態と、ターンを直列化するためのロック"""
+
+    def __init__(self, interface: GraChalleInterface):
+        self.interface = interface
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+    @property
+    def session_id(self):
+        return self.interface.session_id
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    def describe(self):
+        """セッションの状態をJSONで返せる形にする"""
+        interface = self.interface
+        return {
+            "session_id": interface.session_id,
+            "state": interface.state_label,
+            "language": interface.LANGAGE,
+            "level": interface.LEVEL,
+            "turns": interface.conversation_turns,
+            "max_turns": interface.MAX_TURNS,
+            "cost_usd": interface.cost_ledger.total_cost,
+            "evaluation_job_id": interface.evaluation_job_id,
+        }
+
+
+class SessionManager:
+    """
+    1つのイベントループ上で多数の試験セッションを保持するマネージャー。
+    セッションの状態はターンごとにセッションストアへ保存し、ターンの開始時にストアから読み込むため、
+    同じストアを共有する別のワーカーでも続きのターンを処理できます。
+    メモリ上には直近のセッションのみを保持し（ストアの版数と一致すれば再利用）、
+    一定時間操作のないセッションや上限を超えた古いセッションはメモリから外します。
+    """
+
+    def __init__(
+        self,
+        openai_service=None,
+        max_sessions=MAX_SESSIONS,
+        idle_timeout=SESSION_IDLE_TIMEOUT,
+        sweep_interval=SESSION_SWEEP_INTERVAL,
+        store=None,
+    ):
+        """
+        Parameters:
+            openai_service (OpenAIService): 全セッションで共有するサービス（未指定の場合はプロセス共有のもの）
+            max_sessions (int): メモリ上に保持するセッション数の上限
+            idle_timeout (float): 操作のないセッションを破棄するまでの秒数
+            sweep_interval (float): 破棄の確認間隔（秒）
+            store (SessionStore): セッションストア（未指定の場合はプロセス共有のもの）
+        """
+        self.openai_service = openai_service
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.sweep_interval = sweep_interval
+        self.store = store or get_session_store()
+        self.sessions = {}
+        self._sweeper = None
+
+    def _service(self):
+        if self.openai_service is None:
+            self.openai_service = get_openai_service()
+        return self.openai_service
+
+    def _admit(self, session):
+        """セッションをメモリ上に保持する（上限に達していて外せるセッションもない場合はHTTPError）"""
+        if len(self.sessions) >= self.max_sessions and not self._evict_oldest():
+            raise HTTPError(503, "同時に受験できる人数の上限に達しています")
+        self.sessions[session.session_id] = session
+
+    async def create(self, max_turns=3):
+        """新しいセッションを作成してストアに保存する"""
+        session = Session(GraChalleInterface(self._service(), max_turns=max_turns, session_id=uuid.uuid4().hex))
+        self._admit(session)
+        await asyncio.wrap_future(self.store.save(session.interface.snapshot()))
+        logger.info("セッションを作成しました: %s (%s件)", session.session_id, len(self.sessions))
+        return session
+
+    async def get(self, session_id):
+        """
+        ストアから最新の状態を読み込み（1回）、セッションを返す。
+        メモリ上のセッションが同じ版数であればそのまま使い（先行生成中の第一声などを引き継ぐ）、
+        別のワーカーで進んでいればスナップショットから復元する。
+        """
+        snapshot = await asyncio.to_thread(self.store.load, session_id)
+        if snapshot is None:
+            self._drop(session_id)
+            raise HTTPError(404, f"セッションが見つかりません: {session_id}")
+        session = self.sessions.get(session_id)
+        if session is None or (session.interface.version != snapshot.version and not session.lock.locked()):
+            if session is not None:
+                logger.info("別のワーカーで更新されたセッションを復元します: %s", session_id)
+                self._drop(session_id)
+            session = Session(GraChalleInterface.from_snapshot(snapshot, self._service()))
+            self._admit(session)
+        session.touch()
+        return session
+
+    async def commit(self, session):
+        """ターンを終えたセッションの状態をストアに保存し（1回）、コミットされるまで待つ"""
+        interface = session.interface
+        interface.version += 1
+        await asyncio.wrap_future(self.store.save(interface.snapshot()))
+
+    def _drop(self, session_id):
+        """セッションをメモリ上から外す（ストアの状態は残す）"""
+        session = self.sessions.pop(session_id, None)
+        if session is not None:
+            session.interface.reset()
+        return session is not None
+
+    async def close(self, session_id):
+        """セッションを破棄する（先行生成・ターン別評価などの実行中の処理もキャンセルし、ストアからも削除）"""
+        existed = await asyncio.to_thread(self.store.delete, session_id)
+        return self._drop(session_id) or existed
+
+    def _evict_oldest(self):
+        """処理中でないセッションのうち、最後の操作が最も古いものを破棄する"""
+        idle = [session for session in self.sessions.values() if not session.lock.locked()]
+        if not idle:
+            return False
+        oldest = min(idle, key=lambda session: session.last_used)
+        logger.info("セッション数の上限のためメモリから外します: %s", oldest.session_id)
+        return self._drop(oldest.session_id)
+
+    async def sweep(self):
+        """一定時間操作のないセッションをメモリから外し、ストアからも削除する"""
+        now = time.monotonic()
+        expired = [
+            session.session_id
+            for session in self.sessions.values()
+            if not session.lock.locked() and now - session.last_used >= self.idle_timeout
+        ]
+        for session_id in expired:
+            self._drop(session_id)
+        # ストアの削除は最終更新時刻で判定するため、他のワーカーで使用中のセッションは残る
+        purged = await asyncio.to_thread(self.store.purge_idle, self.idle_timeout)
+        if expired or purged:
+            logger.info(
+                "操作のないセッションを破棄しました: メモリ%s件・ストア%s件（メモリ上の残り%s件）",
+                len(expired),
+                purged,
+                len(self.sessions),
+            )
+        return len(expired)
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            await self.sweep()
+
+    def start(self):
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_forever())
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        for session_id in list(self.sessions):
+            self._drop(session_id)
+        # セッションはストアに残し、未反映の書き込みのみ反映する
+        await asyncio.to_thread(self.store.flush)
+
+
+# -----------------------------------------------------#
+# ASGIアプリケーション                                 #
+# -----------------------------------------------------#
+async def _read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise HTTPError(400, "リクエストの受信中に切断されました")
+        body += message.get("body", b"")
+        if len(body) > MAX_BODY_BYTES:
+            raise HTTPError(413, "リクエストが大きすぎます")
+        if not message.get("more_body"):
+            return body
+
+
+async def _read_json(receive):
+    """リクエストボディをJSONオブジェクトとして読み込む（空の場合は空のdict）"""
+    body = await _read_body(receive)
+    try:
+        payload = json.loads(body or b"{}")
+    except ValueError:
+        raise HTTPError(400, "JSONとして解釈できません")
+    if not isinstance(payload, dict):
+        raise HTTPError(400, "JSONオブジェクトを指定してください")
+    return payload
+
+
+async def _send_json(send, status, payload):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json; charset=utf-8"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+def _sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+class GraChalleApp:
+    """
+    試験の状態機械（GraChalleInterface.run_stream_async）をHTTPで公開するASGIアプリケーション。
+
+    POST   /sessions                    セッションを作成
+    GET    /sessions/{id}               セッションの状態
+    POST   /sessions/{id}/messages      受験者の入力を処理（Accept: text/event-streamまたは?stream=trueでSSE）
+    DELETE /sessions/{id}               セッションを破棄
+    GET    /metrics                     Prometheus形式のメトリクス
+    GET    /healthz                     死活監視
+    """
+
+    def __init__(self, sessions: SessionManager = None):
+        self.sessions = sessions or SessionManager()
+        self._job_worker = None
+        self._job_worker_task = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        try:
+            await self._route(scope, receive, send)
+        except HTTPError as e:
+            await _send_json(send, e.status, {"error": e.message})
+        except Exception as e:
+            logger.exception("リクエストの処理中にエラーが発生しました: %s", e)
+            await _send_json(send, 500, {"error": "内部エラーが発生しました"})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self.sessions.start()
+                if WARM_UP_ENABLED:
+                    # 接続を開き終えてから受け付けを始める（レディネスの判定もウォームアップ後になる）
+                    await warm_up_async(self.sessions._service())
+                self._start_job_worker()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self._job_worker is not None:
+                    # 処理中の評価ジョブは待機中に戻し、別のワーカーに引き継ぐ
+                    self._job_worker.stop()
+                    await self._job_worker_task
+                await self.sessions.stop()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def _start_job_worker(self):
+        """GRACHALLE_JOB_INPROCESS_CONCURRENCYが1以上の場合、評価ジョブのワーカーをこのプロセス内で動かす"""
+        queue = get_job_queue()
+        if queue is None or JOB_INPROCESS_CONCURRENCY <= 0:
+            return
+        self._job_worker = JobWorker(queue, JOB_HANDLERS, concurrency=JOB_INPROCESS_CONCURRENCY)
+        self._job_worker_task = asyncio.create_task(self._job_worker.run())
+
+    async def _route(self, scope, receive, send):
+        method = scope["method"]
+        parts = [part for part in scope["path"].split("/") if part]
+
+        if parts == ["healthz"] and method == "GET":
+            await _send_json(send, 200, {"status": "ok", "sessions": len(self.sessions.sessions)})
+            return
+        if parts == ["metrics"] and method == "GET":
+            body = REGISTRY.render().encode("utf-8")
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 200,
+                    "headers": [(b"content-type", b"text/plain; version=0.0.4; charset=utf-8")],
+                }
+            )
+            await send({"type": "http.response.body", "body": body})
+            return
+        if parts == ["sessions"] and method == "POST":
+            payload = await _read_json(receive)
+            max_turns = payload.get("max_turns", 3)
+            # boolはintのサブクラスのため明示的に除く
+            if not isinstance(max_turns, int) or isinstance(max_turns, bool) or max_turns <= 0:
+                raise HTTPError(400, "max_turnsには正の整数を指定してください")
+            session = await self.sessions.create(max_turns=max_turns)
+            await _send_json(send, 201, session.describe())
+            return
+        if len(parts) == 2 and parts[0] == "sessions":
+            if method == "GET":
+                await _send_json(send, 200, (await self.sessions.get(parts[1])).describe())
+                return
+            if method == "DELETE":
+                if not await self.sessions.close(parts[1]):
+                    raise HTTPError(404, f"セッションが見つかりません: {parts[1]}")
+                await _send_json(send, 200, {"session_id": parts[1], "closed": True})
+                return
+        if len(parts) == 3 and parts[0] == "sessions" and parts[2] == "messages" and method == "POST":
+            await self._post_message(scope, receive, send, parts[1])
+            return
+        if len(parts) == 3 and parts[0] == "sessions" and parts[2] == "evaluation" and method == "GET":
+            await self._get_evaluation(scope, receive, send, parts[1])
+            return
+        raise HTTPError(404, f"見つかりません: {method} {scope['path']}")
+
+    @staticmethod
+    def _wants_stream(scope):
+        query = parse_qs(scope.get("query_string", b"").decode())
+        if query.get("stream", ["false"])[0].lower() == "true":
+            return True
+        headers = dict(scope.get("headers") or [])
+        return b"text/event-stream" in headers.get(b"accept", b"")
+
+    @staticmethod
+    def _wants_profile(scope):
+        """ターンのプロファイルを指定されたかどうか（GRACHALLE_PROFILE_ON_REQUESTがtrueの場合のみ受け付ける）"""
+        if not PROFILE_ON_REQUEST:
+            return False
+        query = parse_qs(scope.get("query_string", b"").decode())
+        return query.get("profile", ["false"])[0].lower() == "true"
+
+    async def _post_message(self, scope, receive, send, session_id):
+        """
+        受験者の入力を1ターン分処理する（同じセッションのターンは同時に1つまで）。
+        ストアへのアクセスはターンの開始時の読み込み1回と終了時の書き込み1回のみ。
+        `?profile=true`を指定した場合は、このターンをプロファイルしてスタックファイルを出力する。
+        """
+        payload = await _read_json(receive)
+        message = payload.get("message")
+        if not isinstance(message, str) or not message.strip():
+            raise HTTPError(400, "messageを指定してください")
+        resident = self.sessions.sessions.get(session_id)
+        if resident is not None and resident.lock.locked():
+            raise HTTPError(409, "前の入力を処理中です")
+        session = await self.sessions.get(session_id)
+        if session.lock.locked():
+            raise HTTPError(409, "前の入力を処理中です")
+
+        async with session.lock:
+            version = session.interface.version
+            session.interface.profile = self._wants_profile(scope)
+            try:
+                if not self._wants_stream(scope):
+                    reply = await session.interface.run_async(message)
+                    # 応答を返す前に保存を済ませ、次のターンをどのワーカーが受けても続きから処理できるようにする
+                    await self.sessions.commit(session)
+                    await _send_json(send, 200, {"reply": reply, **session.describe()})
+                    return
+                await self._stream_reply(session, message, receive, send)
+            finally:
+                # 途中で切断・失敗した場合も、メモリ上の状態とストアを一致させておく
+                if session.interface.version == version:
+                    await asyncio.shield(self.sessions.commit(session))
+                session.touch()
+
+    async def _stream_reply(self, session, message, receive, send):
+        """応答をSSEで逐次返す（クライアントが切断した場合は生成を打ち切る）"""
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream; charset=utf-8"),
+                    (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no"),
+                ],
+            }
+        )
+
+        async def _pump():
+            async for delta in session.interface.run_stream_async(message):
+                await send(
+                    {"type": "http.response.body", "body": _sse_event("delta", {"text": delta}), "more_body": True}
+                )
+
+        async def _wait_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        pump = asyncio.create_task(_pump())
+        disconnect = asyncio.create_task(_wait_disconnect())
+        try:
+            await asyncio.wait({pump, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            if not pump.done():
+                logger.info("クライアントが切断したため応答の生成を打ち切ります: %s", session.session_id)
+                pump.cancel()
+                return
+            error = pump.exception()
+            if error is not None:
+                logger.error("応答の生成中にエラーが発生しました: %s", error)
+                final = _sse_event("error", {"error": "応答を生成できませんでした"})
+            else:
+                await self.sessions.commit(session)
+                final = _sse_event("done", session.describe())
+            await send({"type": "http.response.body", "body": final, "more_body": False})
+        finally:
+            for task in (pump, disconnect):
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(pump, disconnect, return_exceptions=True)
+
+    async def _apply_evaluation(self, session):
+        """
+        評価ジョブの状態を確認し、評価レポートを取り込んだ場合はストアに保存する
+        （ターンの処理中であれば、そのターンの保存に任せる）
+        """
+        interface = session.interface
+        if session.lock.locked():
+            return await asyncio.to_thread(interface.job_queue.get, interface.evaluation_job_id)
+        async with session.lock:
+            applied = interface.evaluation_report is not None
+            job = await interface.poll_evaluation_async()
+            if not applied and interface.evaluation_report is not None:
+                await self.sessions.commit(session)
+            return job
+
+    @staticmethod
+    def _describe_job(session, job):
+        return {
+            "job_id": job.job_id,
+            "status": job.status,
+            "attempts": job.attempts,
+            "report": session.interface.evaluation_report,
+        }
+
+    async def _get_evaluation(self, scope, receive, send, session_id):
+        """
+        試験終了時に登録した評価ジョブの状態を返す（SSEの場合は状態が変わるたびに送り、完了時に評価レポートを送る）
+        """
+        session = await self.sessions.get(session_id)
+        interface = session.interface
+        if interface.job_queue is None or interface.evaluation_job_id is None:
+            raise HTTPError(404, f"評価は登録されていません: {session_id}")
+        job = await self._apply_evaluation(session)
+        if job is None:
+            raise HTTPError(404, f"評価ジョブが見つかりません: {interface.evaluation_job_id}")
+        if not self._wants_stream(scope) or job.done:
+            await _send_json(send, 200, self._describe_job(session, job))
+            return
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream; charset=utf-8"),
+                    (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no"),
+                ],
+            }
+        )
+
+        async def _pump():
+            async for current in interface.job_queue.watch(job.job_id):
+                if current is None or current.done:
+                    return
+                event = _sse_event("status", self._describe_job(session, current))
+                await send({"type": "http.response.body", "body": event, "more_body": True})
+
+        async def _wait_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        pump = asyncio.create_task(_pump())
+        disconnect = asyncio.create_task(_wait_disconnect())
+        try:
+            await asyncio.wait({pump, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            if not pump.done():
+                return
+            final_job = await self._apply_evaluation(session)
+            if final_job is None:
+                final = _sse_event("error", {"error": "評価ジョブが見つかりません"})
+            else:
+                final = _sse_event("done", self._describe_job(session, final_job))
+            await send({"type": "http.response.body", "body": final, "more_body": False})
+        finally:
+            for task in (pump, disconnect):
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(pump, disconnect, return_exceptions=True)
+
+
+app = GraChalleApp()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="試験セッションをHTTP（SSE）で提供するAPIサーバーを起動します")
+    parser.add_argument("--host", default="0.0.0.0", help="待ち受けるアドレス")
+    parser.add_argument("--port", type=int, default=8000, help="待ち受けるポート")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="ワーカープロセス数（2以上の場合はGRACHALLE_SESSION_STORE_PATHでストアを共有すること）",
+    )
+    args = parser.parse_args()
+
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("uvicornがインストールされていません: pip install uvicorn")
+
+    if args.workers > 1 and not os.getenv("GRACHALLE_SESSION_STORE_PATH"):
+        raise SystemExit("複数ワーカーで起動するにはGRACHALLE_SESSION_STORE_PATHでセッションストアを指定してください")
+    # 各ワーカーは1つのイベントループで多数のセッションを処理し、セッションの状態はストアで共有する
+    uvicorn.run("server:app", host=args.host, port=args.port, workers=args.workers, log_level="info")
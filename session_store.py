@@ -0,0 +1,311 @@
+# session_store.py
+import abc
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, wait
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+import config  # noqa: F401
+from common import logger
+from examination import ConversationState
+from telemetry import LedgerEntry
+
+# -----------------------------------------------------#
+# セッションストアの設定                               #
+# -----------------------------------------------------#
+# SQLiteのファイルパス（未指定の場合はプロセス内のメモリに保持）
+SESSION_STORE_PATH = os.getenv("GRACHALLE_SESSION_STORE_PATH")
+# 書き込みをまとめてコミットするまでの待ち時間（秒）。同時期に届いた他のセッションの書き込みと1回でコミットする
+SESSION_STORE_COMMIT_DELAY = float(os.getenv("GRACHALLE_SESSION_STORE_COMMIT_DELAY", "0.005"))
+
+
+# -----------------------------------------------------#
+# セッションのスナップショット                         #
+# -----------------------------------------------------#
+class SessionSnapshot(BaseModel):
+    """
+    GraChalleInterfaceの状態を直列化したもの。どのワーカーでもこのスナップショットからセッションを再開できます。
+    """
+
+    session_id: str = Field(description="セッションID")
+    version: int = Field(default=0, description="ターンごとに増える版数（古い書き込みで上書きしないために使う）")
+    exam_status: str = Field(default="hearing", description="試験の状態（hearing, before, started）")
+    is_request_examination: bool = Field(default=False, description="試験開始のリクエストを受け付けたかどうか")
+    language: Optional[str] = Field(default=None, description="出題言語")
+    level: Optional[str] = Field(default=None, description="出題難易度")
+    conversation_turns: int = Field(default=0, description="受験者の回答済みターン数")
+    max_turns: int = Field(default=3, description="最大会話ターン数")
+    conversation: ConversationState = Field(default_factory=ConversationState, description="会話の状態")
+    pending_opener: Optional[str] = Field(default=None, description="先行生成済みの試験官の第一声")
+    cost: dict[str, LedgerEntry] = Field(default_factory=dict, description="呼び出し箇所ごとの料金台帳")
+    evaluation_job_id: Optional[str] = Field(default=None, description="試験終了時に登録した評価ジョブのID")
+    evaluation_report: Optional[str] = Field(default=None, description="評価ジョブから受け取った評価レポート")
+    updated_at: float = Field(default_factory=time.time, description="最終更新時刻（UNIX時間）")
+
+
+# -----------------------------------------------------#
+# セッションストア                                     #
+# -----------------------------------------------------#
+class SessionStore(abc.ABC):
+    """
+    セッションのスナップショットを保存するストアの共通インターフェース。
+    1ターンにつき読み込み（load）1回・書き込み（save）1回で使うことを想定しています。
+    """
+
+    @abc.abstractmethod
+    def load(self, session_id) -> Optional[SessionSnapshot]:
+        """スナップショットを読み込む（存在しない場合はNone）"""
+
+    @abc.abstractmethod
+    def save(self, snapshot: SessionSnapshot) -> Future:
+        """
+        スナップショットを保存する（保存済みのものより版数が新しい場合のみ反映）
+
+        Returns:
+            concurrent.futures.Future: 書き込みが反映されると完了する
+        """
+
+    @abc.abstractmethod
+    def delete(self, session_id):
+        """スナップショットを削除する（削除した場合はTrue）"""
+
+    @abc.abstractmethod
+    def purge_idle(self, max_idle_seconds):
+        """最終更新からmax_idle_seconds秒以上経ったスナップショットを削除し、件数を返す"""
+
+    def flush(self):
+        """未反映の書き込みを反映する"""
+
+    def close(self):
+        """ストアを閉じる"""
+        self.flush()
+
+
+class InMemorySessionStore(SessionStore):
+    """プロセス内のメモリに保持するストア（単一ワーカー・開発用）"""
+
+    def __init__(self):
+        self._rows = {}  # session_id -> (version, updated_at, JSON文字列)
+        self._lock = threading.Lock()
+
+    def load(self, session_id):
+        with self._lock:
+            row = self._rows.get(session_id)
+        # 呼び出し元が状態を書き換えても保存済みの内容に影響しないよう、JSONで保持して都度復元する
+        return SessionSnapshot.model_validate_json(row[2]) if row is not None else None
+
+    def save(self, snapshot):
+        data = snapshot.model_dump_json()
+        with self._lock:
+            row = self._rows.get(snapshot.session_id)
+            if row is None or snapshot.version > row[0]:
+                self._rows[snapshot.session_id] = (snapshot.version, snapshot.updated_at, data)
+        future = Future()
+        future.set_result(None)
+        return future
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._rows.pop(session_id, None) is not None
+
+    def purge_idle(self, max_idle_seconds):
+        threshold = time.time() - max_idle_seconds
+        with self._lock:
+            expired = [session_id for session_id, row in self._rows.items() if row[1] < threshold]
+            for session_id in expired:
+                del self._rows[session_id]
+        return len(expired)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    SQLite（WALモード）に保存するストア。複数のワーカープロセスから同じファイルを共有できます。
+    書き込みは専用スレッドがまとめて1トランザクションでコミットし（グループコミット）、
+    同じセッションの書き込みが溜まっている場合は最新のもののみを反映します。
+    """
+
+    _SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS sessions ("
+        "session_id TEXT PRIMARY KEY, version INTEGER NOT NULL, updated_at REAL NOT NULL, data TEXT NOT NULL)"
+    )
+    _UPSERT = (
+        "INSERT INTO sessions (session_id, version, updated_at, data) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(session_id) DO UPDATE SET version = excluded.version, updated_at = excluded.updated_at, "
+        "data = excluded.data WHERE excluded.version > sessions.version"
+    )
+
+    def __init__(self, path, commit_delay=SESSION_STORE_COMMIT_DELAY, retry_interval=1.0):
+        """
+        Parameters:
+            path (str): SQLiteのファイルパス
+            commit_delay (float): 最初の書き込みから、同時期の書き込みを待ってまとめるまでの秒数
+            retry_interval (float): コミットに失敗した場合の再試行間隔（秒）
+        """
+        self.path = path
+        self.commit_delay = commit_delay
+        self.retry_interval = retry_interval
+        self._local = threading.local()
+        # session_id -> (version, updated_at, JSON文字列, コミット完了を通知するFutureのリスト)
+        self._pending = {}
+        # コミット中の書き込み（コミットが完了するまでloadから参照できるようにする）
+        self._inflight = {}
+        self._pending_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(self._SCHEMA)
+        connection.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+        connection.commit()
+        self._writer = threading.Thread(target=self._write_loop, name="grachalle-session-writer", daemon=True)
+        self._writer.start()
+
+    def _connection(self):
+        """スレッドごとの接続を取得する"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            # WALモードではNORMALでもコミット済みのデータは破損しない（電源断時に直近のコミットを失う可能性のみ）
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def load(self, session_id):
+        with self._pending_lock:
+            row = self._pending.get(session_id) or self._inflight.get(session_id)
+        if row is None:
+            row = (
+                self._connection()
+                .execute("SELECT version, updated_at, data FROM sessions WHERE session_id = ?", (session_id,))
+                .fetchone()
+            )
+        return SessionSnapshot.model_validate_json(row[2]) if row is not None else None
+
+    def save(self, snapshot):
+        """
+        書き込みを予約し、コミットの完了を通知するFutureを返す
+
+        Returns:
+            concurrent.futures.Future: 書き込みがコミットされると完了する
+        """
+        future = Future()
+        data = snapshot.model_dump_json()
+        with self._pending_lock:
+            if self._closed:
+                raise RuntimeError("セッションストアは閉じられています")
+            current = self._pending.get(snapshot.session_id)
+            if current is None:
+                self._pending[snapshot.session_id] = (snapshot.version, snapshot.updated_at, data, [future])
+            elif snapshot.version > current[0]:
+                self._pending[snapshot.session_id] = (
+                    snapshot.version,
+                    snapshot.updated_at,
+                    data,
+                    current[3] + [future],
+                )
+            else:
+                current[3].append(future)
+        self._wakeup.set()
+        return future
+
+    def delete(self, session_id):
+        with self._pending_lock:
+            row = self._pending.pop(session_id, None)
+            self._inflight.pop(session_id, None)
+        connection = self._connection()
+        deleted = connection.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount
+        connection.commit()
+        for future in row[3] if row is not None else []:
+            future.set_result(None)
+        return deleted > 0 or row is not None
+
+    def purge_idle(self, max_idle_seconds):
+        threshold = time.time() - max_idle_seconds
+        connection = self._connection()
+        deleted = connection.execute("DELETE FROM sessions WHERE updated_at < ?", (threshold,)).rowcount
+        connection.commit()
+        return deleted
+
+    def _write_batch(self):
+        """溜まった書き込みを1トランザクションでコミットする（書き込み用スレッドから呼ぶ）"""
+        with self._pending_lock:
+            batch, self._pending = self._pending, {}
+            self._inflight = batch
+        if not batch:
+            return True
+        try:
+            with self._connection() as connection:
+                connection.executemany(self._UPSERT, [(session_id, *row[:3]) for session_id, row in batch.items()])
+        except sqlite3.Error as e:
+            logger.error("セッションの保存に失敗しました（%s件、再試行します）: %s", len(batch), e)
+            with self._pending_lock:
+                self._inflight = {}
+                for session_id, row in batch.items():
+                    current = self._pending.get(session_id)
+                    if current is None:
+                        self._pending[session_id] = row
+                    elif row[0] > current[0]:
+                        self._pending[session_id] = (*row[:3], row[3] + current[3])
+                    else:
+                        current[3].extend(row[3])
+            return False
+        with self._pending_lock:
+            self._inflight = {}
+        for row in batch.values():
+            for future in row[3]:
+                future.set_result(None)
+        return True
+
+    def _write_loop(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            # 同時期に届いた他のセッションの書き込みも同じトランザクションにまとめる
+            time.sleep(self.commit_delay)
+            if not self._write_batch():
+                time.sleep(self.retry_interval)
+                self._wakeup.set()
+            with self._pending_lock:
+                if self._closed and not self._pending:
+                    return
+
+    def flush(self, timeout=10):
+        """未反映の書き込みがコミットされるまで待つ"""
+        with self._pending_lock:
+            futures = [future for row in self._pending.values() for future in row[3]]
+        if futures:
+            self._wakeup.set()
+            _, not_done = wait(futures, timeout=timeout)
+            if not_done:
+                logger.warning("セッションの保存が期限内に完了しませんでした: 残り%s件", len(not_done))
+
+    def close(self):
+        with self._pending_lock:
+            self._closed = True
+        self._wakeup.set()
+        self._writer.join(timeout=10)
+
+
+_session_store = None
+_session_store_lock = threading.Lock()
+
+
+def get_session_store():
+    """
+    プロセス共有のセッションストアを取得する
+    （GRACHALLE_SESSION_STORE_PATHが設定されていればSQLite、なければメモリ）
+    """
+    global _session_store
+    with _session_store_lock:
+        if _session_store is None:
+            if SESSION_STORE_PATH:
+                logger.info("SQLiteのセッションストアを使用します: %s", SESSION_STORE_PATH)
+                _session_store = SQLiteSessionStore(SESSION_STORE_PATH)
+            else:
+                _session_store = InMemorySessionStore()
+    return _session_store
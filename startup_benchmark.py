@@ -0,0 +1,197 @@
+# startup_benchmark.py
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+# 起動時にインポートされてはならない重いパッケージ（初回の呼び出しまで遅らせているもの）
+DEFAULT_FORBIDDEN = ("openai", "httpx")
+
+# 初回の呼び出しを計測する子プロセスのスクリプト（親プロセスのモックサーバーに接続する）
+FIRST_CALL_SCRIPT = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+import main
+from common import OpenAIService
+from intent import ExaminationStartIntent
+imported = time.perf_counter()
+service = OpenAIService(endpoint=sys.argv[1], api_key="bench")
+constructed = time.perf_counter()
+
+async def _run():
+    if sys.argv[2] == "true":
+        await main.warm_up_async(service)
+    warmed = time.perf_counter()
+    await service.call_llm_with_json_output_async("system", "英語の初級で試験を受けたい", ExaminationStartIntent)
+    return warmed, time.perf_counter()
+
+warmed, called = asyncio.run(_run())
+print(json.dumps({
+    "import": imported - started,
+    "construct": constructed - imported,
+    "warm_up": warmed - constructed,
+    "first_call": called - warmed,
+}))
+"""
+
+
+# -----------------------------------------------------#
+# インポート時間の計測                                 #
+# -----------------------------------------------------#
+def parse_importtime(stderr, module):
+    """
+    `python -X importtime`の出力から、指定モジュールの累積時間と、その配下でインポートされたモジュールを取り出します
+
+    Parameters:
+        stderr (str): 子プロセスの標準エラー出力
+        module (str): 計測対象のモジュール名
+
+    Returns:
+        tuple[float, dict[str, float]]: (累積時間（ミリ秒）, モジュール名ごとの自身の時間（ミリ秒）)
+    """
+    subtree = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|", 2)
+        if not self_us.strip().isdigit():
+            # 見出し行
+            continue
+        # 先頭の空白1文字の後、階層ごとに2文字ずつ字下げされる
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        if depth == 0 and name == module:
+            return int(cumulative_us) / 1000, subtree
+        if depth == 0:
+            subtree = {}
+        else:
+            subtree[name] = int(self_us) / 1000
+    raise RuntimeError(f"インポート時間を取得できませんでした: {module}\n{stderr[-2000:]}")
+
+
+def measure_imports(module, runs):
+    """
+    新しいプロセスでモジュールをインポートし、累積時間と配下のモジュールの時間を計測します
+
+    Parameters:
+        module (str): 計測対象のモジュール名
+        runs (int): 計測回数（中央値を採用する）
+
+    Returns:
+        tuple[float, dict[str, float]]: (累積時間の中央値（ミリ秒）, 最後の計測でのモジュール名ごとの自身の時間（ミリ秒）)
+    """
+    totals = []
+    subtree = {}
+    for _ in range(runs):
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        if completed.returncode != 0:
+            raise RuntimeError(f"{module}のインポートに失敗しました:\n{completed.stderr[-2000:]}")
+        total, subtree = parse_importtime(completed.stderr, module)
+        totals.append(total)
+    return statistics.median(totals), subtree
+
+
+def heaviest_packages(subtree, top):
+    """配下のモジュールの自身の時間をトップレベルのパッケージごとに合計し、大きい順に返す"""
+    packages = defaultdict(float)
+    for name, self_ms in subtree.items():
+        packages[name.split(".")[0]] += self_ms
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+# -----------------------------------------------------#
+# 初回の呼び出しの計測                                 #
+# -----------------------------------------------------#
+def measure_first_call(warm_up, runs):
+    """
+    モックサーバーに対して、新しいプロセスでインポートから初回の構造化出力の呼び出しまでを計測します
+
+    Parameters:
+        warm_up (bool): 初回の呼び出しの前にウォームアップを行うかどうか
+        runs (int): 計測回数（段階ごとの中央値を採用する）
+
+    Returns:
+        dict[str, float]: 段階ごとの所要時間の中央値（ミリ秒）
+    """
+    from mock_server import MockSettings, start_mock_server
+
+    server = start_mock_server(port=0, settings=MockSettings(latency_median=0, chunk_interval=0))
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+    samples = defaultdict(list)
+    try:
+        for _ in range(runs):
+            completed = subprocess.run(
+                [sys.executable, "-c", FIRST_CALL_SCRIPT, endpoint, "true" if warm_up else "false"],
+                capture_output=True,
+                text=True,
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                # カセット・応答キャッシュを使わず、必ずモックサーバーに接続させる
+                env={
+                    **os.environ,
+                    "GRACHALLE_CASSETTE_PATH": "",
+                    "GRACHALLE_RESPONSE_CACHE_ENABLED": "false",
+                    "AZURE_OPENAI_DEPLOYMENTS": "",
+                },
+            )
+            if completed.returncode != 0:
+                raise RuntimeError(f"初回の呼び出しの計測に失敗しました:\n{completed.stderr[-2000:]}")
+            for stage, seconds in json.loads(completed.stdout.strip().splitlines()[-1]).items():
+                samples[stage].append(seconds * 1000)
+    finally:
+        server.shutdown()
+    return {stage: statistics.median(values) for stage, values in samples.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="起動時間（python -X importtime）を計測し、予算を超えた場合は終了コード1で終了します"
+    )
+    parser.add_argument(
+        "--module", action="append", default=None, help="計測するモジュール（既定: common, main, server）"
+    )
+    parser.add_argument("--runs", type=int, default=5, help="モジュールごとの計測回数（中央値を採用する）")
+    parser.add_argument("--budget-ms", type=float, default=300, help="モジュールごとのインポート時間の予算（ミリ秒）")
+    parser.add_argument("--top", type=int, default=8, help="表示する重いパッケージの数")
+    parser.add_argument(
+        "--forbid",
+        default=",".join(DEFAULT_FORBIDDEN),
+        help="起動時にインポートされてはならないパッケージ（カンマ区切り、空文字で無効）",
+    )
+    parser.add_argument(
+        "--first-call", action="store_true", help="モックサーバーに対する初回の呼び出しまでの時間も計測する"
+    )
+    args = parser.parse_args()
+
+    modules = args.module or ["common", "main", "server"]
+    forbidden = [name for name in args.forbid.split(",") if name]
+    violations = []
+    for module in modules:
+        total, subtree = measure_imports(module, args.runs)
+        status = "OK" if total <= args.budget_ms else "OVER"
+        print(f"{module:<20}{total:>10.1f} ms  (budget {args.budget_ms:.0f} ms) {status}")
+        for package, self_ms in heaviest_packages(subtree, args.top):
+            print(f"    {package:<28}{self_ms:>8.1f} ms")
+        if total > args.budget_ms:
+            violations.append(f"{module}: {total:.1f} ms > {args.budget_ms:.0f} ms")
+        imported = {name.split(".")[0] for name in subtree}
+        for package in forbidden:
+            if package in imported:
+                violations.append(f"{module}: 起動時に{package}をインポートしています")
+
+    if args.first_call:
+        for warm_up in (False, True):
+            stages = measure_first_call(warm_up, args.runs)
+            label = "first call (warm-up)" if warm_up else "first call (cold)"
+            print(f"{label:<24}" + "  ".join(f"{stage}={ms:.1f}ms" for stage, ms in stages.items()))
+
+    for violation in violations:
+        print(f"予算超過: {violation}")
+    sys.exit(1 if violations else 0)
@@ -0,0 +1,206 @@
+# structured_logging.py
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+
+import config  # noqa: F401
+from telemetry import record_log_dropped
+from tracing import current_span
+
+# -----------------------------------------------------#
+# ログの設定                                           #
+# -----------------------------------------------------#
+LOG_LEVEL = os.getenv("GRACHALLE_LOG_LEVEL", "INFO").upper()
+# "text"（従来の1行形式）または"json"（1行1レコードのJSON）
+LOG_FORMAT = os.getenv("GRACHALLE_LOG_FORMAT", "text").lower()
+# 出力先のファイル（未指定の場合は標準エラー出力）
+LOG_PATH = os.getenv("GRACHALLE_LOG_PATH")
+# メッセージの最大文字数（超えた分は切り詰める、0で無制限）
+LOG_MAX_MESSAGE_CHARS = int(os.getenv("GRACHALLE_LOG_MAX_MESSAGE_CHARS", "1000"))
+# 出力待ちのレコードの上限（超えた分は破棄し、呼び出し元を待たせない）
+LOG_QUEUE_SIZE = int(os.getenv("GRACHALLE_LOG_QUEUE_SIZE", "10000"))
+# ロガー名（またはその接頭辞）ごとに出力する割合。WARNING以上のレコードは常に出力する
+# 例: {"httpx": 0.05, "common": 0.5}
+LOG_SAMPLING = json.loads(os.getenv("GRACHALLE_LOG_SAMPLING") or "{}")
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+TEXT_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# LogRecordが標準で持つ属性（extraで渡された項目と区別するため）
+_RESERVED_ATTRIBUTES = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime", "context"}
+
+
+# -----------------------------------------------------#
+# ログの文脈                                           #
+# -----------------------------------------------------#
+# 現在処理中のセッション・段階など、以降のレコードに付ける項目（asyncio.create_taskで生成したタスクにも引き継がれる）
+_log_context = contextvars.ContextVar("grachalle_log_context", default={})
+
+
+def bind_log_context(**fields):
+    """以降のレコードに付ける項目を追加する（戻り値はunbind_log_contextに渡す）"""
+    return _log_context.set({**_log_context.get(), **fields})
+
+
+def unbind_log_context(token):
+    _log_context.reset(token)
+
+
+def truncate(text, limit=LOG_MAX_MESSAGE_CHARS):
+    """長いテキストを切り詰め、省略した文字数を付ける（limitが0の場合はそのまま）"""
+    if not limit or len(text) <= limit:
+        return text
+    return f"{text[:limit]}…(+{len(text) - limit}文字)"
+
+
+# -----------------------------------------------------#
+# 呼び出し元のスレッドでの処理                         #
+# -----------------------------------------------------#
+class SamplingFilter(logging.Filter):
+    """ロガー名（最長一致の接頭辞）ごとの割合でWARNING未満のレコードを間引く"""
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = dict(rates if rates is not None else LOG_SAMPLING)
+        self._resolved = {}
+
+    def _rate(self, name):
+        rate = self._resolved.get(name)
+        if rate is None:
+            matches = [prefix for prefix in self.rates if name == prefix or name.startswith(prefix + ".")]
+            rate = self._resolved[name] = float(self.rates[max(matches, key=len)]) if matches else 1.0
+        return rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self._rate(record.name)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        record_log_dropped("sampled")
+        return False
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """
+    レコードを待ち行列に入れるだけのハンドラー（書式化後の出力は専用スレッドで行う）。
+    呼び出し元で行うのは、メッセージの組み立て（%形式の引数の埋め込み）と切り詰め、文脈の取り込みのみです。
+    """
+
+    def prepare(self, record):
+        # 引数の埋め込みは出力対象になったレコードのみで行われる（%形式で渡せば、間引かれたレコードは組み立てない）
+        # 他のハンドラーにも渡るレコードは変更せず、複製に対して処理する
+        record = logging.makeLogRecord(record.__dict__)
+        # LLMの応答などの長い文字列の引数は、埋め込む前に切り詰めて全文のコピーを作らない
+        if isinstance(record.args, tuple):
+            record.args = tuple(truncate(arg) if isinstance(arg, str) else arg for arg in record.args)
+        message = truncate(record.getMessage())
+        record.msg = message
+        record.args = None
+        record.message = message
+        if record.exc_info:
+            # トレースバックは別スレッドに渡せないため、ここで文字列にする
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        context = dict(_log_context.get())
+        span = current_span()
+        if span.recording:
+            context["trace_id"] = span.trace_id
+            context["span_id"] = span.span_id
+        record.context = context
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            record_log_dropped("overflow")
+
+
+# -----------------------------------------------------#
+# 出力用のスレッドでの処理                             #
+# -----------------------------------------------------#
+def _extra_fields(record):
+    """extraで渡された項目"""
+    return {key: value for key, value in record.__dict__.items() if key not in _RESERVED_ATTRIBUTES}
+
+
+class JsonFormatter(logging.Formatter):
+    """1行1レコードのJSON（時刻・レベル・ロガー名・メッセージと、セッションID・段階などの文脈）"""
+
+    def format(self, record):
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **getattr(record, "context", {}),
+            **_extra_fields(record),
+        }
+        if record.exc_text:
+            payload["exception"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class ContextTextFormatter(logging.Formatter):
+    """従来の1行形式の末尾に、セッションID・段階などの文脈を付ける"""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT, TEXT_DATE_FORMAT)
+
+    def format(self, record):
+        text = super().format(record)
+        fields = {**getattr(record, "context", {}), **_extra_fields(record)}
+        fields.pop("span_id", None)
+        if not fields:
+            return text
+        suffix = " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_text:
+            # 例外のトレースバックより前（1行目の末尾）に付ける
+            first, _, rest = text.partition("\n")
+            return f"{first} [{suffix}]\n{rest}"
+        return f"{text} [{suffix}]"
+
+
+_listener = None
+
+
+def configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, path=LOG_PATH):
+    """
+    ルートロガーに待ち行列のハンドラーを設定し、出力用のスレッドを起動します。
+    ルートロガーにハンドラーが設定済みの場合は何もしません（logging.basicConfigと同じ扱い）。
+
+    Parameters:
+        level (str): ログレベル
+        fmt (str): "text"または"json"
+        path (str): 出力先のファイル（Noneの場合は標準エラー出力）
+
+    Returns:
+        logging.handlers.QueueListener: 起動した出力用のスレッド（設定済みの場合はNone）
+    """
+    global _listener
+    root = logging.getLogger()
+    if root.handlers:
+        return None
+    if path:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        output = logging.FileHandler(path, encoding="utf-8")
+    else:
+        output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else ContextTextFormatter())
+    handler = ContextQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    handler.addFilter(SamplingFilter())
+    root.addHandler(handler)
+    root.setLevel(level)
+    _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    # 終了時に出力待ちのレコードを書き切る
+    atexit.register(_listener.stop)
+    return _listener
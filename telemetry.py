@@ -0,0 +1,497 @@
+# telemetry.py
+import contextvars
+import json
+import logging
+import os
+import threading
+import weakref
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pydantic import BaseModel, Field
+
+import config  # noqa: F401
+
+# common.pyから読み込まれるため、ロガーは直接取得する
+logger = logging.getLogger(__name__)
+
+# -----------------------------------------------------#
+# テレメトリーの設定                                   #
+# -----------------------------------------------------#
+# Prometheusのスクレイプ用エンドポイント（0の場合は起動しない）
+METRICS_HOST = os.getenv("GRACHALLE_METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("GRACHALLE_METRICS_PORT", "9464"))
+# 1,000トークンあたりの料金（USD）。デプロイメント名（またはその接頭辞）ごとに上書きできる
+# 例: {"gpt-4o-mini": {"prompt": 0.00015, "completion": 0.0006}}
+DEFAULT_MODEL_PRICES = {
+    "gpt-4o-mini": {"prompt": 0.00015, "completion": 0.0006},
+    "gpt-4o": {"prompt": 0.0025, "completion": 0.01},
+    "gpt-4": {"prompt": 0.03, "completion": 0.06},
+    "gpt-35-turbo": {"prompt": 0.0005, "completion": 0.0015},
+}
+MODEL_PRICES = {**DEFAULT_MODEL_PRICES, **json.loads(os.getenv("GRACHALLE_MODEL_PRICES") or "{}")}
+
+# レイテンシのヒストグラムの区切り（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 45.0)
+
+
+# -----------------------------------------------------#
+# メトリクス                                           #
+# -----------------------------------------------------#
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """ラベル付きメトリクスの共通処理"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}のラベルが一致しません: {sorted(labels)} != {sorted(self.labelnames)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    """単調増加するカウンター"""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """任意の値をとるゲージ"""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """区切りごとの累積件数・合計・件数を保持するヒストグラム"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def _render_sample(self, key, state):
+        lines = [
+            f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', _format_value(bound))])} {count}"
+            for bound, count in zip(self.buckets, state["counts"])
+        ]
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+        lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """メトリクスの一覧を保持し、Prometheusのテキスト形式で出力する"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """スクレイプのたびに呼び出す関数（ゲージの更新用）を登録する"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+        for collector in collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.warning("メトリクスの収集に失敗しました: %s", e)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+LLM_REQUEST_SECONDS = REGISTRY.register(
+    Histogram(
+        "grachalle_llm_request_seconds",
+        "LLM呼び出し1件（再試行込み）の所要時間",
+        ("call_site", "model", "outcome"),
+    )
+)
+LLM_TTFT_SECONDS = REGISTRY.register(
+    Histogram("grachalle_llm_ttft_seconds", "ストリーミング呼び出しの最初のチャンクまでの時間", ("call_site", "model"))
+)
+LLM_TOKENS = REGISTRY.register(
+    Counter("grachalle_llm_tokens_total", "LLM呼び出しの使用トークン数", ("call_site", "model", "kind"))
+)
+LLM_COST = REGISTRY.register(Counter("grachalle_llm_cost_usd_total", "LLM呼び出しの推定料金", ("call_site", "model")))
+LLM_RETRIES = REGISTRY.register(Counter("grachalle_llm_retries_total", "LLM呼び出しの再試行回数", ("call_site",)))
+LLM_ATTEMPT_FAILURES = REGISTRY.register(
+    Counter("grachalle_llm_attempt_failures_total", "LLM呼び出しの試行ごとの失敗回数", ("call_site", "kind"))
+)
+LLM_ESCALATIONS = REGISTRY.register(
+    Counter("grachalle_llm_escalations_total", "小型モデルから大型モデルへの呼び直し回数", ("call_site",))
+)
+LLM_CACHE_REQUESTS = REGISTRY.register(
+    Counter(
+        "grachalle_llm_cache_requests_total",
+        "応答キャッシュの参照回数（hit: キャッシュから応答, coalesced: 同じ処理中の呼び出しの結果を共有, miss: 呼び出し）",
+        ("call_site", "result"),
+    )
+)
+FAST_INTENT_REQUESTS = REGISTRY.register(
+    Counter("grachalle_fast_intent_requests_total", "ルールベースの意図判定を試みた回数", ("stage",))
+)
+FAST_INTENT_HITS = REGISTRY.register(
+    Counter(
+        "grachalle_fast_intent_hits_total",
+        "ルールベースの意図判定で即答できた（LLM呼び出しを省略した）回数",
+        ("stage",),
+    )
+)
+RATE_LIMIT_QUEUE_DEPTH = REGISTRY.register(
+    Gauge("grachalle_rate_limit_queue_depth", "レートリミッターの待ち行列の長さ", ("deployment",))
+)
+DEPLOYMENT_OUTSTANDING = REGISTRY.register(
+    Gauge("grachalle_deployment_outstanding", "デプロイメントごとの処理中の呼び出し件数", ("deployment",))
+)
+TRANSITION_SECONDS = REGISTRY.register(
+    Histogram("grachalle_transition_seconds", "状態遷移1回（1ターン）の応答全体の所要時間", ("transition",))
+)
+TRANSITION_FIRST_CHUNK_SECONDS = REGISTRY.register(
+    Histogram("grachalle_transition_first_chunk_seconds", "状態遷移1回の最初の出力までの時間", ("transition",))
+)
+JOB_QUEUE_DEPTH = REGISTRY.register(
+    Gauge("grachalle_job_queue_depth", "ジョブキューの状態ごとのジョブ数", ("kind", "status"))
+)
+JOB_WAIT_SECONDS = REGISTRY.register(
+    Histogram(
+        "grachalle_job_wait_seconds",
+        "ジョブの登録から処理開始までの待ち時間",
+        ("kind",),
+        buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+    )
+)
+JOB_SECONDS = REGISTRY.register(
+    Histogram(
+        "grachalle_job_seconds", "ジョブ1件の処理時間", ("kind", "outcome"), buckets=LATENCY_BUCKETS + (90.0, 180.0)
+    )
+)
+TRACE_SPANS = REGISTRY.register(
+    Counter(
+        "grachalle_trace_spans_total",
+        "トレースのスパン数（exported: 出力, dropped: 出力待ちの上限を超えて破棄）",
+        ("result",),
+    )
+)
+LOG_RECORDS_DROPPED = REGISTRY.register(
+    Counter(
+        "grachalle_log_records_dropped_total",
+        "出力しなかったログレコード数（sampled: 割合による間引き, overflow: 出力待ちの上限を超えて破棄）",
+        ("reason",),
+    )
+)
+
+
+# -----------------------------------------------------#
+# セッションごとの料金台帳                             #
+# -----------------------------------------------------#
+class LedgerEntry(BaseModel):
+    """呼び出し箇所ごとの集計"""
+
+    calls: int = Field(default=0, description="呼び出し件数")
+    prompt_tokens: int = Field(default=0, description="入力トークン数")
+    completion_tokens: int = Field(default=0, description="出力トークン数")
+    cost: float = Field(default=0.0, description="推定料金（USD）")
+    seconds: float = Field(default=0.0, description="所要時間の合計（秒）")
+
+
+class CostLedger:
+    """1セッション分のLLM呼び出しの件数・トークン数・推定料金を呼び出し箇所ごとに集計する台帳"""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.entries = {}
+        self._lock = threading.Lock()
+
+    def add(self, call_site, prompt_tokens, completion_tokens, cost, seconds):
+        with self._lock:
+            entry = self.entries.get(call_site)
+            if entry is None:
+                entry = self.entries[call_site] = LedgerEntry()
+            entry.calls += 1
+            entry.prompt_tokens += prompt_tokens
+            entry.completion_tokens += completion_tokens
+            entry.cost += cost
+            entry.seconds += seconds
+
+    def merge(self, entries):
+        """別の台帳（ジョブを処理したワーカーなど）の集計を加算する"""
+        with self._lock:
+            for call_site, other in entries.items():
+                entry = self.entries.get(call_site)
+                if entry is None:
+                    entry = self.entries[call_site] = LedgerEntry()
+                entry.calls += other.calls
+                entry.prompt_tokens += other.prompt_tokens
+                entry.completion_tokens += other.completion_tokens
+                entry.cost += other.cost
+                entry.seconds += other.seconds
+
+    @property
+    def total_cost(self):
+        with self._lock:
+            return sum(entry.cost for entry in self.entries.values())
+
+    def summary(self):
+        """呼び出し箇所ごとの集計を辞書で返す"""
+        with self._lock:
+            return {call_site: entry.model_dump() for call_site, entry in self.entries.items()}
+
+
+# 現在処理中のセッションの台帳（asyncio.create_taskで生成したタスクにも引き継がれる）
+_current_ledger = contextvars.ContextVar("grachalle_cost_ledger", default=None)
+
+
+def bind_ledger(ledger):
+    """以降のLLM呼び出しを記録する台帳を設定する（戻り値はunbind_ledgerに渡す）"""
+    return _current_ledger.set(ledger)
+
+
+def unbind_ledger(token):
+    _current_ledger.reset(token)
+
+
+def current_ledger():
+    return _current_ledger.get()
+
+
+# -----------------------------------------------------#
+# 記録                                                 #
+# -----------------------------------------------------#
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    """デプロイメント名（最長一致の接頭辞）の料金表から推定料金（USD）を返す（料金表にない場合は0）"""
+    matches = [name for name in MODEL_PRICES if model and model.startswith(name)]
+    if not matches:
+        return 0.0
+    price = MODEL_PRICES[max(matches, key=len)]
+    return (prompt_tokens * price.get("prompt", 0.0) + completion_tokens * price.get("completion", 0.0)) / 1000
+
+
+def record_llm_call(call_site, model, seconds, outcome, prompt_tokens=0, completion_tokens=0):
+    """
+    LLM呼び出し1件の所要時間・トークン数・推定料金を記録します（セッションの台帳があれば台帳にも記録）
+
+    Parameters:
+        call_site (str): 呼び出し箇所
+        model (str): デプロイメント名
+        seconds (float): 所要時間（再試行込み）
+        outcome (str): "ok"または失敗の種類
+        prompt_tokens (int): 入力トークン数
+        completion_tokens (int): 出力トークン数
+    """
+    LLM_REQUEST_SECONDS.observe(seconds, call_site=call_site, model=model, outcome=outcome)
+    cost = estimate_cost(model, prompt_tokens, completion_tokens)
+    if prompt_tokens or completion_tokens:
+        LLM_TOKENS.inc(prompt_tokens, call_site=call_site, model=model, kind="prompt")
+        LLM_TOKENS.inc(completion_tokens, call_site=call_site, model=model, kind="completion")
+        LLM_COST.inc(cost, call_site=call_site, model=model)
+    ledger = current_ledger()
+    if ledger is not None:
+        ledger.add(call_site, prompt_tokens, completion_tokens, cost, seconds)
+
+
+def record_ttft(call_site, model, seconds):
+    LLM_TTFT_SECONDS.observe(seconds, call_site=call_site, model=model)
+
+
+def record_attempt_failure(call_site, kind, retrying):
+    """試行の失敗を記録する（retryingがTrueの場合は再試行回数にも数える）"""
+    LLM_ATTEMPT_FAILURES.inc(call_site=call_site, kind=kind)
+    if retrying:
+        LLM_RETRIES.inc(call_site=call_site)
+
+
+def record_escalation(call_site):
+    LLM_ESCALATIONS.inc(call_site=call_site)
+
+
+def record_cache(call_site, result):
+    LLM_CACHE_REQUESTS.inc(call_site=call_site, result=result)
+
+
+def record_fast_intent(stage, hit):
+    """ルールベースの意図判定1回の結果を記録する（ヒット率はhits_total / requests_total）"""
+    FAST_INTENT_REQUESTS.inc(stage=stage)
+    if hit:
+        FAST_INTENT_HITS.inc(stage=stage)
+
+
+# 状態を収集するデプロイメントプール（OpenAIServiceごとに登録され、破棄されたプールは自動的に外れる）
+_watched_pools = weakref.WeakSet()
+_watched_pools_lock = threading.Lock()
+
+
+def _collect_pools():
+    with _watched_pools_lock:
+        pools = list(_watched_pools)
+    for pool in pools:
+        for deployment in pool.deployments:
+            DEPLOYMENT_OUTSTANDING.set(deployment.outstanding, deployment=deployment.name)
+            if deployment.rate_limiter is not None:
+                RATE_LIMIT_QUEUE_DEPTH.set(deployment.rate_limiter.queue_depth, deployment=deployment.name)
+
+
+REGISTRY.add_collector(_collect_pools)
+
+
+def watch_pools(pools):
+    """
+    デプロイメントプールの処理中の件数と待ち行列の長さを、スクレイプのたびに収集する
+    （同じプールは1回だけ登録し、プールへの参照は保持しない）
+    """
+    with _watched_pools_lock:
+        _watched_pools.update(pools)
+
+
+def watch_job_queue(queue):
+    """ジョブキューの状態ごとのジョブ数を、スクレイプのたびに収集する"""
+
+    def _collect():
+        for (kind, status), count in queue.counts().items():
+            JOB_QUEUE_DEPTH.set(count, kind=kind, status=status)
+
+    REGISTRY.add_collector(_collect)
+
+
+def record_job(kind, outcome, seconds, waited=None):
+    """ジョブ1件の処理時間（と登録から処理開始までの待ち時間）を記録する"""
+    JOB_SECONDS.observe(seconds, kind=kind, outcome=outcome)
+    if waited is not None:
+        JOB_WAIT_SECONDS.observe(waited, kind=kind)
+
+
+def record_spans(result, count=1):
+    TRACE_SPANS.inc(count, result=result)
+
+
+def record_log_dropped(reason):
+    LOG_RECORDS_DROPPED.inc(reason=reason)
+
+
+def record_transition(transition, seconds, first_chunk=None):
+    """状態遷移1回の所要時間（と最初の出力までの時間）を記録する"""
+    TRANSITION_SECONDS.observe(seconds, transition=transition)
+    if first_chunk is not None:
+        TRANSITION_FIRST_CHUNK_SECONDS.observe(first_chunk, transition=transition)
+
+
+# -----------------------------------------------------#
+# スクレイプ用エンドポイント                           #
+# -----------------------------------------------------#
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # スクレイプのたびにアクセスログを出さない
+        pass
+
+
+_metrics_server = None
+_metrics_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    """
+    /metricsを返すHTTPサーバーを別スレッドで起動します（プロセスにつき1つ、portが0の場合は起動しない）
+
+    Returns:
+        ThreadingHTTPServer: 起動したサーバー（起動しない・ポートを使用できない場合はNone）
+    """
+    global _metrics_server
+    if not port:
+        return None
+    with _metrics_server_lock:
+        if _metrics_server is None:
+            try:
+                server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError as e:
+                # 同じホストの別のワーカーがポートを使用中の場合など。メトリクスなしで処理を続ける
+                logger.warning("メトリクスのエンドポイントを起動できませんでした (%s:%s): %s", host, port, e)
+                return None
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name="grachalle-metrics", daemon=True).start()
+            logger.info(
+                "メトリクスのエンドポイントを起動しました: http://%s:%s/metrics", host, server.server_address[1]
+            )
+            _metrics_server = server
+    return _metrics_server
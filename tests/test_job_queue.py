@@ -0,0 +1,187 @@
+# tests/test_job_queue.py
+import asyncio
+import time
+
+import pytest
+
+from job_queue import FAILED, QUEUED, RUNNING, SUCCEEDED, JobQueue, JobWorker
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.db"))
+
+
+def expire_lease(queue, job_id):
+    """処理中のジョブの占有期限を過去にする（ワーカーが応答しなくなった状態）"""
+    with queue._connection() as connection:
+        connection.execute("UPDATE jobs SET lease_until = ? WHERE job_id = ?", (time.time() - 1, job_id))
+
+
+# -----------------------------------------------------#
+# 占有期限と試行回数                                   #
+# -----------------------------------------------------#
+def test_submit_is_idempotent_per_key(queue):
+    first = queue.submit("evaluation", "session-1", "{}")
+    second = queue.submit("evaluation", "session-1", '{"other": true}')
+
+    assert second.job_id == first.job_id
+    assert second.payload == "{}"
+
+
+def test_running_job_is_not_claimed_twice_while_leased(queue):
+    queue.submit("evaluation", "session-1", "{}")
+
+    assert queue.claim("worker-a", ["evaluation"]) is not None
+    assert queue.claim("worker-b", ["evaluation"]) is None
+
+
+def test_expired_lease_is_reclaimed_by_another_worker(queue):
+    job = queue.submit("evaluation", "session-1", "{}")
+    claimed = queue.claim("worker-a", ["evaluation"])
+    expire_lease(queue, job.job_id)
+
+    reclaimed = queue.claim("worker-b", ["evaluation"])
+
+    assert reclaimed.job_id == job.job_id
+    assert reclaimed.status == RUNNING
+    assert reclaimed.worker_id == "worker-b"
+    assert reclaimed.attempts == claimed.attempts + 1
+    # 占有を失ったワーカーは延長も完了の記録もできない
+    assert not queue.heartbeat(job.job_id, "worker-a")
+    assert not queue.complete(job.job_id, "worker-a", "{}")
+    assert queue.complete(job.job_id, "worker-b", '{"ok": true}')
+    assert queue.get(job.job_id).status == SUCCEEDED
+
+
+def test_expired_lease_at_max_attempts_is_forced_to_failed(queue):
+    job = queue.submit("evaluation", "session-1", "{}", max_attempts=2)
+    for worker_id in ("worker-a", "worker-b"):
+        assert queue.claim(worker_id, ["evaluation"]).job_id == job.job_id
+        expire_lease(queue, job.job_id)
+
+    assert queue.claim("worker-c", ["evaluation"]) is None
+
+    failed = queue.get(job.job_id)
+    assert failed.status == FAILED
+    assert failed.attempts == 2
+    assert failed.worker_id is None
+    assert failed.error == "処理中のワーカーが応答しなくなりました"
+
+
+def test_fail_requeues_until_max_attempts(queue):
+    job = queue.submit("evaluation", "session-1", "{}", max_attempts=2)
+
+    queue.claim("worker-a", ["evaluation"])
+    assert queue.fail(job.job_id, "worker-a", "boom", retry_delay=0)
+    assert queue.get(job.job_id).status == QUEUED
+
+    queue.claim("worker-a", ["evaluation"])
+    assert queue.fail(job.job_id, "worker-a", "boom again", retry_delay=0)
+    failed = queue.get(job.job_id)
+    assert failed.status == FAILED
+    assert failed.error == "boom again"
+    assert queue.claim("worker-a", ["evaluation"]) is None
+
+
+def test_release_does_not_count_an_attempt(queue):
+    job = queue.submit("evaluation", "session-1", "{}")
+    assert queue.claim("worker-a", ["evaluation"]).attempts == 1
+
+    assert queue.release(job.job_id, "worker-a")
+
+    released = queue.get(job.job_id)
+    assert released.status == QUEUED
+    assert released.attempts == 0
+    assert released.worker_id is None
+    assert queue.claim("worker-b", ["evaluation"]).attempts == 1
+
+
+# -----------------------------------------------------#
+# ワーカー                                             #
+# -----------------------------------------------------#
+def test_worker_shutdown_releases_job_without_counting_an_attempt(queue):
+    job = queue.submit("evaluation", "session-1", "{}")
+    started = asyncio.Event()
+    cancelled = False
+
+    async def handler(payload):
+        nonlocal cancelled
+        started.set()
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+
+    async def run():
+        worker = JobWorker(queue, {"evaluation": handler}, lease_seconds=30, poll_interval=0.01)
+        running = asyncio.create_task(worker.run())
+        await asyncio.wait_for(started.wait(), 5)
+        worker.stop()
+        await asyncio.wait_for(running, 5)
+
+    asyncio.run(run())
+
+    released = queue.get(job.job_id)
+    assert cancelled
+    assert released.status == QUEUED
+    assert released.attempts == 0
+    assert released.worker_id is None
+
+
+def test_heartbeat_that_lost_the_lease_cancels_the_handler(queue):
+    job = queue.submit("evaluation", "session-1", "{}")
+    cancelled = False
+    finished = False
+
+    async def handler(payload):
+        nonlocal cancelled, finished
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finished = True
+        return "{}"
+
+    async def steal_lease():
+        await asyncio.sleep(0.05)
+        with queue._connection() as connection:
+            connection.execute("UPDATE jobs SET worker_id = 'worker-b' WHERE job_id = ?", (job.job_id,))
+
+    async def run():
+        # 占有期限の3分の1（0.03秒）ごとに延長する
+        worker = JobWorker(queue, {"evaluation": handler}, lease_seconds=0.09)
+        claimed = queue.claim(worker.worker_id, ["evaluation"], worker.lease_seconds)
+        stealing = asyncio.create_task(steal_lease())
+        await asyncio.wait_for(worker._process(claimed), 5)
+        await stealing
+
+    asyncio.run(run())
+
+    assert cancelled
+    assert not finished
+    # 占有を移されたジョブは、打ち切った側からは更新しない
+    stolen = queue.get(job.job_id)
+    assert stolen.status == RUNNING
+    assert stolen.worker_id == "worker-b"
+    assert stolen.attempts == 1
+
+
+def test_worker_records_handler_failure_for_retry(queue):
+    job = queue.submit("evaluation", "session-1", "{}")
+
+    async def handler(payload):
+        raise ValueError("bad payload")
+
+    async def run():
+        worker = JobWorker(queue, {"evaluation": handler}, retry_delay=60)
+        await worker._process(queue.claim(worker.worker_id, ["evaluation"]))
+
+    asyncio.run(run())
+
+    failed = queue.get(job.job_id)
+    assert failed.status == QUEUED
+    assert failed.error == "bad payload"
+    assert failed.available_at > time.time() + 30
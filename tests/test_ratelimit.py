@@ -0,0 +1,200 @@
+# tests/test_ratelimit.py
+import asyncio
+
+import pytest
+
+from ratelimit import (
+    PRIORITY_CONVERSATION,
+    PRIORITY_EVALUATION,
+    PRIORITY_HEARING,
+    RateLimiter,
+)
+
+
+class FakeClock:
+    """テストから進める時計（補充はadvanceした分だけ行われる）"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+async def wait_until(predicate, timeout=5):
+    """条件を満たすまでイベントループを回す"""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "条件を満たしませんでした"
+        await asyncio.sleep(0.005)
+
+
+# -----------------------------------------------------#
+# 優先度と受付                                         #
+# -----------------------------------------------------#
+def test_waiters_are_admitted_in_priority_order(clock):
+    # 1秒あたり100トークン（満杯で1000トークン）。1件あたり10トークンなので0.1秒ごとに1件通る
+    limiter = RateLimiter(tpm=6000, clock=clock)
+    admitted = []
+
+    async def request(name, priority):
+        assert await limiter.acquire(10, priority)
+        admitted.append(name)
+
+    async def run():
+        assert limiter.try_acquire(1000)
+        tasks = []
+        for name, priority in [
+            ("hearing", PRIORITY_HEARING),
+            ("conversation-1", PRIORITY_CONVERSATION),
+            ("evaluation", PRIORITY_EVALUATION),
+            ("conversation-2", PRIORITY_CONVERSATION),
+        ]:
+            tasks.append(asyncio.create_task(request(name, priority)))
+            await wait_until(lambda: limiter.queue_depth == len(tasks))
+        # 1件分ずつ補充し、1件ずつ通す
+        for count in range(1, len(tasks) + 1):
+            clock.advance(0.1)
+            await wait_until(lambda: len(admitted) == count)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+
+    # 優先度順、同じ優先度は到着順
+    assert admitted == ["evaluation", "conversation-1", "conversation-2", "hearing"]
+    assert limiter.queue_depth == 0
+
+
+def test_try_acquire_does_not_overtake_waiters(clock):
+    limiter = RateLimiter(tpm=6000, clock=clock)
+
+    async def run():
+        assert limiter.try_acquire(1000)
+        waiter = asyncio.create_task(limiter.acquire(10, PRIORITY_HEARING))
+        await wait_until(lambda: limiter.queue_depth == 1)
+        clock.advance(1)
+        # 補充されていても、待っている呼び出しがあれば割り込まない
+        assert not limiter.try_acquire(10, PRIORITY_EVALUATION)
+        assert await asyncio.wait_for(waiter, 5)
+
+    asyncio.run(run())
+
+
+def test_hearing_is_rejected_when_queue_is_deep(clock):
+    limiter = RateLimiter(tpm=6000, max_queue_depth=2, clock=clock)
+
+    async def run():
+        assert limiter.try_acquire(1000)
+        waiters = [asyncio.create_task(limiter.acquire(10, PRIORITY_CONVERSATION)) for _ in range(2)]
+        await wait_until(lambda: limiter.queue_depth == 2)
+
+        # 新規セッションのヒアリングは待たせずに断る
+        assert not await asyncio.wait_for(limiter.acquire(10, PRIORITY_HEARING), 1)
+        # 試験中の会話と評価は断らずに待ち行列に入れる
+        extra = [
+            asyncio.create_task(limiter.acquire(10, PRIORITY_CONVERSATION)),
+            asyncio.create_task(limiter.acquire(10, PRIORITY_EVALUATION)),
+        ]
+        await wait_until(lambda: limiter.queue_depth == 4)
+
+        stats = limiter.stats()
+        assert stats["rejected"] == {"evaluation": 0, "conversation": 0, "hearing": 1}
+        assert stats["waiting"] == {"evaluation": 1, "conversation": 3, "hearing": 0}
+
+        # キャンセルした呼び出しは待ち行列から取り除かれる
+        for task in waiters + extra:
+            task.cancel()
+        await asyncio.gather(*waiters, *extra, return_exceptions=True)
+        assert limiter.queue_depth == 0
+
+    asyncio.run(run())
+
+
+def test_hearing_is_admitted_when_queue_is_empty(clock):
+    limiter = RateLimiter(tpm=6000, max_queue_depth=0, clock=clock)
+
+    assert asyncio.run(limiter.acquire(10, PRIORITY_HEARING))
+    assert limiter.stats()["admitted"]["hearing"] == 1
+
+
+# -----------------------------------------------------#
+# 精算と一時停止                                       #
+# -----------------------------------------------------#
+def test_reconcile_refunds_and_charges_the_difference(clock):
+    # 1秒あたり10トークン（満杯で100トークン）
+    limiter = RateLimiter(tpm=600, clock=clock)
+    assert limiter.try_acquire(60)
+    assert limiter.tokens.available == 40
+
+    # 見積もりより少なかった分を返す
+    limiter.reconcile(60, 20)
+    assert limiter.tokens.available == 80
+
+    # 見積もりより多かった分を追加で消費する
+    limiter.reconcile(20, 50)
+    assert limiter.tokens.available == 50
+    assert not limiter.try_acquire(60)
+
+    clock.advance(1)
+    assert limiter.try_acquire(60)
+    assert limiter.tokens.available == 0
+
+
+def test_refund_does_not_exceed_capacity(clock):
+    limiter = RateLimiter(tpm=600, clock=clock)
+    assert limiter.try_acquire(10)
+
+    limiter.reconcile(10, 0)
+    limiter.reconcile(10, 0)
+
+    assert limiter.tokens.available == limiter.tokens.capacity
+
+
+def test_reconcile_ignores_unknown_usage(clock):
+    limiter = RateLimiter(tpm=600, clock=clock)
+    assert limiter.try_acquire(10)
+
+    limiter.reconcile(10, None)
+
+    assert limiter.tokens.available == 90
+
+
+def test_request_larger_than_capacity_passes_when_full_and_goes_negative(clock):
+    limiter = RateLimiter(tpm=600, clock=clock)
+
+    assert limiter.try_acquire(150)
+    assert limiter.tokens.available == -50
+    # 負の残高を補充し終えるまで次の呼び出しは通らない
+    clock.advance(5)
+    assert not limiter.try_acquire(1)
+    clock.advance(0.1)
+    assert limiter.try_acquire(1)
+
+
+def test_requests_per_minute_bucket(clock):
+    # 1秒あたり1リクエスト（満杯で10リクエスト）
+    limiter = RateLimiter(rpm=60, clock=clock)
+    assert all(limiter.try_acquire(0) for _ in range(10))
+    assert not limiter.try_acquire(0)
+
+    clock.advance(1)
+    assert limiter.try_acquire(0)
+
+
+def test_pause_blocks_until_retry_after(clock):
+    limiter = RateLimiter(tpm=600, clock=clock)
+    limiter.pause(5)
+
+    assert not limiter.try_acquire(1)
+    clock.advance(4.9)
+    assert not limiter.try_acquire(1)
+    clock.advance(0.1)
+    assert limiter.try_acquire(1)
@@ -0,0 +1,195 @@
+# tests/test_response_cache.py
+import asyncio
+import threading
+import time
+
+from pydantic import BaseModel
+
+from common import OpenAIService
+from deployment_pool import DeploymentConfig
+from resilience import LLMFailure
+from response_cache import ResponseCache
+
+
+class Answer(BaseModel):
+    text: str
+
+
+def make_service(cache):
+    """接続しないダミーのデプロイメント1件と、指定した応答キャッシュを使うOpenAIService"""
+    config = DeploymentConfig(endpoint="http://127.0.0.1:9", api_key="test", model_name="test-model")
+    return OpenAIService(deployments=[config], small_deployments=[config], response_cache=cache)
+
+
+# -----------------------------------------------------#
+# 同一リクエストの合流（single-flight）                #
+# -----------------------------------------------------#
+def test_concurrent_identical_calls_make_one_upstream_call():
+    cache = ResponseCache()
+    service = make_service(cache)
+    calls = 0
+
+    async def upstream():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return Answer(text="hello")
+
+    async def run():
+        return await asyncio.gather(*(service._call_cached_async("key", Answer, "test", upstream) for _ in range(10)))
+
+    results = asyncio.run(run())
+
+    assert calls == 1
+    assert all(result == Answer(text="hello") for result in results)
+    # 合流した呼び出しにはそれぞれ別のインスタンスを返す
+    assert len({id(result) for result in results}) == len(results)
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["coalesced"] == 9
+    assert cache.get_local("key") == Answer(text="hello").model_dump_json()
+
+
+def test_concurrent_identical_sync_calls_make_one_upstream_call():
+    cache = ResponseCache()
+    service = make_service(cache)
+    calls = 0
+    started = threading.Event()
+    release = threading.Event()
+
+    def upstream():
+        nonlocal calls
+        calls += 1
+        started.set()
+        release.wait(5)
+        return Answer(text="hello")
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(service._call_cached("key", Answer, "test", upstream)))
+    leader.start()
+    started.wait(5)
+    followers = [
+        threading.Thread(target=lambda: results.append(service._call_cached("key", Answer, "test", upstream)))
+        for _ in range(5)
+    ]
+    for thread in followers:
+        thread.start()
+    # 後続の呼び出しがすべて合流してから先着の呼び出しを完了させる
+    deadline = time.monotonic() + 5
+    while cache.stats()["coalesced"] < len(followers) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join(5)
+
+    assert calls == 1
+    assert results == [Answer(text="hello")] * 6
+
+
+def test_leader_failure_reaches_followers_without_poisoning_cache():
+    cache = ResponseCache()
+    service = make_service(cache)
+    failure = LLMFailure(kind="server_error", message="boom")
+    calls = 0
+
+    async def failing():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return failure
+
+    async def succeeding():
+        nonlocal calls
+        calls += 1
+        return Answer(text="recovered")
+
+    async def run(call, count):
+        return await asyncio.gather(*(service._call_cached_async("key", Answer, "test", call) for _ in range(count)))
+
+    results = asyncio.run(run(failing, 5))
+
+    assert calls == 1
+    assert all(result == failure for result in results)
+    # 失敗はキャッシュに残らず、次の呼び出しは改めて呼び出す
+    assert cache.get_local("key") is None
+    assert cache.stats()["entries"] == 0
+
+    assert asyncio.run(run(succeeding, 1)) == [Answer(text="recovered")]
+    assert calls == 2
+
+
+def test_leader_exception_releases_followers_to_retry():
+    cache = ResponseCache()
+    service = make_service(cache)
+    calls = 0
+
+    async def upstream():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        if calls == 1:
+            raise RuntimeError("leader crashed")
+        return Answer(text="second")
+
+    async def run():
+        return await asyncio.gather(
+            *(service._call_cached_async("key", Answer, "test", upstream) for _ in range(4)),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(run())
+
+    # 先着の呼び出しの例外はその呼び出し元にのみ伝わり、待っていた呼び出しのいずれか1件が改めて呼び出す
+    assert isinstance(results[0], RuntimeError)
+    assert results[1:] == [Answer(text="second")] * 3
+    assert calls == 2
+    assert cache.get_local("key") == Answer(text="second").model_dump_json()
+
+
+# -----------------------------------------------------#
+# 有効期限とサイズの上限                               #
+# -----------------------------------------------------#
+def test_entries_expire_after_ttl():
+    cache = ResponseCache(ttl=0.05)
+    cache.put("key", "value")
+    assert cache.get("key") == "value"
+
+    time.sleep(0.1)
+
+    assert cache.get("key") is None
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["bytes"] == 0
+
+
+def test_least_recently_used_entries_are_evicted_over_byte_cap():
+    # キー1文字 + 値9文字 = 10バイトのエントリが3件まで入る
+    cache = ResponseCache(max_bytes=30)
+    for key in "abc":
+        cache.put(key, key * 9)
+    # aを参照して最近使ったものにする
+    assert cache.get("a") == "a" * 9
+
+    cache.put("d", "d" * 9)
+
+    assert cache.get("b") is None
+    assert [cache.get(key) for key in "acd"] == ["a" * 9, "c" * 9, "d" * 9]
+    assert cache.stats()["bytes"] == 30
+
+
+def test_value_larger_than_cap_is_not_cached():
+    cache = ResponseCache(max_bytes=10)
+    cache.put("a", "a" * 9)
+
+    cache.put("big", "x" * 100)
+
+    assert cache.get("big") is None
+    assert cache.get("a") == "a" * 9
+
+
+def test_replacing_an_entry_keeps_byte_count_consistent():
+    cache = ResponseCache(max_bytes=100)
+    cache.put("key", "short")
+    cache.put("key", "a much longer value")
+
+    assert cache.get("key") == "a much longer value"
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["bytes"] == len("key") + len("a much longer value")
@@ -0,0 +1,85 @@
+# tests/test_session_store.py
+import threading
+
+import pytest
+
+from session_store import (
+    InMemorySessionStore,
+    SessionSnapshot,
+    SessionStore,
+    SQLiteSessionStore,
+)
+
+
+def test_session_store_is_abstract():
+    with pytest.raises(TypeError):
+        SessionStore()
+
+
+def test_store_missing_an_operation_cannot_be_instantiated():
+    class LoadOnlyStore(SessionStore):
+        def load(self, session_id):
+            return None
+
+    with pytest.raises(TypeError, match="purge_idle"):
+        LoadOnlyStore()
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_stores_keep_only_newer_versions(backend, tmp_path):
+    store = InMemorySessionStore() if backend == "memory" else SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    try:
+        store.save(SessionSnapshot(session_id="s1", version=2, language="英語")).result(5)
+        store.save(SessionSnapshot(session_id="s1", version=1, language="フランス語")).result(5)
+
+        assert store.load("s1").language == "英語"
+        assert store.delete("s1")
+        assert store.load("s1") is None
+    finally:
+        store.close()
+
+
+class BlockingConnection:
+    """トランザクションの開始後、releaseされるまでコミットを止める接続"""
+
+    def __init__(self, connection, entered, release):
+        self.connection = connection
+        self.entered = entered
+        self.release = release
+
+    def __enter__(self):
+        connection = self.connection.__enter__()
+        self.entered.set()
+        self.release.wait(5)
+        return connection
+
+    def __exit__(self, *exc_info):
+        return self.connection.__exit__(*exc_info)
+
+
+def test_sqlite_store_reads_its_own_writes_while_committing(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"), commit_delay=0)
+    entered = threading.Event()
+    release = threading.Event()
+    try:
+        store.save(SessionSnapshot(session_id="s1", version=1, language="英語")).result(5)
+
+        connection = store._connection
+
+        def writer_connection():
+            if threading.current_thread() is store._writer:
+                return BlockingConnection(connection(), entered, release)
+            return connection()
+
+        store._connection = writer_connection
+        future = store.save(SessionSnapshot(session_id="s1", version=2, language="フランス語"))
+        assert entered.wait(5)
+
+        # 予約済みの書き込みがコミット中でも、最新のスナップショットを返す
+        assert store.load("s1").version == 2
+        release.set()
+        future.result(5)
+        assert store.load("s1").language == "フランス語"
+    finally:
+        release.set()
+        store.close()
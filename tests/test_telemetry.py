@@ -0,0 +1,39 @@
+# tests/test_telemetry.py
+import gc
+import socket
+import weakref
+
+import telemetry
+from deployment_pool import Deployment, DeploymentConfig, DeploymentPool
+from telemetry import REGISTRY, start_metrics_server, watch_pools
+
+
+def make_pool(name):
+    config = DeploymentConfig(endpoint=f"http://{name}.invalid", api_key="test", model_name="test-model")
+    return DeploymentPool([Deployment(config, {})])
+
+
+def test_watch_pools_registers_each_pool_once_and_forgets_discarded_pools():
+    collectors = len(REGISTRY._collectors)
+    pool = make_pool("kept")
+    discarded = make_pool("discarded")
+
+    for _ in range(3):
+        watch_pools([pool, discarded])
+    assert len(REGISTRY._collectors) == collectors
+    assert {pool, discarded} <= set(telemetry._watched_pools)
+
+    # 監視の登録はプールへの参照を保持しない
+    discarded_ref = weakref.ref(discarded)
+    del discarded
+    gc.collect()
+    assert discarded_ref() is None
+    assert pool in telemetry._watched_pools
+    assert 'grachalle_deployment_outstanding{deployment="' in REGISTRY.render()
+
+
+def test_metrics_server_returns_none_when_port_is_in_use():
+    with socket.socket() as busy:
+        busy.bind(("127.0.0.1", 0))
+        busy.listen()
+        assert start_metrics_server(port=busy.getsockname()[1], host="127.0.0.1") is None
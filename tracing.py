@@ -0,0 +1,707 @@
+# tracing.py
+import argparse
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import statistics
+import sys
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config  # noqa: F401
+from telemetry import record_spans
+
+# common.pyから読み込まれるため、ロガーは直接取得する
+logger = logging.getLogger(__name__)
+
+# -----------------------------------------------------#
+# トレースの設定                                       #
+# -----------------------------------------------------#
+# 無効の場合、スパンの生成はすべて共有の何もしないスパンを返すだけになる
+TRACING_ENABLED = os.getenv("GRACHALLE_TRACING_ENABLED", "false").lower() == "true"
+# トレース（ターン）ごとに記録する割合（0～1）
+TRACE_SAMPLE_RATE = float(os.getenv("GRACHALLE_TRACE_SAMPLE_RATE", "1.0"))
+# スパンの出力先（OTLP/JSON形式を1行1バッチで追記するファイル、空文字で無効）
+TRACE_EXPORT_PATH = os.getenv("GRACHALLE_TRACE_EXPORT_PATH", "traces.jsonl")
+# OTLP/HTTP（JSON）の送信先（例: http://localhost:4318/v1/traces、未指定の場合は送信しない）
+TRACE_OTLP_ENDPOINT = os.getenv("GRACHALLE_TRACE_OTLP_ENDPOINT")
+# 出力する間隔（秒）と、出力待ちのスパンの上限（超えた分は破棄する）
+TRACE_EXPORT_INTERVAL = float(os.getenv("GRACHALLE_TRACE_EXPORT_INTERVAL", "1.0"))
+TRACE_MAX_QUEUE = int(os.getenv("GRACHALLE_TRACE_MAX_QUEUE", "4096"))
+SERVICE_NAME = os.getenv("GRACHALLE_SERVICE_NAME", "grachalle")
+
+# ターンをプロファイルする割合（0～1、セッションごとに有効にする場合はGraChalleInterface.profileを使う）
+PROFILE_SAMPLE_RATE = float(os.getenv("GRACHALLE_PROFILE_SAMPLE_RATE", "0"))
+# スタックを採取する間隔（秒）とスタックファイルの出力先
+PROFILE_INTERVAL = float(os.getenv("GRACHALLE_PROFILE_INTERVAL", "0.005"))
+PROFILE_DIR = os.getenv("GRACHALLE_PROFILE_DIR", "profiles")
+# HTTPサーバーで、リクエストの指定（?profile=true）によるターンのプロファイルを受け付けるかどうか
+PROFILE_ON_REQUEST = os.getenv("GRACHALLE_PROFILE_ON_REQUEST", "false").lower() == "true"
+
+# スパンの種類（OpenTelemetryのSpanKind）とステータス
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+# -----------------------------------------------------#
+# スパン                                               #
+# -----------------------------------------------------#
+def _new_id(bits):
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+class Span:
+    """
+    処理の区間1つ分の記録。ID・時刻・属性はOpenTelemetryのスパンと同じ形で保持し、
+    終了時に出力用の待ち行列に入れます。
+    """
+
+    __slots__ = (
+        "name",
+        "kind",
+        "trace_id",
+        "span_id",
+        "parent_span_id",
+        "start_ns",
+        "end_ns",
+        "attributes",
+        "events",
+        "status",
+        "status_message",
+    )
+
+    def __init__(self, name, trace_id, parent_span_id=None, kind=SPAN_KIND_INTERNAL, attributes=None):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = _new_id(64)
+        self.parent_span_id = parent_span_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes or {}
+        self.events = []
+        self.status = None
+        self.status_message = ""
+
+    @property
+    def recording(self):
+        return True
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def add_event(self, name, **attributes):
+        self.events.append((name, time.time_ns(), attributes))
+
+    def set_error(self, message):
+        self.status = STATUS_ERROR
+        self.status_message = message
+
+    def record_exception(self, error):
+        self.add_event("exception", **{"exception.type": type(error).__name__, "exception.message": str(error)})
+        self.set_error(str(error))
+
+    def end(self):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        _get_processor().enqueue(self)
+
+    def to_otlp(self):
+        """OTLP/JSONのスパンの形に変換する"""
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": _otlp_attributes(self.attributes),
+        }
+        if self.parent_span_id:
+            span["parentSpanId"] = self.parent_span_id
+        if self.events:
+            span["events"] = [
+                {"name": name, "timeUnixNano": str(at), "attributes": _otlp_attributes(attributes)}
+                for name, at, attributes in self.events
+            ]
+        if self.status is not None:
+            span["status"] = {"code": self.status, "message": self.status_message}
+        return span
+
+
+class _NoopSpan:
+    """トレースが無効・サンプリング対象外の場合に返す、何も記録しないスパン（子のスパンも記録しない）"""
+
+    __slots__ = ()
+
+    recording = False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def add_event(self, name, **attributes):
+        pass
+
+    def set_error(self, message):
+        pass
+
+    def record_exception(self, error):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes):
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+# 現在処理中のスパン（asyncio.create_taskで生成したタスクにも引き継がれる）
+_current_span = contextvars.ContextVar("grachalle_current_span", default=None)
+
+
+def current_span():
+    return _current_span.get() or NOOP_SPAN
+
+
+def start_span(name, kind=SPAN_KIND_INTERNAL, **attributes):
+    """
+    スパンを開始します（終了はSpan.endを呼ぶ）。処理中のスパンがなければ新しいトレースとしてサンプリングし、
+    対象外の場合や処理中のスパンが記録対象外の場合はNOOP_SPANを返します。
+
+    Parameters:
+        name (str): スパン名
+        kind (int): スパンの種類（SPAN_KIND_*）
+        attributes: スパンの属性
+
+    Returns:
+        Span: 開始したスパン（記録しない場合はNOOP_SPAN）
+    """
+    if not TRACING_ENABLED:
+        return NOOP_SPAN
+    parent = _current_span.get()
+    if parent is None:
+        if random.random() >= TRACE_SAMPLE_RATE:
+            return NOOP_SPAN
+        return Span(name, _new_id(128), kind=kind, attributes=attributes)
+    if not parent.recording:
+        return NOOP_SPAN
+    return Span(name, parent.trace_id, parent.span_id, kind, attributes)
+
+
+def bind_span(span):
+    """以降の処理のスパンの親を設定する（戻り値はunbind_spanに渡す、トレースが無効の場合は何もしない）"""
+    if not TRACING_ENABLED:
+        return None
+    return _current_span.set(span)
+
+
+def unbind_span(token):
+    if token is not None:
+        _current_span.reset(token)
+
+
+class _SpanScope:
+    """withの区間をスパンとして記録し、区間内で開始したスパンの親にする"""
+
+    __slots__ = ("span", "_token")
+
+    def __init__(self, span):
+        self.span = span
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        if exc is not None and not isinstance(exc, GeneratorExit):
+            self.span.record_exception(exc)
+        self.span.end()
+        return False
+
+
+class _NoopScope:
+    __slots__ = ()
+
+    def __enter__(self):
+        return NOOP_SPAN
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SCOPE = _NoopScope()
+
+
+def span(name, kind=SPAN_KIND_INTERNAL, **attributes):
+    """
+    withの区間をスパンとして記録します（区間内でyieldしないこと。非同期ジェネレーターにはtraced_streamを使う）
+
+    例:
+        with span("intent.hear") as s:
+            result = await ...
+            s.set_attribute("outcome", "ok")
+    """
+    if not TRACING_ENABLED:
+        return _NOOP_SCOPE
+    started = start_span(name, kind, **attributes)
+    if not started.recording:
+        return _NOOP_SCOPE
+    return _SpanScope(started)
+
+
+def use_span(span):
+    """開始済みのスパンを、withの区間内で開始するスパンの親にする（区間の終了時にスパンは終了しない）"""
+    if not TRACING_ENABLED:
+        return _NOOP_SCOPE
+    return _ActiveSpan(span)
+
+
+class _ActiveSpan:
+    __slots__ = ("span", "_token")
+
+    def __init__(self, span):
+        self.span = span
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        return False
+
+
+def traced_stream(name, agen, kind=SPAN_KIND_INTERNAL, **attributes):
+    """
+    非同期ジェネレーターの開始から終了までをスパンとして記録します（最初の要素の時刻はイベントとして記録）。
+    同期ブリッジでは要素ごとに別タスクで進むため、スパンは要素を取り出すたびに親として設定します。
+    トレースが無効・記録対象外の場合は、ジェネレーターをそのまま返します。
+    """
+    if not TRACING_ENABLED:
+        return agen
+    started = start_span(name, kind, **attributes)
+    if not started.recording:
+        return agen
+    return _traced_stream(started, agen)
+
+
+async def _traced_stream(span, agen):
+    first = True
+    try:
+        while True:
+            token = _current_span.set(span)
+            try:
+                item = await agen.__anext__()
+            except StopAsyncIteration:
+                break
+            except Exception as e:
+                span.record_exception(e)
+                raise
+            finally:
+                _current_span.reset(token)
+            if first:
+                span.add_event("first_chunk")
+                first = False
+            yield item
+    finally:
+        await agen.aclose()
+        span.end()
+
+
+# -----------------------------------------------------#
+# スパンの出力                                         #
+# -----------------------------------------------------#
+def _resource():
+    return {
+        "attributes": _otlp_attributes(
+            {"service.name": SERVICE_NAME, "process.pid": os.getpid(), "host.name": os.uname().nodename}
+        )
+    }
+
+
+def encode_spans(spans):
+    """スパンのリストをOTLP/JSON（ExportTraceServiceRequest）の形に変換する"""
+    return {
+        "resourceSpans": [
+            {
+                "resource": _resource(),
+                "scopeSpans": [{"scope": {"name": "grachalle.tracing"}, "spans": [s.to_otlp() for s in spans]}],
+            }
+        ]
+    }
+
+
+class FileSpanExporter:
+    """OTLP/JSONを1行1バッチでファイルに追記する（OpenTelemetry Collectorのfileエクスポーターと同じ形式）"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def export(self, payload):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+
+
+class OTLPHttpSpanExporter:
+    """OTLP/HTTPのJSONエンコーディングでコレクターに送信する"""
+
+    def __init__(self, endpoint, timeout=5):
+        self.endpoint = endpoint
+        self.timeout = timeout
+
+    def export(self, payload):
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class BatchSpanProcessor:
+    """
+    終了したスパンを待ち行列にため、専用スレッドでまとめて出力します（呼び出し元はファイル・ネットワークを待たない）。
+    待ち行列があふれた場合は破棄し、件数をメトリクスに記録します。
+    """
+
+    MAX_BATCH = 512
+
+    def __init__(self, exporters, interval=TRACE_EXPORT_INTERVAL, max_queue=TRACE_MAX_QUEUE):
+        self.exporters = exporters
+        self.interval = interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._flush = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="grachalle-trace-export", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            record_spans("dropped")
+            return
+        if self._queue.qsize() >= self.MAX_BATCH:
+            self._flush.set()
+
+    def _drain(self):
+        spans = []
+        while len(spans) < self.MAX_BATCH:
+            try:
+                spans.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return spans
+
+    def _export(self, spans):
+        payload = encode_spans(spans)
+        for exporter in self.exporters:
+            try:
+                exporter.export(payload)
+            except Exception as e:
+                logger.warning("スパンの出力に失敗しました: %s: %s", type(exporter).__name__, e)
+        record_spans("exported", len(spans))
+
+    def _run(self):
+        while True:
+            self._flush.wait(self.interval)
+            self._flush.clear()
+            self.flush()
+
+    def flush(self):
+        """待ち行列のスパンをすべて出力する（出力スレッドと終了時の呼び出しが重ならないようにする）"""
+        with self._lock:
+            while True:
+                spans = self._drain()
+                if not spans:
+                    return
+                self._export(spans)
+
+
+_processor = None
+_processor_lock = threading.Lock()
+
+
+def _get_processor():
+    """プロセス共有のスパンの出力処理を取得する（初回のスパンの終了時に出力先を開く）"""
+    global _processor
+    if _processor is None:
+        with _processor_lock:
+            if _processor is None:
+                exporters = []
+                if TRACE_EXPORT_PATH:
+                    exporters.append(FileSpanExporter(TRACE_EXPORT_PATH))
+                if TRACE_OTLP_ENDPOINT:
+                    exporters.append(OTLPHttpSpanExporter(TRACE_OTLP_ENDPOINT))
+                _processor = BatchSpanProcessor(exporters)
+                atexit.register(_processor.flush)
+    return _processor
+
+
+def flush_spans():
+    """出力待ちのスパンをすべて出力する（テスト・バッチ処理の終了時向け）"""
+    if _processor is not None:
+        _processor.flush()
+
+
+# -----------------------------------------------------#
+# サンプリングプロファイラー                           #
+# -----------------------------------------------------#
+class SamplingProfiler:
+    """
+    指定したスレッドのスタックを一定間隔で採取し、フレームグラフ用のスタックファイル
+    （flamegraph.pl・speedscope・inferno向けの折りたたみ形式: `a;b;c 回数`）に出力します。
+    採取は専用スレッドで行うため、対象のスレッドにはスタックの取得以外の負荷をかけません。
+    イベントループのスレッドを対象にした場合、同時に処理中の他のセッションのスタックも含まれ、
+    LLMの応答待ちの時間はセレクター（select/epoll）の待ちとして表れます。
+    """
+
+    def __init__(self, path, thread_id=None, interval=PROFILE_INTERVAL):
+        self.path = path
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.samples = 0
+        self._stacks = defaultdict(int)
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _frame_label(frame):
+        code = frame.f_code
+        # 折りたたみ形式では";"がフレームの区切りになる
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+    def _sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+        labels = []
+        while frame is not None:
+            labels.append(self._frame_label(frame))
+            frame = frame.f_back
+        self._stacks[";".join(reversed(labels))] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+        self._write()
+
+    def _write(self):
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as f:
+                for stack, count in sorted(self._stacks.items()):
+                    f.write(f"{stack} {count}\n")
+        except OSError as e:
+            logger.warning("スタックファイルを出力できませんでした: %s: %s", self.path, e)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="grachalle-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """採取を終了する（ファイルへの出力は採取用のスレッドで行い、呼び出し元を待たせない）"""
+        self._stop.set()
+        return self.path
+
+
+def start_profile(label, forced=False):
+    """
+    設定した割合（forcedがTrueの場合は必ず）で、現在のスレッドのプロファイルを開始します
+
+    Parameters:
+        label (str): スタックファイル名の接頭辞（セッションIDなど）
+        forced (bool): 割合に関係なくプロファイルするかどうか
+
+    Returns:
+        SamplingProfiler: 開始したプロファイラー（対象外の場合はNone）
+    """
+    if not forced and (PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE):
+        return None
+    path = os.path.join(PROFILE_DIR, f"{label}-{time.strftime('%Y%m%d-%H%M%S')}-{_new_id(32)}.folded")
+    return SamplingProfiler(path).start()
+
+
+# -----------------------------------------------------#
+# 検証用のコレクターと集計                             #
+# -----------------------------------------------------#
+def _collector_handler(output):
+    lock = threading.Lock()
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path.split("?")[0] != "/v1/traces":
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                self.send_response(400)
+                self.end_headers()
+                return
+            with lock, open(output, "a", encoding="utf-8") as f:
+                f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, format, *args):
+            pass
+
+    return _Handler
+
+
+def run_collector(port, output, host="127.0.0.1"):
+    """OTLP/HTTP（JSON）で受け取ったスパンをファイルに追記する、コレクターの代わりのサーバーを起動する"""
+    server = ThreadingHTTPServer((host, port), _collector_handler(output))
+    logger.info("スパンを受け付けます: http://%s:%s/v1/traces -> %s", host, server.server_address[1], output)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def load_spans(path):
+    """OTLP/JSONのファイルからスパンを読み込む"""
+    spans = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            for resource_spans in json.loads(line).get("resourceSpans", []):
+                for scope_spans in resource_spans.get("scopeSpans", []):
+                    spans.extend(scope_spans.get("spans", []))
+    return spans
+
+
+def summarize_spans(spans):
+    """
+    スパン名ごとの件数・所要時間・自身の時間（直下の子のスパンを除いた時間）を集計します
+
+    Returns:
+        list[dict]: 自身の時間の合計が大きい順の集計
+    """
+    durations = {s["spanId"]: (int(s["endTimeUnixNano"]) - int(s["startTimeUnixNano"])) / 1e6 for s in spans}
+    children = defaultdict(float)
+    for s in spans:
+        if s.get("parentSpanId") in durations:
+            children[s["parentSpanId"]] += durations[s["spanId"]]
+    by_name = defaultdict(lambda: {"durations": [], "self": 0.0, "errors": 0})
+    for s in spans:
+        entry = by_name[s["name"]]
+        entry["durations"].append(durations[s["spanId"]])
+        # 並行に動く子のスパンがある場合は自身の時間を0とみなす
+        entry["self"] += max(durations[s["spanId"]] - children[s["spanId"]], 0.0)
+        if s.get("status", {}).get("code") == STATUS_ERROR:
+            entry["errors"] += 1
+    rows = []
+    for name, entry in by_name.items():
+        values = sorted(entry["durations"])
+        rows.append(
+            {
+                "name": name,
+                "count": len(values),
+                "errors": entry["errors"],
+                "p50_ms": statistics.median(values),
+                "p95_ms": values[min(int(len(values) * 0.95), len(values) - 1)],
+                "total_ms": sum(values),
+                "self_ms": entry["self"],
+            }
+        )
+    return sorted(rows, key=lambda row: row["self_ms"], reverse=True)
+
+
+def format_trace(spans, trace_id):
+    """1つのトレースのスパンを親子関係の木として整形する"""
+    members = [s for s in spans if s["traceId"] == trace_id]
+    ids = {s["spanId"] for s in members}
+    children = defaultdict(list)
+    for s in members:
+        children[s.get("parentSpanId") if s.get("parentSpanId") in ids else None].append(s)
+    origin = min(int(s["startTimeUnixNano"]) for s in members)
+    lines = []
+
+    def _walk(parent, depth):
+        for s in sorted(children[parent], key=lambda s: int(s["startTimeUnixNano"])):
+            offset = (int(s["startTimeUnixNano"]) - origin) / 1e6
+            duration = (int(s["endTimeUnixNano"]) - int(s["startTimeUnixNano"])) / 1e6
+            error = " ERROR" if s.get("status", {}).get("code") == STATUS_ERROR else ""
+            lines.append(f"{'  ' * depth}{s['name']:<{48 - 2 * depth}} +{offset:>9.1f} ms {duration:>9.1f} ms{error}")
+            _walk(s["spanId"], depth + 1)
+
+    _walk(None, 0)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="トレースの受信（コレクターの代わり）と集計")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    collect = subparsers.add_parser("collect", help="OTLP/HTTP（JSON）でスパンを受け付けてファイルに追記する")
+    collect.add_argument("--host", default="127.0.0.1")
+    collect.add_argument("--port", type=int, default=4318)
+    collect.add_argument("--output", default="traces.jsonl", help="スパンを追記するファイル")
+    summarize = subparsers.add_parser("summarize", help="スパン名ごとの所要時間を集計する")
+    summarize.add_argument("path", nargs="?", default=TRACE_EXPORT_PATH or "traces.jsonl")
+    summarize.add_argument("--slowest", type=int, default=1, help="木として表示する遅いトレースの数")
+    args = parser.parse_args()
+
+    if args.command == "collect":
+        run_collector(args.port, args.output, args.host)
+        sys.exit(0)
+
+    loaded = load_spans(args.path)
+    if not loaded:
+        sys.exit(f"スパンがありません: {args.path}")
+    print(f"{'span':<40}{'count':>7}{'errors':>7}{'p50 ms':>10}{'p95 ms':>10}{'total ms':>12}{'self ms':>12}")
+    for row in summarize_spans(loaded):
+        print(
+            f"{row['name']:<40}{row['count']:>7}{row['errors']:>7}{row['p50_ms']:>10.1f}"
+            f"{row['p95_ms']:>10.1f}{row['total_ms']:>12.1f}{row['self_ms']:>12.1f}"
+        )
+    roots = sorted(
+        (s for s in loaded if not s.get("parentSpanId")),
+        key=lambda s: int(s["endTimeUnixNano"]) - int(s["startTimeUnixNano"]),
+        reverse=True,
+    )
+    for root in roots[: args.slowest]:
+        print(f"\ntrace {root['traceId']}")
+        print(format_trace(loaded, root["traceId"]))
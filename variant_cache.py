@@ -0,0 +1,222 @@
+# variant_cache.py
+import argparse
+import asyncio
+import atexit
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from common import logger
+from fast_intent import canonicalize_language, canonicalize_level
+
+# 1キーあたりに保持する生成済みバリエーション数
+VARIANTS_PER_KEY = int(os.getenv("GRACHALLE_VARIANTS_PER_KEY", "3"))
+# バリエーションの有効期限（秒）
+VARIANT_TTL = float(os.getenv("GRACHALLE_VARIANT_TTL", "86400"))
+# 保持する(言語, 難易度)の組み合わせの上限
+VARIANT_MAX_KEYS = int(os.getenv("GRACHALLE_VARIANT_MAX_KEYS", "256"))
+# ディスクに保存する場合のディレクトリ（未指定の場合はメモリのみ）
+VARIANT_CACHE_DIR = os.getenv("GRACHALLE_VARIANT_CACHE_DIR")
+# 追加してからディスクに書き出すまでの待ち時間（秒）。この間の追加はまとめて1回で書き出す
+VARIANT_SAVE_DELAY = float(os.getenv("GRACHALLE_VARIANT_SAVE_DELAY", "1.0"))
+# バリエーションを生成するときの温度（同じ文面ばかりにならないようにする）
+VARIANT_TEMPERATURE = 0.7
+
+# デプロイ時のウォームアップで事前生成する組み合わせ
+COMMON_LANGUAGES = ["英語", "フランス語", "ドイツ語", "スペイン語", "中国語", "韓国語"]
+COMMON_LEVELS = ["初級", "中級", "上級"]
+
+
+# -----------------------------------------------------#
+# (言語, 難易度)単位のバリエーションキャッシュ         #
+# -----------------------------------------------------#
+class VariantCache:
+    """
+    出題言語と難易度だけで決まるLLM出力（確認メッセージ・試験官の第一声）を、
+    正規化したキーごとに最大N件のバリエーションとして保持するキャッシュ。
+    TTLとLRUで古いキーを破棄し、必要に応じてJSONファイルに永続化します。
+    ファイルへの書き出しは追加から一定時間後に別スレッドでまとめて行い、呼び出し元（イベントループ）を待たせません。
+    """
+
+    def __init__(
+        self,
+        name,
+        variants_per_key=VARIANTS_PER_KEY,
+        ttl=VARIANT_TTL,
+        max_keys=VARIANT_MAX_KEYS,
+        path=None,
+        save_delay=VARIANT_SAVE_DELAY,
+    ):
+        """
+        Parameters:
+            name (str): キャッシュ名（ログ出力用）
+            variants_per_key (int): 1キーあたりに保持するバリエーション数
+            ttl (float): バリエーションの有効期限（秒）
+            max_keys (int): 保持するキーの上限（超えた場合は最も使われていないキーを破棄）
+            path (str): 永続化先のJSONファイル（Noneの場合はメモリのみ）
+            save_delay (float): 追加してからファイルに書き出すまでの待ち時間（秒）
+        """
+        self.name = name
+        self.variants_per_key = variants_per_key
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.path = path
+        self.save_delay = save_delay
+        self._entries = OrderedDict()  # key -> list[(created_at, text)]
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._save_timer = None
+        # 書き出しが同時に走らないようにする（保存用のタイマーと終了時の書き出し）
+        self._save_lock = threading.Lock()
+        if path:
+            self._load()
+            # 終了時に未保存の追加を書き出す
+            atexit.register(self.flush)
+
+    @staticmethod
+    def make_key(language, level):
+        """表記ゆれを吸収した(言語, 難易度)のキーを作る"""
+        return f"{canonicalize_language(language)}|{canonicalize_level(level)}"
+
+    def _fresh_variants(self, key, now):
+        """期限切れのバリエーションを取り除いて返す（ロック取得済みの前提）"""
+        variants = [(created, text) for created, text in self._entries.get(key, []) if now - created < self.ttl]
+        if variants:
+            self._entries[key] = variants
+        else:
+            self._entries.pop(key, None)
+        return variants
+
+    def get(self, language, level):
+        """
+        バリエーションが揃っているキーであれば、その中から1件を無作為に返します。
+
+        Returns:
+            str: キャッシュ済みのテキスト（未充足の場合はNone）
+        """
+        key = self.make_key(language, level)
+        with self._lock:
+            variants = self._fresh_variants(key, time.time())
+            if len(variants) < self.variants_per_key:
+                return None
+            self._entries.move_to_end(key)
+            return random.choice(variants)[1]
+
+    def missing(self, language, level):
+        """キーに不足しているバリエーション数を返す"""
+        key = self.make_key(language, level)
+        with self._lock:
+            return max(self.variants_per_key - len(self._fresh_variants(key, time.time())), 0)
+
+    def add(self, language, level, text):
+        """
+        生成したテキストをバリエーションとして追加します（上限に達している場合は最も古いものと入れ替え）
+        """
+        if not text:
+            return
+        key = self.make_key(language, level)
+        with self._lock:
+            variants = self._fresh_variants(key, time.time())
+            variants.append((time.time(), text))
+            self._entries[key] = variants[-self.variants_per_key :]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+            if self.path:
+                self._dirty = True
+                self._schedule_save()
+
+    def _schedule_save(self):
+        """書き出しを予約する（予約済みの場合は何もしない、ロック取得済みの前提）"""
+        if self._save_timer is not None:
+            return
+        self._save_timer = threading.Timer(self.save_delay, self.flush)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+    def _load(self):
+        """永続化したバリエーションを読み込む"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            for key, variants in data.items():
+                self._entries[key] = [(created, text) for created, text in variants]
+            logger.info("%sキャッシュを読み込みました: %s件", self.name, len(self._entries))
+        except (OSError, ValueError) as e:
+            logger.error("%sキャッシュの読み込みに失敗しました: %s", self.name, e)
+
+    def flush(self):
+        """未保存の追加があれば、バリエーションをJSONファイルに書き出す"""
+        with self._save_lock:
+            with self._lock:
+                self._save_timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+                # 書き出しの間も追加・参照を止めないよう、複製してからロックを外す
+                snapshot = {key: list(variants) for key, variants in self._entries.items()}
+            tmp_path = f"{self.path}.tmp"
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(snapshot, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.error("%sキャッシュの保存に失敗しました: %s", self.name, e)
+
+
+def _cache_path(filename):
+    return os.path.join(VARIANT_CACHE_DIR, filename) if VARIANT_CACHE_DIR else None
+
+
+_confirmation_cache = VariantCache("確認メッセージ", path=_cache_path("confirmation.json"))
+_opener_cache = VariantCache("試験官の第一声", path=_cache_path("opener.json"))
+
+
+def get_confirmation_cache():
+    """確認メッセージのプロセス共有キャッシュを取得する"""
+    return _confirmation_cache
+
+
+def get_opener_cache():
+    """試験官の第一声のプロセス共有キャッシュを取得する"""
+    return _opener_cache
+
+
+# -----------------------------------------------------#
+# ウォームアップ                                       #
+# -----------------------------------------------------#
+async def warm_up(languages=COMMON_LANGUAGES, levels=COMMON_LEVELS):
+    """
+    よく使われる(言語, 難易度)の組み合わせについて、不足しているバリエーションを事前生成します。
+    """
+    from examination import ConversationalChat
+    from intent import IntentExtract
+
+    intent_extract = IntentExtract()
+    examination = ConversationalChat()
+
+    async def _fill(language, level):
+        for _ in range(_confirmation_cache.missing(language, level)):
+            await intent_extract.generate_confirmation_async(language, level)
+        for _ in range(_opener_cache.missing(language, level)):
+            await examination.generate_opener(language, level)
+
+    await asyncio.gather(*[_fill(language, level) for language in languages for level in levels])
+    logger.info("バリエーションキャッシュのウォームアップが完了しました")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="確認メッセージと試験官の第一声を事前生成します")
+    parser.add_argument("--languages", nargs="+", default=COMMON_LANGUAGES, help="事前生成する出題言語")
+    parser.add_argument("--levels", nargs="+", default=COMMON_LEVELS, help="事前生成する出題難易度")
+    args = parser.parse_args()
+
+    if not VARIANT_CACHE_DIR:
+        logger.warning("GRACHALLE_VARIANT_CACHE_DIRが未設定のため、生成結果はプロセス終了時に破棄されます")
+    asyncio.run(warm_up(args.languages, args.levels))